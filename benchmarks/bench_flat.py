@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, division, print_function
+
+"""
+Serialization benchmark of the classes generated with ROSIMPORT_FLAT, against the genpy ones.
+
+The geometry_msgs/Pose and nav_msgs/Odometry definitions are written in a temporary workspace,
+their genpy classes are imported through RosImporter, and their flat classes are generated from the same definitions.
+serialize() and deserialize() of both are timed, results are emitted as JSON, to compare versions :
+
+  $ python benchmarks/bench_flat.py --number 20000 --repeat 20 -o results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+from io import BytesIO
+
+ROSIMPORT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFINITIONS = {
+    'std_msgs/Header': 'uint32 seq\ntime stamp\nstring frame_id\n',
+    'geometry_msgs/Point': 'float64 x\nfloat64 y\nfloat64 z\n',
+    'geometry_msgs/Quaternion': 'float64 x\nfloat64 y\nfloat64 z\nfloat64 w\n',
+    'geometry_msgs/Vector3': 'float64 x\nfloat64 y\nfloat64 z\n',
+    'geometry_msgs/Pose': 'Point position\nQuaternion orientation\n',
+    'geometry_msgs/PoseWithCovariance': 'Pose pose\nfloat64[36] covariance\n',
+    'geometry_msgs/Twist': 'Vector3 linear\nVector3 angular\n',
+    'geometry_msgs/TwistWithCovariance': 'Twist twist\nfloat64[36] covariance\n',
+    'nav_msgs/Odometry': (
+        'std_msgs/Header header\nstring child_frame_id\n'
+        'geometry_msgs/PoseWithCovariance pose\ngeometry_msgs/TwistWithCovariance twist\n'
+    ),
+}
+
+
+def generate_workspace(workspace):
+    """Writes the message definitions in a ROS workspace"""
+    for type_, definition in DEFINITIONS.items():
+        package, name = type_.split('/')
+        msgdir = os.path.join(workspace, package, 'msg')
+        if not os.path.exists(msgdir):
+            os.makedirs(msgdir)
+        with open(os.path.join(msgdir, name + '.msg'), 'w') as f:
+            f.write(definition)
+
+
+def flat_class(workspace, type_):
+    """Generates the class of a message type with ROSIMPORT_FLAT"""
+    import rosimport
+    package, name = type_.split('/')
+    sources = rosimport.genrosmsg_py_sources(
+        [os.path.join(workspace, package, 'msg', name + '.msg')], package + '.msg',
+        search_path={p: [os.path.join(workspace, p, 'msg')] for p in ['std_msgs', 'geometry_msgs']}, flat=True
+    )
+    namespace = {'__name__': '{0}.msg._{1}'.format(package, name)}
+    exec(compile(sources['_' + name], name, 'exec'), namespace)
+    return namespace[name]
+
+
+def odometry(cls):
+    msg = cls()
+    msg.header.seq = 42
+    msg.header.stamp.secs, msg.header.stamp.nsecs = 1500000000, 123456789
+    msg.header.frame_id = 'odom'
+    msg.child_frame_id = 'base_link'
+    msg.pose.pose.position.x, msg.pose.pose.position.y = 1.5, -2.5
+    msg.pose.pose.orientation.w = 1.0
+    msg.pose.covariance = [0.01 * i for i in range(36)]
+    msg.twist.twist.linear.x = 0.5
+    msg.twist.covariance = [0.02 * i for i in range(36)]
+    return msg
+
+
+def pose(cls):
+    msg = cls()
+    msg.position.x, msg.position.y, msg.position.z = 1.5, -2.5, 0.25
+    msg.orientation.z, msg.orientation.w = 0.7071, 0.7071
+    return msg
+
+
+def methods(msg):
+    """
+    Returns the functions calling serialize() and deserialize() for a message.
+    The message and the stream are reused, their construction, the same for both classes, is not measured.
+    """
+    buff = BytesIO()
+    msg.serialize(buff)
+    data = buff.getvalue()
+    decoded = type(msg)()
+    decoded.deserialize(data)
+
+    def serialize():
+        buff.seek(0)
+        msg.serialize(buff)
+
+    def deserialize():
+        decoded.deserialize(data)
+
+    return {'serialize_us': serialize, 'deserialize_us': deserialize}
+
+
+def time_methods(variants, number, repeat):
+    """
+    Times the methods of message variants, alternating between them, so they are measured in the same conditions.
+    :param variants: a dict {variant name: message}
+    :return: a dict {variant name: {method: best time, in microseconds}}
+    """
+    functions = {name: methods(msg) for name, msg in variants.items()}
+    times = {name: {method: [] for method in functions[name]} for name in functions}
+    for _ in range(repeat):
+        for name in sorted(functions):
+            for method, function in functions[name].items():
+                times[name][method].append(timeit.timeit(function, number=number) / number * 1e6)
+    return {name: {method: min(t) for method, t in times[name].items()} for name in times}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='rosimport flat serialization benchmark')
+    parser.add_argument('--number', type=int, default=10000, help='number of calls per measure')
+    parser.add_argument('--repeat', type=int, default=20, help='number of measures, the best one is kept')
+    parser.add_argument('-o', '--output', default=None, help='JSON output file, defaults to stdout')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, ROSIMPORT_ROOT)
+    import rosimport
+    import rosimport._version
+
+    tmpdir = tempfile.mkdtemp('rosimport_bench')
+    try:
+        workspace = os.path.join(tmpdir, 'ws')
+        generate_workspace(workspace)
+        sys.path.insert(0, workspace)
+        os.environ['ROSIMPORT_CACHE_DIR'] = os.path.join(tmpdir, 'cache')
+
+        results = {
+            'config': {'number': args.number, 'repeat': args.repeat},
+            'rosimport_version': rosimport._version.__version__,
+            'python': '{0} {1}'.format(platform.python_implementation(), platform.python_version()),
+            'platform': platform.platform(),
+        }
+        with rosimport.RosImporter():
+            from geometry_msgs.msg import Pose
+            from nav_msgs.msg import Odometry
+            for type_, cls, make in [('geometry_msgs/Pose', Pose, pose), ('nav_msgs/Odometry', Odometry, odometry)]:
+                times = time_methods(
+                    {'genpy': make(cls), 'flat': make(flat_class(workspace, type_))}, args.number, args.repeat
+                )
+                # how many times faster the flat classes are
+                times['speedup'] = {k: times['genpy'][k] / times['flat'][k] for k in times['genpy']}
+                results[type_] = times
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
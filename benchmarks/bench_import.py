@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, division, print_function
+
+"""
+Import latency benchmark for rosimport, on synthetic ROS workspaces.
+
+A workspace of N packages with M messages each is generated.
+Packages are organised in layers (the dependency depth), messages of one layer depending on messages
+from F packages of the layer below (the fan-out). Packages can also have a nested subpkg/msg,
+like tests/test_rosimport/subtests.
+
+Each measure runs in a fresh interpreter, importing all message packages through RosImporter :
+- cold : with an empty generation cache,
+- warm : with the cache filled by a previous run.
+
+Results (latency, peak RSS, rosimport.stats()) are emitted as JSON, to compare versions :
+
+  $ python benchmarks/bench_import.py --packages 20 --messages 10 --depth 3 --fanout 2 -o results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+ROSIMPORT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PRIMITIVES = ['bool', 'int32', 'float64', 'string', 'uint8[]', 'time']
+
+
+def package_name(index):
+    return 'bench_pkg_{0}'.format(index)
+
+
+def generate_workspace(workspace, packages, messages, depth, fanout, nested):
+    """
+    Generates a synthetic ROS workspace.
+    :return: the list of python modules to import
+    """
+    layers = max(depth, 1)
+    layer_packages = [[i for i in range(packages) if i % layers == layer] for layer in range(layers)]
+    modules = []
+    for i in range(packages):
+        layer = i % layers
+        msgdir = os.path.join(workspace, package_name(i), 'msg')
+        os.makedirs(msgdir)
+        with open(os.path.join(workspace, package_name(i), 'package.xml'), 'w') as f:
+            f.write('<package><name>{0}</name></package>\n'.format(package_name(i)))
+        # depending on the layer below, spreading the dependencies over its packages
+        below = layer_packages[layer - 1] if layer > 0 else []
+        dependencies = [below[(i + k) % len(below)] for k in range(min(fanout, len(below)))] if below else []
+        for m in range(messages):
+            with open(os.path.join(msgdir, 'Msg{0}.msg'.format(m)), 'w') as f:
+                for p, primitive in enumerate(PRIMITIVES):
+                    f.write('{0} field_{1}\n'.format(primitive, p))
+                for d in dependencies:
+                    f.write('{0}/Msg{1} dep_{2}\n'.format(package_name(d), m % messages, d))
+                if m > 0:  # same package dependency
+                    f.write('Msg{0} previous\n'.format(m - 1))
+        modules.append(package_name(i) + '.msg')
+
+        if nested:
+            subdir = os.path.join(workspace, package_name(i), 'subpkg', 'msg')
+            os.makedirs(subdir)
+            for m in range(max(messages // 2, 1)):
+                with open(os.path.join(subdir, 'SubMsg{0}.msg'.format(m)), 'w') as f:
+                    for p, primitive in enumerate(PRIMITIVES):
+                        f.write('{0} field_{1}\n'.format(primitive, p))
+            modules.append(package_name(i) + '.subpkg.msg')
+    return modules
+
+
+def run_import(workspace, modules):
+    """Imports the modules through RosImporter, in this interpreter. Returns the measures."""
+    start = timeit.default_timer()
+    import importlib
+    import rosimport
+    import_rosimport = timeit.default_timer() - start
+
+    sys.path.insert(0, workspace)
+    classes = 0
+    start = timeit.default_timer()
+    with rosimport.RosImporter():
+        for m in modules:
+            mod = importlib.import_module(m)
+            # getting all classes, so lazy imports are measured as well
+            for name in getattr(mod, '__all__', []):
+                getattr(mod, name)
+                classes += 1
+    elapsed = timeit.default_timer() - start
+
+    try:
+        import resource
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes elsewhere
+        peak_rss_kb = peak_rss // 1024 if sys.platform == 'darwin' else peak_rss
+    except ImportError:  # windows
+        peak_rss_kb = None
+
+    return {
+        'import_rosimport_s': import_rosimport,
+        'import_s': elapsed,
+        'modules': len(modules),
+        'classes': classes,
+        'peak_rss_kb': peak_rss_kb,
+        # versions before rosimport.stats() report no counters
+        'stats': getattr(rosimport, 'stats', lambda: None)(),
+    }
+
+
+def measure(workspace, modules, cache_dir, env=None):
+    """Runs one import in a fresh interpreter"""
+    env = dict(os.environ if env is None else env)
+    env['ROSIMPORT_CACHE_DIR'] = cache_dir
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--run-import', workspace] + modules,
+        env=env
+    )
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def summary(runs, key='import_s'):
+    values = sorted(r[key] for r in runs if r.get(key) is not None)
+    if not values:
+        return None
+    return {
+        'min': values[0],
+        'median': values[len(values) // 2],
+        'max': values[-1],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='rosimport import latency benchmark')
+    parser.add_argument('--packages', type=int, default=10, help='number of packages')
+    parser.add_argument('--messages', type=int, default=10, help='number of messages per package')
+    parser.add_argument('--depth', type=int, default=3, help='depth of the dependency graph between packages')
+    parser.add_argument('--fanout', type=int, default=2, help='number of packages each package depends on')
+    parser.add_argument('--nested', action='store_true', help='add a nested subpkg/msg to each package')
+    parser.add_argument('--repeat', type=int, default=3, help='number of cold and warm runs')
+    parser.add_argument('-o', '--output', default=None, help='JSON output file, defaults to stdout')
+    parser.add_argument('--run-import', nargs='+', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_import:
+        print(json.dumps(run_import(args.run_import[0], args.run_import[1:])))
+        return 0
+
+    tmpdir = tempfile.mkdtemp('rosimport_bench')
+    try:
+        workspace = os.path.join(tmpdir, 'ws')
+        modules = generate_workspace(workspace, args.packages, args.messages, args.depth, args.fanout, args.nested)
+        env = dict(os.environ)
+        # benchmarking the rosimport from this source tree
+        env['PYTHONPATH'] = os.pathsep.join([ROSIMPORT_ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+        # the fallback generation code goes in per process directories, in our temporary directory
+        env['TMPDIR'] = tmpdir
+
+        cold, warm = [], []
+        for r in range(args.repeat):
+            cache_dir = os.path.join(tmpdir, 'cache{0}'.format(r))
+            cold.append(measure(workspace, modules, cache_dir, env))
+            warm.append(measure(workspace, modules, cache_dir, env))
+
+        sys.path.insert(0, ROSIMPORT_ROOT)
+        import rosimport._version
+        results = {
+            'config': {
+                'packages': args.packages,
+                'messages': args.messages,
+                'depth': args.depth,
+                'fanout': args.fanout,
+                'nested': args.nested,
+                'repeat': args.repeat,
+            },
+            'rosimport_version': rosimport._version.__version__,
+            'python': '{0} {1}'.format(platform.python_implementation(), platform.python_version()),
+            'platform': platform.platform(),
+            'summary': {
+                'cold_import_s': summary(cold),
+                'warm_import_s': summary(warm),
+                'cold_peak_rss_kb': summary(cold, 'peak_rss_kb'),
+                'warm_peak_rss_kb': summary(warm, 'peak_rss_kb'),
+            },
+            'cold': cold,
+            'warm': warm,
+        }
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,12 +10,23 @@ from ._ros_generator import (
     MsgDependencyNotFound,
     genrosmsg_py,
     genrossrv_py,
+    genrosmsg_py_sources,
+    genrossrv_py_sources,
 )
 
 from ._rosdef_loader import ROSMsgLoader, ROSSrvLoader, ros_import_search_path
 
 from ._ros_directory_finder import get_supported_ros_loaders, ROSDirectoryFinder, ROSPathFinder
 
+from ._ros_warm_up import RosWarmUp
+
+from ._ros_codec import MessagePool, deserialize_batch, lazy_class, message_dtype, message_plan
+
+from ._stats import stats, reset_stats
+
+if sys.version_info >= (3, 5):
+    from ._ros_async import import_async, import_all_async
+
 from ._utils import _verbose_message
 
 ros_path_hook = ROSDirectoryFinder.path_hook(*get_supported_ros_loaders())
@@ -25,13 +36,27 @@ py3importer = filefinder2.Py3Importer()
 
 
 class RosImporter(filefinder2.Py3Importer):
-    def __init__(self):
+    # seconds to wait for the warm-up worker to finish generating its current package, when exiting
+    warm_up_timeout = 10
+
+    def __init__(self, warm_up=None):
+        """
+        :param warm_up: whether to generate the ROS packages found on sys.path and ROS_PACKAGE_PATH in the background,
+        while the importer is active. defaults to the ROSIMPORT_WARM_UP environment variable.
+        """
         super(RosImporter, self).__init__()
+        self.warm_up = bool(os.environ.get('ROSIMPORT_WARM_UP')) if warm_up is None else warm_up
+        self.warm_up_worker = None
+        # the worker of an outer importer, restored on exit
+        self._outer_warm_up = None
+        # the hooks installed by this importer, and not by an outer one : (path hook, meta path hook)
+        self._installed_hooks = (False, False)
 
     def __enter__(self):
         # We should plug filefinder first to avoid plugging ROSDirectoryFinder, when it is not a ROS thing...
         super(RosImporter, self).__enter__()
 
+        self._installed_hooks = (ros_path_hook not in sys.path_hooks, ROSPathFinder not in sys.meta_path)
         if ros_path_hook not in sys.path_hooks:
             # We need to be before FileFinder to be able to find our '.msg' and '.srv' files without making a namespace package
             # Note this must be early in the path_hook list, since we change the logic
@@ -44,22 +69,54 @@ class RosImporter(filefinder2.Py3Importer):
             pf2_idx = sys.meta_path.index(filefinder2.PathFinder)
             sys.meta_path.insert(pf2_idx, ROSPathFinder)
 
+        # names we could not find before might be findable now
+        ROSPathFinder.invalidate_caches()
+
+        # generating ahead of imports is pointless when the generated code is not stored in the cache
+        if self.warm_up and ROSMsgLoader.rosimport_cachedir is not False and not ROSMsgLoader.rosimport_in_memory:
+            self.warm_up_worker = RosWarmUp(
+                cache_dir=ROSMsgLoader.rosimport_cachedir, numpy=ROSMsgLoader.rosimport_numpy,
+                flat=ROSMsgLoader.rosimport_flat,
+            )
+            self._outer_warm_up = ROSMsgLoader.rosimport_warm_up
+            ROSMsgLoader.rosimport_warm_up = ROSSrvLoader.rosimport_warm_up = self.warm_up_worker
+            self.warm_up_worker.start()
+
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.warm_up_worker is not None:
+            # the package being generated is finished before the hooks are removed
+            if not self.warm_up_worker.stop(timeout=self.warm_up_timeout):
+                _verbose_message("rosimport warm-up: still generating after {0}s", self.warm_up_timeout)
+            ROSMsgLoader.rosimport_warm_up = ROSSrvLoader.rosimport_warm_up = self._outer_warm_up
+            self.warm_up_worker, self._outer_warm_up = None, None
+
         # CAREFUL : Even though we remove the path from sys.path,
         # initialized finders will remain in sys.path_importer_cache (until cache is cleared by parent class)
 
-        # removing metahook
-        pf2_idx = sys.meta_path.index(ROSPathFinder)
-        sys.meta_path.pop(pf2_idx)
-        # removing path_hook
-        ff2_idx = sys.path_hooks.index(ros_path_hook)
-        sys.path_hooks.pop(ff2_idx)
+        # removing the hooks, unless an outer importer is still using them
+        installed_path_hook, installed_meta_path_hook = self._installed_hooks
+        if installed_meta_path_hook:
+            pf2_idx = sys.meta_path.index(ROSPathFinder)
+            sys.meta_path.pop(pf2_idx)
+        if installed_path_hook:
+            ff2_idx = sys.path_hooks.index(ros_path_hook)
+            sys.path_hooks.pop(ff2_idx)
 
         super(RosImporter, self).__exit__(exc_type, exc_val, exc_tb)
 
 
 __all__ = [
+    'MessagePool',
     'MsgDependencyNotFound',
     'ROSMsgLoader',
     'ROSSrvLoader',
+    'deserialize_batch',
+    'lazy_class',
+    'message_dtype',
+    'message_plan',
+    'stats',
+    'reset_stats',
 ]
+
+if sys.version_info >= (3, 5):
+    __all__ += ['import_async', 'import_all_async']
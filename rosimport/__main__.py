@@ -0,0 +1,82 @@
+from __future__ import absolute_import, division, print_function
+
+"""
+Command line interface for rosimport.
+
+  python -m rosimport compile [-o SITEDIR] [--cache-dir CACHE_DIR] [-j JOBS] [--numpy] [--flat] ROOT [ROOT ...]
+
+generates the python code for all the ROS definitions found in workspaces or package roots,
+ahead of time, and reports the time spent on each package.
+"""
+
+import argparse
+import multiprocessing
+import sys
+import timeit
+
+from rosimport._ros_compiler import find_rosdef_packages, compile_rosdef_packages
+
+
+def compile_command(args):
+    packages = find_rosdef_packages(args.roots)
+    if not packages:
+        print("no ROS definitions found in {0}".format(', '.join(args.roots)), file=sys.stderr)
+        return 1
+
+    start = timeit.default_timer()
+    failed = []
+    for package, count, elapsed, error in compile_rosdef_packages(
+        packages, sitedir=args.sitedir, cache_dir=args.cache_dir, jobs=args.jobs, numpy=args.numpy,
+        flat=args.flat,
+    ):
+        if error is None:
+            print("{0}: {1} definitions generated in {2:.3f}s".format(package, count, elapsed))
+        else:
+            print("{0}: generation failed after {1:.3f}s: {2}".format(package, elapsed, error), file=sys.stderr)
+            failed.append(package)
+
+    print("{0} packages generated in {1:.3f}s{2}".format(
+        len(packages) - len(failed), timeit.default_timer() - start,
+        ", {0} failed".format(len(failed)) if failed else ""
+    ))
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rosimport', description='ROS message definitions python importer')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    compile_parser = subparsers.add_parser(
+        'compile', help='generate the python code for ROS definitions ahead of time'
+    )
+    compile_parser.add_argument('roots', nargs='+', help='workspaces or package roots containing msg/srv directories')
+    compile_parser.add_argument(
+        '-o', '--sitedir', default=None,
+        help='site directory where to generate importable python packages. '
+             'By default the code is generated in the rosimport generation cache, used by rosimport at runtime.'
+    )
+    compile_parser.add_argument(
+        '--cache-dir', default=None,
+        help='the generation cache directory, overriding ROSIMPORT_CACHE_DIR.'
+    )
+    compile_parser.add_argument(
+        '-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+        help='number of processes generating independent packages in parallel. defaults to the number of CPUs.'
+    )
+    compile_parser.add_argument(
+        '--numpy', action='store_true', default=None,
+        help='generate classes deserializing primitive arrays as numpy arrays, like imports with ROSIMPORT_NUMPY set.'
+    )
+    compile_parser.add_argument(
+        '--flat', action='store_true', default=None,
+        help='generate classes serializing with the rosimport codec, like imports with ROSIMPORT_FLAT set.'
+    )
+    compile_parser.set_defaults(func=compile_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
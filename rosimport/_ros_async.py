@@ -0,0 +1,121 @@
+from __future__ import absolute_import, division, print_function
+
+import asyncio
+import importlib
+import importlib.util
+import sys
+import threading
+
+"""
+A module providing an import API for asyncio applications (python >= 3.5).
+
+The first import of a message package runs genmsg and genpy, which would block the event loop for a while.
+Here, finding the package and generating its code run in an executor, and only the execution of the module,
+once everything is ready, happens in the event loop thread.
+"""
+
+from ._rosdef_loader import ros_generated_finders
+from ._utils import _ImportError, _verbose_message
+
+# {(event loop, module name): future}, for the imports in progress
+_imports_in_progress = {}
+
+# the preparations run one at a time : generating code updates the search path and the loaders state,
+# which are shared between the executor threads.
+_prepare_lock = threading.Lock()
+
+
+def _prepare_import(fullname, prepared=None, seen=None):
+    """
+    Finds a module, generating its code, and the code of all the modules of its package,
+    along with the packages a lazy package imports when it is executed.
+    This runs in an executor, and does not execute the modules themselves.
+    :return: a list of (module name, spec), the dependencies first, to execute in that order
+    """
+    prepared = [] if prepared is None else prepared
+    seen = set() if seen is None else seen
+    seen.add(fullname)
+    spec = importlib.util.find_spec(fullname)
+    if spec is None:
+        raise _ImportError("No module named {0!r}".format(fullname), name=fullname)
+    for location in spec.submodule_search_locations or []:
+        finder = ros_generated_finders.get(location)
+        if finder is not None:
+            # lazy packages would otherwise generate their modules when their classes are first accessed
+            finder.generate_modules(fullname)
+    if spec.has_location and hasattr(spec.loader, 'get_code') and getattr(spec.loader, 'sources', None) is None:
+        # storing the bytecode, code in memory would be compiled again on exec
+        spec.loader.get_code(fullname)
+    for name in getattr(spec.loader, 'dependency_modules', list)():
+        if name not in sys.modules and name not in seen:
+            _prepare_import(name, prepared, seen)
+    prepared.append((fullname, spec))
+    return prepared
+
+
+def _prepare_import_locked(fullname):
+    """Prepares an import, once the other preparations are done. See _prepare_import."""
+    with _prepare_lock:
+        return _prepare_import(fullname)
+
+
+def _load(fullname, spec):
+    """Executes a module from its spec, and registers it, like the import system does"""
+    module = sys.modules.get(fullname)
+    if module is not None:  # imported in the meantime
+        return module
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[fullname] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        sys.modules.pop(fullname, None)
+        raise
+    # the module might have replaced itself in sys.modules
+    module = sys.modules[fullname]
+    parent, _, child = fullname.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+async def import_async(name, package=None, executor=None):
+    """
+    Imports a module without blocking the event loop : the code is found and generated in an executor,
+    and only the module execution happens in the event loop thread.
+    The module is the one importlib.import_module would return, and is registered in sys.modules the same way.
+    The ROS import hooks have to be active, like for any other import (see RosImporter).
+    :param name: the module name, relative to package if it starts with '.'
+    :param package: the package to resolve a relative name from
+    :param executor: the concurrent.futures executor to use. defaults to the event loop default executor.
+    :return: the module
+    """
+    fullname = importlib.util.resolve_name(name, package) if name.startswith('.') else name
+    module = sys.modules.get(fullname)
+    if module is not None:
+        return module
+
+    # get_running_loop() is new in python 3.7, in a coroutine get_event_loop() returns the running loop as well
+    loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)()
+    # concurrent imports of the same module wait for the same preparation
+    preparing = _imports_in_progress.get((loop, fullname))
+    if preparing is None:
+        _verbose_message("{0}: preparing import in executor", fullname)
+        preparing = asyncio.ensure_future(loop.run_in_executor(executor, _prepare_import_locked, fullname))
+        _imports_in_progress[(loop, fullname)] = preparing
+        preparing.add_done_callback(lambda _: _imports_in_progress.pop((loop, fullname), None))
+    prepared = await asyncio.shield(preparing)
+    for name, spec in prepared:
+        module = _load(name, spec)
+    return module
+
+
+async def import_all_async(names, package=None, executor=None):
+    """
+    Imports modules concurrently, without blocking the event loop. See import_async.
+    :param names: the module names
+    :param package: the package to resolve relative names from
+    :param executor: the concurrent.futures executor to use. defaults to the event loop default executor.
+    :return: the list of modules, in the same order as names
+    """
+    return list(await asyncio.gather(*[import_async(n, package=package, executor=executor) for n in names]))
@@ -0,0 +1,1168 @@
+from __future__ import absolute_import, division, print_function
+
+import codecs
+import collections
+import importlib
+import struct
+import sys
+import threading
+
+"""
+A module decoding serialized ROS messages, from the layout of their generated classes.
+
+For each message class, a decoding plan is built once, from the types of its fields (``_slot_types``) :
+fixed size fields following each other, including the ones of nested messages, are read with one precompiled struct,
+and the plan is compiled to python functions, reading any buffer (bytes, bytearray, memoryview...) at an offset.
+
+The plan can decode a message as a flat tuple of field values, which is used to decode many messages of one type
+into columns, or into a message instance, and encode a message instance in place, into any writable buffer.
+It also describes the layout of fixed size messages as a numpy structured dtype, to view many messages at once.
+
+Lazy message classes use the plan to locate each field in a serialized message, and decode it only when it is read.
+"""
+
+import genpy
+from genmsg.msgs import parse_type
+
+from ._stats import count
+
+# numpy is optional, and slow to import : it is only imported when it is first needed.
+numpy = None
+_numpy_imported = False
+
+
+def _import_numpy():
+    """Imports numpy on first use, returns None if it is not installed"""
+    global numpy, _numpy_imported
+    if not _numpy_imported:
+        try:
+            import numpy as numpy_module
+        except ImportError:  # columns are lists then
+            numpy_module = None
+        numpy, _numpy_imported = numpy_module, True
+    return numpy
+
+# struct codes of the ROS primitive types, which are also numpy dtype codes (with '<' for little endian).
+_STRUCT_CODES = {
+    'bool': '?',
+    'byte': 'b',
+    'char': 'B',
+    'int8': 'b',
+    'uint8': 'B',
+    'int16': 'h',
+    'uint16': 'H',
+    'int32': 'i',
+    'uint32': 'I',
+    'int64': 'q',
+    'uint64': 'Q',
+    'float32': 'f',
+    'float64': 'd',
+}
+
+# time types : (struct code of secs and nsecs, class)
+_TIME_TYPES = {
+    'time': ('I', genpy.Time),
+    'duration': ('i', genpy.Duration),
+}
+
+_UINT32 = struct.Struct('<I')
+
+if sys.version_info >= (3, 0):
+    def _text(data):
+        # decoding from any buffer, without copying it to bytes first
+        return codecs.utf_8_decode(data, 'strict', True)[0]
+else:
+    def _text(data):
+        return data.tobytes() if isinstance(data, memoryview) else bytes(data)
+
+
+def _bytes(data):
+    return data.tobytes() if isinstance(data, memoryview) else bytes(data)
+
+
+def _utf8(value):
+    """Encodes a string field, like genpy"""
+    return value if isinstance(value, bytes) else value.encode('utf-8')
+
+
+def _as_bytes(value):
+    """Returns the bytes of a uint8[] / char[] field, which genpy allows to be a list of integers"""
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, (list, tuple)):
+        return bytes(bytearray(value))
+    return _bytes(value)
+
+
+def _pack_array(buf, end, code, values):
+    """Writes a primitive array field at end in buf, returns the end of the written data"""
+    # a numpy array can only be there if numpy has already been imported
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        data = memoryview(numpy.ascontiguousarray(values, '<' + code).reshape(-1).view(numpy.uint8))
+        buf[end:end + len(data)] = data
+        return end + len(data)
+    struct.pack_into('<{0}{1}'.format(len(values), code), buf, end, *values)
+    return end + len(values) * struct.calcsize(code)
+
+
+def _array_bytes(code, values):
+    """Returns the serialized elements of a primitive array field"""
+    # a numpy array can only be there if numpy has already been imported
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        return numpy.ascontiguousarray(values, '<' + code).tobytes()
+    return struct.pack('<{0}{1}'.format(len(values), code), *values)
+
+
+def _packed_array(base_type):
+    """Whether a fixed size array of base_type can be read with the fields around it, in one struct"""
+    return base_type in _STRUCT_CODES and base_type not in ('uint8', 'char')
+
+
+def _message_class(type_):
+    """Returns the generated class of a message type, like 'std_msgs/Header', importing its package"""
+    package, _, name = type_.partition('/')
+    return getattr(importlib.import_module(package + '.msg'), name)
+
+
+class _CodeBuilder(object):
+    """Builds the source of a decoding function, merging consecutive fixed size fields in one struct"""
+
+    def __init__(self, namespace, encode=False, stream=False, write='write'):
+        """
+        :param namespace: the namespace of the generated code, shared by the functions of a plan
+        :param encode: whether the function writes the fields (pack_into), instead of reading them (unpack_from)
+        :param stream: whether the function writes the fields to a write function (pack), instead of a buffer
+        :param write: the expression of the write function, for stream functions
+        """
+        self.namespace = namespace
+        self.encode = encode or stream
+        self.stream = stream
+        self.write = write
+        self.lines = []
+        # the pending fixed size fields : [(struct code, target or value expression, array length or None)]
+        self.fixed = []
+        # the lines run once the pending fixed size fields are read, like canonicalizing times
+        self.after = []
+        self.indent = '  '
+        self.variables = 0
+
+    def constant(self, prefix, value):
+        """Stores a value in the namespace of the generated code, returning its name"""
+        name = '_{0}{1}'.format(prefix, len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def variable(self, prefix):
+        """Returns a new local variable name"""
+        self.variables += 1
+        return '{0}{1}'.format(prefix, self.variables)
+
+    def line(self, code):
+        self.lines.append(self.indent + code)
+
+    def flush(self):
+        """Reads the pending fixed size fields"""
+        if not self.fixed:
+            return
+        compiled = struct.Struct('<' + ''.join(c for c, _, _ in self.fixed))
+        s = self.constant('s', compiled)
+        if self.stream:
+            self.line('{0}({1}.pack({2}))'.format(self.write, s, ', '.join(t for _, t, _ in self.fixed)))
+            self.fixed = []
+            return
+        if self.encode:
+            self.line('{0}.pack_into(buf, end, {1})'.format(s, ', '.join(t for _, t, _ in self.fixed)))
+        elif all(n is None for _, _, n in self.fixed):
+            self.line('{0}, = {1}.unpack_from(buf, end)'.format(', '.join(t for _, t, _ in self.fixed), s))
+        else:
+            # fixed size arrays are read with the fields around them
+            self.line('values = {0}.unpack_from(buf, end)'.format(s))
+            start, scalars = 0, []
+            for code, target, length in self.fixed + [(None, None, 0)]:
+                if length is None:
+                    scalars.append(target)
+                    continue
+                if scalars:
+                    self.line('{0}, = values[{1}:{2}]'.format(', '.join(scalars), start, start + len(scalars)))
+                    start, scalars = start + len(scalars), []
+                if target is not None:
+                    self.line('{0} = values[{1}:{2}]'.format(target, start, start + length))
+                    start += length
+        self.line('end += {0}'.format(compiled.size))
+        self.lines.extend(self.indent + code for code in self.after)
+        self.fixed, self.after = [], []
+
+    def read_length(self, length):
+        """Reads a length prefix, with the pending fixed size fields, if the length is not fixed"""
+        if length is not None:
+            return str(length)
+        self.fixed.append(('I', 'length', None))
+        self.flush()
+        return 'length'
+
+    def write_length(self, value):
+        """Writes the length prefix of value, with the pending fixed size fields"""
+        self.fixed.append(('I', 'len({0})'.format(value), None))
+        self.flush()
+
+    def write_data(self, data, indent=''):
+        """Writes the bytes expression data"""
+        if self.stream:
+            self.line('{0}{1}({2})'.format(indent, self.write, data))
+        else:
+            self.line('{0}buf[end:end + len({1})] = {1}'.format(indent, data))
+            self.line('{0}end += len({1})'.format(indent, data))
+
+    def source(self, name, args, result):
+        self.flush()
+        return 'def {0}({1}):\n{2}\n{3}return {4}\n'.format(name, args, '\n'.join(self.lines), self.indent, result)
+
+
+_FLAT_METHODS_TEMPLATE = """
+def serialize(msg, buff):
+  try:
+{serialize}
+  except (_struct.error, TypeError, ValueError, AttributeError) as e:
+    msg._check_types(e)
+
+
+def deserialize(msg, buf, copy=True):
+  end = 0
+  try:
+{deserialize}
+  except (_struct.error, ValueError) as e:
+    raise _genpy.DeserializationError(e)
+  if end > len(buf):
+    raise _genpy.DeserializationError({short})
+  return msg
+"""
+
+
+def _indented(lines):
+    """Returns the source of the lines of a function, in a try block"""
+    return '\n'.join('  ' + line for line in lines) or '    pass'
+
+
+class MessagePlan(object):
+    """
+    Decoding plan of a message type, built once from its generated class, and compiled to python functions.
+    Use message_plan() to get the plan of a class, shared by all the users of that class.
+    """
+
+    def __init__(self, msg_class):
+        """
+        :param msg_class: the generated message class
+        """
+        self.msg_class = msg_class
+        # the numpy structured dtype description of fixed size messages, or the first field with a variable size
+        self.dtype_descr, self.variable_field = self._fixed_descr(msg_class, '')
+        # classes generated with numpy arrays for primitive arrays fields (see ROSIMPORT_NUMPY) are decoded the same way
+        self.numpy_arrays = getattr(msg_class, '_numpy_arrays', False)
+
+        namespace = {
+            '_uint32': _UINT32, '_text': _text, '_bytes': _bytes, '_utf8': _utf8, '_as_bytes': _as_bytes,
+            '_pack_array': _pack_array, '_array_bytes': _array_bytes, '_struct': struct, '_genpy': genpy,
+            # numpy is only imported for the classes using it, or for flat decoding (see _flat_decoder)
+            '_numpy': _import_numpy() if self.numpy_arrays else None,
+        }
+        into = _CodeBuilder(namespace)
+        self._emit_into(into, msg_class, 'msg')
+        reuse = _CodeBuilder(namespace)
+        self._emit_into(reuse, msg_class, 'msg', reuse=True)
+        encode = _CodeBuilder(namespace, encode=True)
+        self._emit_encode(encode, msg_class, 'msg')
+        stream = _CodeBuilder(namespace, stream=True)
+        self._emit_encode(stream, msg_class, 'msg')
+        serialize = _CodeBuilder(namespace, stream=True, write='buff.write')
+        self._emit_encode(serialize, msg_class, 'msg')
+        serialize.flush()
+        size = _CodeBuilder(namespace)
+        base_size = self._emit_size(size, msg_class, 'msg')
+        # the serialized size of the message, if it is the same for all messages
+        self.fixed_size = None if size.lines else base_size
+        if size.lines:
+            size.lines.insert(0, size.indent + 'size = 0')
+        source = '\n'.join([
+            into.source('decode_into', 'buf, end, msg, copy=True', 'end'),
+            reuse.source('decode_reuse', 'buf, end, msg, copy=True', 'end'),
+            encode.source('encode_into', 'buf, end, msg', 'end'),
+            stream.source('encode_stream', 'write, msg', 'None'),
+            size.source('size', 'msg', '{0}{1}'.format(base_size, ' + size' if size.lines else '')),
+        ])
+        # the serialize() and deserialize() methods of the classes generated with ROSIMPORT_FLAT, in one function each
+        source += _FLAT_METHODS_TEMPLATE.format(
+            serialize=_indented(serialize.lines), deserialize=_indented(into.lines),
+            short=repr('buffer too short for {0}'.format(msg_class._type)),
+        )
+        self.source = source
+        exec(compile(source, '<rosimport plan {0}>'.format(msg_class._type), 'exec'), namespace)
+        self._decode_into = namespace['decode_into']
+        self._decode_reuse = namespace['decode_reuse']
+        self._encode_into = namespace['encode_into']
+        self._encode_stream = namespace['encode_stream']
+        self._size = namespace['size']
+        self._serialize = namespace['serialize']
+        self._deserialize = namespace['deserialize']
+        self._namespace = namespace
+        self._flat = None
+        self._field_codecs = None
+        count('message_plans')
+
+    @staticmethod
+    def _fields(msg_class):
+        """Returns the fields of a generated class, with the class of its nested messages"""
+        default = msg_class()
+        for name, type_ in zip(msg_class.__slots__, msg_class._slot_types):
+            base_type, is_array, length = parse_type(type_)
+            if is_array or base_type in _STRUCT_CODES or base_type in _TIME_TYPES or base_type == 'string':
+                nested = None
+            else:
+                nested = type(getattr(default, name))
+            yield name, base_type, is_array, length, nested
+
+    def _fixed_descr(self, msg_class, path):
+        """
+        Describes the layout of a message as a numpy structured dtype, if it has a fixed size.
+        :return: a tuple (dtype description or None, None or a description of the first variable size field)
+        """
+        descr = []
+        for name, base_type, is_array, length, nested in self._fields(msg_class):
+            if base_type == 'string':
+                return None, '{0}{1} (string)'.format(path, name)
+            if is_array and length is None:
+                return None, '{0}{1} ({2}[])'.format(path, name, base_type)
+            if base_type in _STRUCT_CODES:
+                field_descr = '<' + _STRUCT_CODES[base_type]
+            elif base_type in _TIME_TYPES:
+                code = _TIME_TYPES[base_type][0]
+                field_descr = [('secs', '<' + code), ('nsecs', '<' + code)]
+            else:
+                nested = nested if nested is not None else _message_class(base_type)
+                field_descr, variable_field = self._fixed_descr(nested, path + name + '.')
+                if field_descr is None:
+                    return None, variable_field
+            descr.append((name, field_descr, (length,)) if is_array else (name, field_descr))
+        return descr, None
+
+    @property
+    def dtype(self):
+        """
+        The little endian numpy structured dtype matching the serialized layout of the message.
+        :raises ValueError: if the message does not have a fixed size, or numpy is not installed.
+        """
+        if _import_numpy() is None:
+            raise ValueError('numpy is not installed')
+        if self.dtype_descr is None:
+            raise ValueError('{0} does not have a fixed size : {1} has a variable length'.format(
+                self.msg_class._type, self.variable_field
+            ))
+        return numpy.dtype(self.dtype_descr)
+
+    @property
+    def columns(self):
+        """
+        The flat fields, in serialization order : [(name, numpy dtype if the field is a primitive, None otherwise)].
+        Nested messages fields are named with their path, like 'header.stamp.secs'.
+        """
+        return self._flat_decoder()[1]
+
+    def _flat_decoder(self):
+        """
+        Compiles the function decoding a message as flat values, on first use.
+        Its primitive arrays are numpy arrays if numpy is installed, which is imported then.
+        :return: a tuple (decode_flat(buf, end), columns)
+        """
+        if self._flat is not None:
+            return self._flat
+        with _plans_lock:
+            if self._flat is None:
+                self._namespace['_numpy'] = _import_numpy()
+                flat, columns = _CodeBuilder(self._namespace), []
+                self._emit_flat(flat, columns, self.msg_class, '')
+                source = flat.source('decode_flat', 'buf, end, copy=True', '({0}), end'.format(''.join(
+                    'v{0}, '.format(i) for i in range(len(columns))
+                )))
+                self.source += '\n' + source
+                exec(compile(source, '<rosimport flat {0}>'.format(self.msg_class._type), 'exec'), self._namespace)
+                self._flat = (self._namespace['decode_flat'], columns)
+            return self._flat
+
+    def _emit_flat(self, builder, columns, msg_class, path):
+        """Emits the code decoding the fields of msg_class as flat values v0, v1..., adding them to columns"""
+        for name, base_type, is_array, length, nested in self._fields(msg_class):
+            if nested is not None:
+                self._emit_flat(builder, columns, nested, path + name + '.')
+                continue
+            if not is_array and base_type in _TIME_TYPES:
+                code = _TIME_TYPES[base_type][0]
+                for part in ('secs', 'nsecs'):
+                    builder.fixed.append((code, 'v{0}'.format(len(columns)), None))
+                    columns.append(('{0}{1}.{2}'.format(path, name, part), '<' + code))
+                continue
+            target = 'v{0}'.format(len(columns))
+            if not is_array and base_type in _STRUCT_CODES:
+                builder.fixed.append((_STRUCT_CODES[base_type], target, None))
+                columns.append((path + name, '<' + _STRUCT_CODES[base_type]))
+                continue
+            columns.append((path + name, None))
+            self._emit_variable(builder, base_type, is_array, length, target, numpy_arrays=numpy is not None)
+
+    def _emit_into(self, builder, msg_class, target, reuse=False):
+        """
+        Emits the code decoding the fields of msg_class into the instance target
+        :param reuse: whether the lists of messages (or times) of target, and their elements, are decoded into
+        """
+        for name, base_type, is_array, length, nested in self._fields(msg_class):
+            self._emit_field_into(builder, '{0}.{1}'.format(target, name), base_type, is_array, length, nested, reuse)
+
+    def _emit_field_into(self, builder, attribute, base_type, is_array, length, nested, reuse=False):
+        """Emits the code decoding one field into the attribute (or variable) expression"""
+        if nested is not None or (not is_array and base_type in _TIME_TYPES):
+            cls = nested if nested is not None else _TIME_TYPES[base_type][1]
+            variable = builder.variable('m')
+            builder.line('{0} = {1}'.format(variable, attribute))
+            builder.line('if {0} is None:'.format(variable))
+            builder.line('  {0} = {1} = {2}()'.format(variable, attribute, builder.constant('c', cls)))
+            if nested is not None:
+                self._emit_into(builder, nested, variable, reuse)
+            else:
+                code = _TIME_TYPES[base_type][0]
+                builder.fixed.extend([(code, variable + '.secs', None), (code, variable + '.nsecs', None)])
+                # like genpy, which canonicalizes the times it reads (canon() only changes out of range nsecs)
+                builder.after.append('if not 0 <= {0}.nsecs < 1000000000: {0}.canon()'.format(variable))
+        elif not is_array and base_type in _STRUCT_CODES:
+            builder.fixed.append((_STRUCT_CODES[base_type], attribute, None))
+        else:
+            self._emit_variable(builder, base_type, is_array, length, attribute, self.numpy_arrays, reuse)
+
+    def _emit_encode(self, builder, msg_class, target):
+        """Emits the code encoding the fields of the instance target"""
+        for name, base_type, is_array, length, nested in self._fields(msg_class):
+            self._emit_field_encode(builder, '{0}.{1}'.format(target, name), name, base_type, is_array, length, nested)
+
+    def _emit_field_encode(self, builder, attribute, name, base_type, is_array, length, nested):
+        """Emits the code encoding one field, the value of the attribute (or variable) expression"""
+        if nested is not None or (not is_array and base_type in _TIME_TYPES):
+            variable = builder.variable('m')
+            builder.line('{0} = {1}'.format(variable, attribute))
+            if nested is not None:
+                self._emit_encode(builder, nested, variable)
+            else:
+                code = _TIME_TYPES[base_type][0]
+                builder.fixed.extend([(code, variable + '.secs', None), (code, variable + '.nsecs', None)])
+        elif not is_array and base_type in _STRUCT_CODES:
+            builder.fixed.append((_STRUCT_CODES[base_type], attribute, None))
+        elif not is_array:  # string
+            builder.line('data = {0}'.format(attribute))
+            builder.line('if not isinstance(data, bytes):')
+            builder.line("  data = data.encode('utf-8')")
+            builder.write_length('data')
+            builder.write_data('data')
+        else:
+            builder.line('items = {0}'.format(attribute))
+            if length is None:
+                builder.write_length('items')
+            elif builder.stream and _packed_array(base_type) and not self.numpy_arrays:
+                # packed with a struct of that length, which raises a struct error on wrong lengths
+                builder.flush()
+            else:
+                # a struct error, like genpy reports wrong lengths
+                builder.line('if len(items) != {0}:'.format(length))
+                builder.line("  raise _struct.error('{0} should have {1} elements')".format(name, length))
+                builder.flush()
+            self._emit_encode_items(builder, base_type, length)
+
+    def _emit_encode_items(self, builder, base_type, length=None):
+        """Emits the code encoding the elements of an array field, items, with length elements if it is fixed"""
+        if base_type in ('uint8', 'char'):
+            builder.line('data = _as_bytes(items)')
+            builder.write_data('data')
+        elif base_type in _STRUCT_CODES and builder.stream and length is not None and not self.numpy_arrays:
+            s = builder.constant('s', struct.Struct('<{0}{1}'.format(length, _STRUCT_CODES[base_type])))
+            builder.line('{0}({1}.pack(*items))'.format(builder.write, s))
+        elif base_type in _STRUCT_CODES:
+            if builder.stream:
+                builder.line("{0}(_array_bytes('{1}', items))".format(builder.write, _STRUCT_CODES[base_type]))
+            else:
+                builder.line("end = _pack_array(buf, end, '{0}', items)".format(_STRUCT_CODES[base_type]))
+        else:
+            builder.line('for item in items:')
+            if base_type == 'string':
+                builder.line('  data = _utf8(item)')
+                if builder.stream:
+                    builder.line('  {0}(_uint32.pack(len(data)))'.format(builder.write))
+                else:
+                    builder.line('  _uint32.pack_into(buf, end, len(data))')
+                    builder.line('  end += 4')
+                builder.write_data('data', indent='  ')
+            elif base_type in _TIME_TYPES:
+                s = builder.constant('s', struct.Struct('<2' + _TIME_TYPES[base_type][0]))
+                if builder.stream:
+                    builder.line('  {0}({1}.pack(item.secs, item.nsecs))'.format(builder.write, s))
+                else:
+                    builder.line('  {0}.pack_into(buf, end, item.secs, item.nsecs)'.format(s))
+                    builder.line('  end += 8')
+            elif builder.stream:
+                encode_stream = message_plan(_message_class(base_type))._encode_stream
+                builder.line('  {0}({1}, item)'.format(builder.constant('w', encode_stream), builder.write))
+            else:
+                encode_into = message_plan(_message_class(base_type))._encode_into
+                builder.line('  end = {0}(buf, end, item)'.format(builder.constant('e', encode_into)))
+
+    def _emit_size(self, builder, msg_class, target):
+        """
+        Emits the code adding the size of the variable size fields of the instance target to size.
+        :return: the size of its fixed size fields
+        """
+        fixed_size = 0
+        for name, base_type, is_array, length, nested in self._fields(msg_class):
+            attribute = '{0}.{1}'.format(target, name)
+            if nested is not None:
+                fixed_size += self._emit_size(builder, nested, attribute)
+            elif not is_array and base_type in _TIME_TYPES:
+                fixed_size += 8
+            elif not is_array and base_type in _STRUCT_CODES:
+                fixed_size += struct.calcsize(_STRUCT_CODES[base_type])
+            elif not is_array:  # string
+                fixed_size += 4
+                builder.line('size += len(_utf8({0}))'.format(attribute))
+            else:
+                element_size = None
+                if base_type in _STRUCT_CODES:
+                    element_size = struct.calcsize(_STRUCT_CODES[base_type])
+                elif base_type in _TIME_TYPES:
+                    element_size = 8
+                elif base_type != 'string':
+                    element_size = message_plan(_message_class(base_type)).fixed_size
+                if length is None:
+                    fixed_size += 4
+                elif element_size is not None:
+                    fixed_size += length * element_size
+                    continue
+                if element_size is not None:
+                    builder.line('size += {0} * len({1})'.format(element_size, attribute))
+                elif base_type == 'string':
+                    builder.line('size += sum(4 + len(_utf8(item)) for item in {0})'.format(attribute))
+                else:
+                    size = message_plan(_message_class(base_type))._size
+                    builder.line('size += sum(map({0}, {1}))'.format(builder.constant('z', size), attribute))
+        return fixed_size
+
+    def _element_size(self, base_type):
+        """Returns the serialized size of an element of a base type, None if it is not fixed"""
+        if base_type in _STRUCT_CODES:
+            return struct.calcsize(_STRUCT_CODES[base_type])
+        if base_type in _TIME_TYPES:
+            return 8
+        if base_type == 'string':
+            return None
+        return message_plan(_message_class(base_type)).fixed_size
+
+    def _field_size(self, base_type, is_array, length, nested):
+        """Returns the serialized size of a field, None if it is not fixed"""
+        if nested is not None:
+            return message_plan(nested).fixed_size
+        if not is_array:
+            return self._element_size(base_type)
+        element_size = self._element_size(base_type) if length is not None else None
+        return None if element_size is None else length * element_size
+
+    def _emit_skip(self, builder, base_type, is_array, length, nested):
+        """Emits the code moving end after a variable size field"""
+        if nested is not None:
+            offsets = builder.constant('o', message_plan(nested).field_codecs()[0])
+            builder.line('end = {0}(buf, end)[-1]'.format(offsets))
+        elif not is_array:  # string
+            builder.line('end += 4 + _uint32.unpack_from(buf, end)[0]')
+        else:
+            length = builder.read_length(length)
+            element_size = self._element_size(base_type)
+            if element_size is not None:
+                builder.line('end += {0} * {1}'.format(element_size, length))
+                return
+            builder.line('for _ in range({0}):'.format(length))
+            if base_type == 'string':
+                builder.line('  end += 4 + _uint32.unpack_from(buf, end)[0]')
+            else:
+                offsets = builder.constant('o', message_plan(_message_class(base_type)).field_codecs()[0])
+                builder.line('  end = {0}(buf, end)[-1]'.format(offsets))
+
+    def _emit_variable(self, builder, base_type, is_array, length, target, numpy_arrays, reuse=False):
+        """Emits the code decoding a string or an array field into target"""
+        if not is_array:  # string
+            builder.read_length(None)
+            builder.line('{0} = _text(buf[end:end + length])'.format(target))
+            builder.line('end += length')
+            return
+
+        if length is not None and not numpy_arrays and _packed_array(base_type):
+            # read with the fields around it
+            builder.fixed.append(('{0}{1}'.format(length, _STRUCT_CODES[base_type]), target, length))
+            return
+        length = builder.read_length(length)
+        if base_type in ('uint8', 'char'):  # bytes, like genpy
+            builder.flush()
+            # or a view of the buffer, without copying large payloads
+            builder.line('{0} = _bytes(buf[end:end + {1}]) if copy else memoryview(buf)[end:end + {1}]'.format(
+                target, length
+            ))
+            builder.line('end += {0}'.format(length))
+        elif base_type in _STRUCT_CODES:
+            builder.flush()
+            code = _STRUCT_CODES[base_type]
+            if numpy_arrays:
+                builder.line("{0} = _numpy.frombuffer(buf, '<{1}', {2}, end)".format(target, code, length))
+            else:
+                builder.line("{0} = _struct.unpack_from('<%d{1}' % {2}, buf, end)".format(target, code, length))
+            builder.line('end += {0} * {1}'.format(length, struct.calcsize(code)))
+        elif reuse and base_type != 'string':
+            builder.flush()
+            self._emit_reused_items(builder, base_type, length, target)
+        else:
+            builder.flush()
+            builder.line('items = []')
+            builder.line('for _ in range({0}):'.format(length))
+            if base_type == 'string':
+                builder.line('  length, = _uint32.unpack_from(buf, end)')
+                builder.line('  end += 4')
+                builder.line('  items.append(_text(buf[end:end + length]))')
+                builder.line('  end += length')
+            elif base_type in _TIME_TYPES:
+                code, cls = _TIME_TYPES[base_type]
+                s = builder.constant('s', struct.Struct('<2' + code))
+                builder.line('  items.append({0}(*{1}.unpack_from(buf, end)))'.format(builder.constant('c', cls), s))
+                builder.line('  end += 8')
+            else:
+                cls = _message_class(base_type)
+                builder.line('  item = {0}()'.format(builder.constant('c', cls)))
+                builder.line('  end = {0}(buf, end, item, copy)'.format(
+                    builder.constant('d', message_plan(cls)._decode_into)
+                ))
+                builder.line('  items.append(item)')
+            builder.line('{0} = items'.format(target))
+
+    @staticmethod
+    def _emit_reused_items(builder, base_type, length, target):
+        """
+        Emits the code decoding an array of messages (or times) into the list target, and its elements.
+        An element appearing more than once in the list, like in [Sample()] * 3, is only reused once.
+        """
+        builder.line('items = {0}'.format(target))
+        builder.line('if items.__class__ is not list:')
+        builder.line('  items = {0} = []'.format(target))
+        builder.line('del items[{0}:]'.format(length))
+        builder.line('if len(items) < {0}:'.format(length))
+        builder.line('  items.extend([None] * ({0} - len(items)))'.format(length))
+        if base_type in _TIME_TYPES:
+            code, cls = _TIME_TYPES[base_type]
+            s = builder.constant('s', struct.Struct('<2' + code))
+        else:
+            cls = _message_class(base_type)
+            decode = builder.constant('d', message_plan(cls)._decode_reuse)
+        cls = builder.constant('c', cls)
+        builder.line('reused = set()')
+        builder.line('for i in range({0}):'.format(length))
+        builder.line('  item = items[i]')
+        builder.line('  if item.__class__ is not {0} or id(item) in reused:'.format(cls))
+        builder.line('    item = items[i] = {0}()'.format(cls))
+        builder.line('  reused.add(id(item))')
+        if base_type in _TIME_TYPES:
+            builder.line('  item.secs, item.nsecs = {0}.unpack_from(buf, end)'.format(s))
+            builder.line('  item.canon()')
+            builder.line('  end += 8')
+        else:
+            builder.line('  end = {0}(buf, end, item, copy)'.format(decode))
+
+    def decode_flat(self, buf, offset=0):
+        """
+        Decodes a serialized message as a flat tuple of field values, matching self.columns.
+        :param buf: the serialized message, any object supporting the buffer protocol
+        :param offset: where the message starts in buf
+        :return: a tuple (values, end offset)
+        """
+        try:
+            values, end = self._flat_decoder()[0](buf, offset)
+        except (struct.error, ValueError) as e:
+            raise genpy.DeserializationError(e)
+        if end > len(buf):
+            raise genpy.DeserializationError('buffer too short for {0}'.format(self.msg_class._type))
+        return values, end
+
+    def decode_into(self, buf, msg, offset=0, reuse=False, copy=True):
+        """
+        Decodes a serialized message into a message instance.
+        Nested messages and times are decoded into the ones of msg, when they are set, like genpy does.
+        :param buf: the serialized message, any object supporting the buffer protocol
+        :param msg: the instance of the plan message class to decode into
+        :param offset: where the message starts in buf
+        :param reuse: whether the lists of messages (or times) of msg are decoded into as well,
+        reusing their elements, instead of being replaced with new lists.
+        Previous references to these lists, or their elements, then see the new values.
+        :param copy: whether uint8[] and char[] fields are bytes copied from buf, like genpy does,
+        or memoryview slices of buf, without copying. buf must not change while they are used then.
+        :return: the end offset of the message in buf
+        """
+        try:
+            end = (self._decode_reuse if reuse else self._decode_into)(buf, offset, msg, copy)
+        except (struct.error, ValueError) as e:
+            raise genpy.DeserializationError(e)
+        if end > len(buf):
+            raise genpy.DeserializationError('buffer too short for {0}'.format(self.msg_class._type))
+        return end
+
+    def size(self, msg):
+        """
+        Computes the serialized size of a message.
+        :param msg: an instance of the plan message class
+        """
+        try:
+            return self._size(msg)
+        except (TypeError, AttributeError) as e:
+            msg._check_types(e)
+
+    def field_codecs(self):
+        """
+        Compiles the functions decoding and encoding the fields of the message one by one, on first use.
+        :return: a tuple (offsets, decoders, encoders, immutable) :
+        offsets(buf, end) returns the offsets of the fields in a serialized message, followed by its end offset,
+        decoders[i](buf, end) returns the value of field i, encoders[i](write, value) writes it,
+        and the bits of immutable are set for the fields whose decoded value cannot change (numbers, strings, tuples).
+        """
+        with _plans_lock:
+            if self._field_codecs is not None:
+                return self._field_codecs
+            fields = list(self._fields(self.msg_class))
+            offsets = _CodeBuilder(self._namespace)
+            sources, immutable, skip = [], 0, 0
+            for i, (name, base_type, is_array, length, nested) in enumerate(fields):
+                offsets.line('o{0} = end{1}'.format(i, ' + {0}'.format(skip) if skip else ''))
+                field_size = self._field_size(base_type, is_array, length, nested)
+                if field_size is not None:
+                    skip += field_size
+                elif skip:
+                    offsets.line('end += {0}'.format(skip))
+                    skip = 0
+                if field_size is None:
+                    self._emit_skip(offsets, base_type, is_array, length, nested)
+
+                decoder = _CodeBuilder(self._namespace)
+                decoder.line('value = None')
+                self._emit_field_into(decoder, 'value', base_type, is_array, length, nested)
+                encoder = _CodeBuilder(self._namespace, stream=True)
+                self._emit_field_encode(encoder, 'value', name, base_type, is_array, length, nested)
+                sources.extend([
+                    decoder.source('decode_field{0}'.format(i), 'buf, end, copy=True', 'value'),
+                    encoder.source('encode_field{0}'.format(i), 'write, value', 'None'),
+                ])
+
+                if nested is None and (not is_array and base_type not in _TIME_TYPES or is_array and (
+                    base_type in ('uint8', 'char') or base_type in _STRUCT_CODES and not self.numpy_arrays
+                )):
+                    immutable |= 1 << i
+            if skip:
+                offsets.line('end += {0}'.format(skip))
+            sources.append(offsets.source('offsets', 'buf, end', '({0}end)'.format(
+                ''.join('o{0}, '.format(i) for i in range(len(fields)))
+            )))
+
+            source = '\n'.join(sources)
+            self.source += '\n' + source
+            exec(compile(source, '<rosimport fields {0}>'.format(self.msg_class._type), 'exec'), self._namespace)
+            self._field_codecs = (
+                self._namespace['offsets'],
+                tuple(self._namespace['decode_field{0}'.format(i)] for i in range(len(fields))),
+                tuple(self._namespace['encode_field{0}'.format(i)] for i in range(len(fields))),
+                immutable,
+            )
+            return self._field_codecs
+
+    def encode_into(self, buf, msg, offset=0):
+        """
+        Encodes a message in place, into a writable buffer.
+        :param buf: a writable object supporting the buffer protocol (bytearray, memoryview, mmap...).
+        A bytearray is extended if it is too short.
+        :param msg: the instance of the plan message class to encode
+        :param offset: where to write the message in buf
+        :return: the end offset of the message in buf
+        """
+        end = offset + self.size(msg)
+        if len(buf) < end:
+            if not isinstance(buf, bytearray):
+                raise genpy.SerializationError('buffer too short for {0}: {1} bytes needed at offset {2}'.format(
+                    self.msg_class._type, end - offset, offset
+                ))
+            buf.extend(b'\0' * (end - len(buf)))
+        try:
+            self._encode_into(buf, offset, msg)
+        except (struct.error, TypeError, ValueError, AttributeError) as e:
+            msg._check_types(e)
+        return end
+
+
+# {message class: plan}
+_plans = {}
+_plans_lock = threading.RLock()
+
+
+def message_plan(msg_class):
+    """
+    Returns the decoding plan of a generated message class, building it on first use.
+    :param msg_class: the generated message class
+    :return: a MessagePlan
+    """
+    try:
+        return _plans[msg_class]
+    except KeyError:
+        pass
+    with _plans_lock:
+        plan = _plans.get(msg_class)
+        if plan is None:
+            plan = _plans[msg_class] = MessagePlan(msg_class)
+        return plan
+
+
+def deserialize_from(msg, buf, offset=0, reuse=False, copy=True):
+    """
+    Decodes a serialized message into a message instance, from any buffer, without copying it.
+    Generated classes have it as a method.
+    :param msg: the message instance to decode into
+    :param buf: an object supporting the buffer protocol (bytes, bytearray, memoryview, mmap...)
+    :param offset: where the message starts in buf
+    :param reuse: whether the lists of messages of msg, and their elements, are reused (see MessagePlan.decode_into)
+    :param copy: whether uint8[] and char[] fields are copied to bytes, or memoryview slices of buf (see decode_into)
+    :return: the end offset of the message in buf
+    """
+    return message_plan(type(msg)).decode_into(buf, msg, offset, reuse, copy)
+
+
+def serialize_into(msg, buf, offset=0):
+    """
+    Encodes a message in place, into a writable buffer. Generated classes have it as a method.
+    :param msg: the message instance to encode
+    :param buf: a writable object supporting the buffer protocol (bytearray, memoryview, mmap...).
+    A bytearray is extended if it is too short.
+    :param offset: where to write the message in buf
+    :return: the end offset of the message in buf
+    """
+    return message_plan(type(msg)).encode_into(buf, msg, offset)
+
+
+def serialized_size(msg):
+    """
+    Returns the serialized size of a message, to allocate the buffer for serialize_into().
+    Generated classes have it as a method.
+    :param msg: the message instance
+    """
+    return message_plan(type(msg)).size(msg)
+
+
+def _flat_methods(msg_class):
+    """
+    Binds the serialize() and deserialize() methods compiled by the plan of a class generated with ROSIMPORT_FLAT
+    to the class, replacing flat_serialize() and flat_deserialize(), and returns the plan.
+    """
+    plan = message_plan(msg_class)
+    if getattr(msg_class.serialize, '__func__', msg_class.serialize) is flat_serialize:
+        msg_class.serialize = plan._serialize
+    if getattr(msg_class.deserialize, '__func__', msg_class.deserialize) is flat_deserialize:
+        msg_class.deserialize = plan._deserialize
+    return plan
+
+
+def flat_serialize(msg, buff):
+    """
+    Serializes a message into a stream, like the genpy serialize() method, with the message plan.
+    Classes generated with ROSIMPORT_FLAT have it as serialize() method, until it is first called :
+    the method compiled by the plan then replaces it, without the indirections of this function.
+    :param msg: the message instance to serialize
+    :param buff: the stream to write to, ``BytesIO``
+    """
+    _flat_methods(type(msg))._serialize(msg, buff)
+
+
+def flat_deserialize(msg, str):
+    """
+    Deserializes a message, like the genpy deserialize() method, with the message plan.
+    Classes generated with ROSIMPORT_FLAT have it as deserialize() method, until it is first called :
+    the method compiled by the plan then replaces it, without the indirections of this function.
+    :param msg: the message instance to decode into
+    :param str: the serialized message, any object supporting the buffer protocol
+    :return: msg
+    """
+    return _flat_methods(type(msg))._deserialize(msg, str)
+
+
+def _lazy_field(index, slot, decode):
+    """Returns the property of a field of a lazy message class, decoding the field when it is first read"""
+    bit = 1 << index
+
+    def get(self):
+        if not self._decoded & bit:
+            try:
+                value = decode(self._buf, self._offsets[index])
+            except (struct.error, ValueError) as e:
+                raise genpy.DeserializationError(e)
+            slot.__set__(self, value)
+            self._decoded |= bit
+        return slot.__get__(self, None)
+
+    def set(self, value):
+        slot.__set__(self, value)
+        self._decoded |= bit
+        self._assigned |= bit
+
+    return property(get, set)
+
+
+def _lazy_init(self, *args, **kwds):
+    """
+    Creates a new lazy message, its fields having their default values, like the genpy message constructor.
+    """
+    self._buf, self._offsets = self._lazy_default
+    self._decoded = self._assigned = 0
+    if args and kwds:
+        raise TypeError("Message constructor may only use args OR keywords, not both")
+    if args:
+        if len(args) != len(self.__slots__):
+            raise TypeError("Invalid number of arguments, args should be {0} args are {1}".format(self.__slots__, args))
+        kwds = dict(zip(self.__slots__, args))
+    for name, value in kwds.items():
+        if name not in self.__slots__:
+            raise AttributeError("{0} is not an attribute of {1}".format(name, type(self).__name__))
+        # like genpy, None is the default value
+        if value is not None:
+            setattr(self, name, value)
+
+
+def _lazy_load(msg, buf, offset):
+    """Replaces the serialized message of a lazy message, returning its end offset in buf"""
+    try:
+        offsets = msg._lazy_offsets(buf, offset)
+    except (struct.error, ValueError) as e:
+        raise genpy.DeserializationError(e)
+    if offsets[-1] > len(buf):
+        raise genpy.DeserializationError('buffer too short for {0}'.format(msg._type))
+    msg._buf, msg._offsets = buf, offsets
+    msg._decoded = msg._assigned = 0
+    return offsets[-1]
+
+
+def _lazy_deserialize(self, str):
+    """
+    Keeps a serialized message, to decode its fields when they are first read.
+    :param str: the serialized message, any object supporting the buffer protocol. It must not change afterwards.
+    :return: self
+    """
+    _lazy_load(self, str, 0)
+    return self
+
+
+def _lazy_deserialize_from(self, buf, offset=0):
+    """
+    Keeps a serialized message, to decode its fields when they are first read.
+    :param buf: an object supporting the buffer protocol (bytes, bytearray, memoryview, mmap...).
+    It must not change afterwards.
+    :param offset: where the message starts in buf
+    :return: the end offset of the message in buf
+    """
+    return _lazy_load(self, buf, offset)
+
+
+def _lazy_serialize(self, buff):
+    """
+    Serializes the message into a stream, writing the original bytes of the fields that cannot have changed.
+    :param buff: the stream to write to, ``BytesIO``
+    """
+    buf, offsets = self._buf, self._offsets
+    # the fields that were assigned, or read and possibly modified in place
+    changed = self._decoded & ~self._lazy_immutable | self._assigned
+    if not changed:
+        if offsets[0] == 0 and offsets[-1] == len(buf) and isinstance(buf, bytes):
+            buff.write(buf)
+        else:
+            buff.write(buf[offsets[0]:offsets[-1]])
+        return
+    write, encoders = buff.write, self._lazy_encoders
+    # the start of the original bytes left to write
+    start = None
+    try:
+        for i, name in enumerate(self.__slots__):
+            if changed & (1 << i):
+                if start is not None:
+                    write(buf[start:offsets[i]])
+                    start = None
+                encoders[i](write, getattr(self, name))
+            elif start is None:
+                start = offsets[i]
+        if start is not None:
+            write(buf[start:offsets[-1]])
+    except (struct.error, TypeError, ValueError, AttributeError) as e:
+        self._check_types(e)
+
+
+def _lazy_eq(self, other):
+    # equal to the messages of the generated class, with the same values
+    return isinstance(other, self._lazy_base) and self._lazy_base.__eq__(other, self)
+
+
+def _lazy_setstate(self, state):
+    _lazy_init(self, *state)
+
+
+def _lazy_new(msg_class):
+    """Creates a lazy message of a generated message class, when unpickling one"""
+    return lazy_class(msg_class)()
+
+
+def _lazy_reduce(self):
+    # lazy classes are built at runtime, and cannot be pickled by name : the generated class is, instead
+    return _lazy_new, (self._lazy_base,), self.__getstate__()
+
+
+# {message class: lazy message class}
+_lazy_classes = {}
+
+
+def lazy_class(msg_class):
+    """
+    Returns the lazy variant of a generated message class, built on first use.
+
+    Deserializing a lazy message only computes the offsets of its fields in the serialized message, which is kept.
+    A field is decoded when it is first read, and serializing the message writes the original bytes
+    of the fields which were not assigned, nor read and possibly modified in place (nested messages, lists).
+    So a message forwarded without reading it is written as it was received.
+    Lazy messages compare equal to the messages of the generated class, with the same values.
+    :param msg_class: the generated message class
+    :return: a subclass of msg_class, like msg_class for rospy (it can be the data class of a subscriber)
+    """
+    try:
+        return _lazy_classes[msg_class]
+    except KeyError:
+        pass
+    with _plans_lock:
+        cls = _lazy_classes.get(msg_class)
+        if cls is None:
+            plan = message_plan(msg_class)
+            offsets, decoders, encoders, immutable = plan.field_codecs()
+            default = bytearray()
+            plan.encode_into(default, msg_class())
+            default = bytes(default)
+            namespace = {
+                '__slots__': ('_buf', '_offsets', '_decoded', '_assigned'),
+                '__doc__': msg_class.__doc__,
+                '__module__': msg_class.__module__,
+                '__init__': _lazy_init,
+                '__eq__': _lazy_eq,
+                '__setstate__': _lazy_setstate,
+                '__reduce__': _lazy_reduce,
+                'serialize': _lazy_serialize,
+                'deserialize': _lazy_deserialize,
+                'deserialize_from': _lazy_deserialize_from,
+                '_lazy_base': msg_class,
+                '_lazy_offsets': staticmethod(offsets),
+                '_lazy_encoders': encoders,
+                '_lazy_immutable': immutable,
+                '_lazy_default': (default, offsets(default, 0)),
+            }
+            for i, name in enumerate(msg_class.__slots__):
+                namespace[name] = _lazy_field(i, getattr(msg_class, name), decoders[i])
+            cls = type('Lazy' + msg_class.__name__, (msg_class,), namespace)
+            # genpy iterates the fields with __slots__
+            cls.__slots__ = msg_class.__slots__
+            _lazy_classes[msg_class] = cls
+            count('lazy_classes')
+        return cls
+
+
+class MessagePool(object):
+    """
+    Instances of a generated message class, recycled by a decoding loop, along with their nested messages and lists.
+    Once messages are released, decoding allocates almost nothing but strings and primitive arrays.
+    """
+
+    def __init__(self, msg_class, size=64):
+        """
+        :param msg_class: the generated message class
+        :param size: the maximum number of released messages kept for reuse
+        """
+        self.msg_class = msg_class
+        self.size = size
+        self._plan = message_plan(msg_class)
+        self._free = []
+
+    def acquire(self):
+        """Returns a released message, or a new one, with the field values it had"""
+        try:
+            return self._free.pop()
+        except IndexError:
+            count('pool_messages_created')
+            return self.msg_class()
+
+    def release(self, msg):
+        """
+        Gives a message back to the pool. It, and the messages and lists it contains, must not be used anymore.
+        :param msg: a message of the pool class
+        """
+        if type(msg) is not self.msg_class:
+            raise TypeError('{0} is not a {1} message'.format(type(msg).__name__, self.msg_class._type))
+        if len(self._free) < self.size:
+            self._free.append(msg)
+
+    def deserialize(self, buf, offset=0):
+        """
+        Decodes a serialized message into a pooled message, reusing its nested messages and lists.
+        :param buf: the serialized message, any object supporting the buffer protocol
+        :param offset: where the message starts in buf
+        :return: the message, to release once it is not used anymore
+        """
+        msg = self.acquire()
+        self._plan.decode_into(buf, msg, offset, reuse=True)
+        return msg
+
+
+def message_dtype(msg_class):
+    """
+    Returns the little endian numpy structured dtype matching the serialized layout of a fixed size message type,
+    so that a buffer of N serialized messages can be viewed as an array with numpy.frombuffer(buf, dtype).
+    Nested messages are nested structured dtypes, time and duration have 'secs' and 'nsecs' fields.
+    :param msg_class: the generated message class
+    :raises ValueError: if the message type has a variable size (strings, variable length arrays),
+    naming the first variable length field.
+    """
+    return message_plan(msg_class).dtype
+
+
+def deserialize_batch(msg_class, buffers):
+    """
+    Decodes many serialized messages of one type into columns.
+    :param msg_class: the generated message class
+    :param buffers: an iterable of serialized messages, objects supporting the buffer protocol
+    :return: an OrderedDict {field name: column}, nested messages fields being named with their path ('header.stamp.secs').
+    Columns of primitive fields are numpy arrays (lists when numpy is not installed),
+    other columns are lists of the values deserialize() would give, primitive arrays being numpy arrays.
+    """
+    plan = message_plan(msg_class)
+    columns = collections.OrderedDict()
+    if _import_numpy() is not None and plan.dtype_descr is not None and all(d is not None for _, d in plan.columns):
+        # fixed size messages made of primitives : viewing all the messages at once
+        buffers = list(buffers)
+        dtype = plan.dtype
+        if dtype.itemsize and all(len(b) == dtype.itemsize for b in buffers):
+            records = numpy.frombuffer(b''.join(buffers), dtype)
+            for name, _ in plan.columns:
+                column = records
+                for field in name.split('.'):
+                    column = column[field]
+                columns[name] = numpy.ascontiguousarray(column)
+            count('batch_messages', len(buffers))
+            return columns
+
+    decode_flat = plan.decode_flat
+    rows = [decode_flat(b)[0] for b in buffers]
+    for (name, dtype), values in zip(plan.columns, zip(*rows) if rows else [()] * len(plan.columns)):
+        if dtype is not None and numpy is not None:
+            columns[name] = numpy.array(values, dtype=dtype)
+        else:
+            columns[name] = list(values)
+    count('batch_messages', len(rows))
+    return columns
@@ -0,0 +1,275 @@
+from __future__ import absolute_import, division, print_function
+
+import collections
+import compileall
+import multiprocessing
+import os
+import sys
+import timeit
+
+try:
+    import queue
+except ImportError:  # python2
+    import Queue as queue
+
+"""
+A module to generate the python code for a whole workspace ahead of time.
+
+ROS definitions are discovered like ROSDirectoryFinder does on import ('msg' / 'srv' directories),
+and the code is generated either in a site directory, importable without rosimport,
+or in the rosimport generation cache, so that the usual finders and loaders only have to load it at runtime.
+"""
+
+from ._ros_generator import genmsg, genrosmsg_py, genrossrv_py, genrosmsg_py_sources, genrossrv_py_sources, genros_py_outdir
+from ._rosdef_cache import cached_genros_py, load_bytecode, write_bytecode
+from ._rosdef_loader import ROSMsgLoader, RosSearchPath
+from ._ros_directory_finder import get_supported_ros_loaders
+from ._utils import _verbose_message
+
+
+# generators for each kind of ROS definition : (site directory generator, sources generator)
+_generators = {
+    'msg': (genrosmsg_py, genrosmsg_py_sources),
+    'srv': (genrossrv_py, genrossrv_py_sources),
+}
+
+# the init of intermediate generated packages, merging with other portions of the same python package
+_PKG_INITPY = "__path__ = __import__('pkgutil').extend_path(__path__, __name__)\n"
+
+
+def _is_rosdef_package(path):
+    """Whether a directory is a ROS package root : it has a package.xml, or ROS definition directories"""
+    return os.path.exists(os.path.join(path, 'package.xml')) or any(
+        os.path.isdir(os.path.join(path, loader.get_origin_subdir())) for loader, _ in get_supported_ros_loaders()
+    )
+
+
+def _rosdef_package_name(root, rosdef_dir):
+    """
+    Computes the python package name matching a ROS definition directory.
+    If root is a package root, it is the ROS package.
+    Otherwise the ROS package is the closest directory containing a package.xml, or the directory containing rosdef_dir.
+    :param root: the workspace or package root the directory was found in
+    :param rosdef_dir: the 'msg' / 'srv' directory
+    :return: the package name, like 'my_pkg.msg' or 'my_pkg.subpkg.srv'
+    """
+    parent = os.path.dirname(rosdef_dir)
+    if parent == root or _is_rosdef_package(root):
+        base = os.path.dirname(root)
+    else:
+        rospkg_dir = parent
+        while rospkg_dir != root and not os.path.exists(os.path.join(rospkg_dir, 'package.xml')):
+            rospkg_dir = os.path.dirname(rospkg_dir)
+        base = os.path.dirname(rospkg_dir if rospkg_dir != root else parent)
+    return '.'.join(os.path.relpath(rosdef_dir, base).split(os.sep))
+
+
+def find_rosdef_packages(roots):
+    """
+    Finds the ROS definitions in workspaces or package roots.
+    :param roots: a list of workspaces or package roots directories
+    :return: an OrderedDict {package name: [rosdef files]}, messages packages first, since services can depend on them.
+    """
+    found = {}
+    for root in roots:
+        root = os.path.normpath(os.path.abspath(root))
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+            for loader, suffixes in get_supported_ros_loaders():
+                if os.path.basename(dirpath) != loader.get_origin_subdir():
+                    continue
+                rosdef_files = [os.path.join(dirpath, f) for f in sorted(filenames) if f.endswith(tuple(suffixes))]
+                if rosdef_files:
+                    package = _rosdef_package_name(root, dirpath)
+                    _verbose_message("{0}: found {1} definitions in {2}", package, len(rosdef_files), dirpath)
+                    # multiple directories can make up one package, they are aggregated like on import
+                    found.setdefault(package, []).extend(rosdef_files)
+
+    return collections.OrderedDict(
+        sorted(found.items(), key=lambda p: (p[0].rpartition('.')[2] != 'msg', p[0]))
+    )
+
+
+def _write_package_inits(package, sitedir, directory_name):
+    """Writes the __init__.py of the parent packages of a generated package, to make it importable on python 2"""
+    pkgdir = os.path.dirname(genros_py_outdir(package, sitedir, directory_name))
+    while pkgdir != sitedir:
+        init_path = os.path.join(pkgdir, '__init__.py')
+        if not os.path.exists(init_path):
+            with open(init_path, 'w') as f:
+                f.write(_PKG_INITPY)
+        pkgdir = os.path.dirname(pkgdir)
+
+
+def _compile_bytecode(directory):
+    """Compiles the generated modules in directory, storing the code next to them for rosimport loaders"""
+    for module in sorted(f for f in os.listdir(directory) if f.endswith('.py')):
+        source_path = os.path.join(directory, module)
+        with open(source_path, 'rb') as f:
+            source = f.read()
+        if load_bytecode(source_path, source) is None:
+            write_bytecode(source_path, source, compile(source, source_path, 'exec', dont_inherit=True))
+
+
+def rosdef_dependencies(package, rosdef_files):
+    """
+    Finds the ROS packages a set of ROS definitions depends on, from their parsed specifications.
+    :param package: the package name of the definitions, the head element being the ros package.
+    :param rosdef_files: the .msg/.srv files
+    :return: the set of ros package names the definitions depend on
+    """
+    rospackage = package.partition('.')[0]
+    msg_context = genmsg.msg_loader.MsgContext.create_default()
+    dependencies = set()
+    for f in rosdef_files:
+        full_type = genmsg.gentools.compute_full_type_name(rospackage, os.path.basename(f))
+        try:
+            if f.endswith(genmsg.EXT_SRV):
+                srv_spec = genmsg.msg_loader.load_srv_from_file(msg_context, f, full_type)
+                types = srv_spec.request.types + srv_spec.response.types
+            else:
+                types = genmsg.msg_loader.load_msg_from_file(msg_context, f, full_type).types
+        except genmsg.InvalidMsgSpec as e:
+            # generation will report it
+            _verbose_message("{0}: cannot parse dependencies: {1}", f, e)
+            continue
+        for t in types:
+            t = genmsg.msgs.bare_msg_type(t)
+            if not genmsg.msgs.is_builtin(t):
+                dependencies.add(genmsg.package_resource_name(genmsg.msgs.resolve_type(t, rospackage))[0])
+    return dependencies
+
+
+def rosdef_packages_graph(packages):
+    """
+    Builds the dependency graph between ROS definitions packages.
+    :param packages: a dict {package name: [rosdef files]}, as returned by find_rosdef_packages
+    :return: a dict {package name: set of the package names it depends on}, among packages
+    """
+    msg_packages = {}
+    for package in packages:
+        if package.rpartition('.')[2] == 'msg':
+            msg_packages.setdefault(package.partition('.')[0], set()).add(package)
+
+    graph = {}
+    for package, rosdef_files in packages.items():
+        graph[package] = set()
+        for d in rosdef_dependencies(package, rosdef_files):
+            graph[package].update(msg_packages.get(d, set()))
+        graph[package].discard(package)
+    return graph
+
+
+def _compile_rosdef_package(package, rosdef_files, sitedir, cache_dir, search_path, numpy=False, flat=False):
+    """
+    Generates the python code for one ROS definitions package.
+    This is the task run in pool processes, it returns the result instead of raising.
+    """
+    directory_name = package.rpartition('.')[2]
+    generator, sources_generator = _generators[directory_name]
+    start = timeit.default_timer()
+    try:
+        if sitedir is not None:
+            generator(
+                rosdef_files=rosdef_files, package=package, sitedir=sitedir, search_path=search_path, numpy=numpy, flat=flat
+            )
+            _write_package_inits(package, sitedir, directory_name)
+            compileall.compile_dir(genros_py_outdir(package, sitedir, directory_name), quiet=1)
+        else:
+            generated = cached_genros_py(
+                sources_generator, directory_name, rosdef_files, package,
+                search_path=search_path, cache_dir=cache_dir, numpy=numpy, flat=flat,
+            )
+            if generated is None:
+                raise genmsg.MsgGenerationException("cannot use the generation cache for {0}".format(package))
+            _compile_bytecode(os.path.dirname(generated[1]))
+    except Exception as e:  # reported with the package result, a pool process should not die on it
+        return package, len(rosdef_files), timeit.default_timer() - start, e
+    return package, len(rosdef_files), timeit.default_timer() - start, None
+
+
+def _error_callback(results, package, definitions):
+    """
+    Returns the arguments of apply_async reporting the failure of a package task, as a result with an exception.
+    The task itself does not raise, but its arguments or result can fail to pickle.
+    Python 2 pools do not have an error callback.
+    """
+    if sys.version_info < (3,):
+        return {}
+    start = timeit.default_timer()
+    return {'error_callback': lambda e: results.put((package, definitions, timeit.default_timer() - start, e))}
+
+
+def compile_rosdef_packages(packages, sitedir=None, cache_dir=None, search_path=None, jobs=1, numpy=None, flat=None):
+    """
+    Generates the python code for ROS definitions packages.
+    The packages are generated in the order of their dependency graph,
+    and independent packages are generated concurrently when using multiple jobs.
+    :param packages: a dict {package name: [rosdef files]}, as returned by find_rosdef_packages
+    :param sitedir: the site directory where to generate the packages.
+    If None, the code is generated in the rosimport generation cache.
+    :param cache_dir: the root of the generation cache. defaults to rosdef_cache_dir()
+    :param search_path: optionally a mapping of the form {package: [list of paths]} , in order to retrieve message dependencies.
+    The message directories of the compiled packages are added to it.
+    :param jobs: the number of processes generating code in parallel.
+    :param numpy: if True, the generated classes deserialize primitive arrays as numpy arrays.
+    defaults to the setting of the loaders (ROSIMPORT_NUMPY), to generate the code imports will look for.
+    :param flat: if True, the generated classes serialize with the rosimport codec, flattening fixed size fields.
+    defaults to the setting of the loaders (ROSIMPORT_FLAT).
+    :return: a generator of tuples (package name, number of definitions, elapsed time in seconds, exception or None),
+    in the order packages are generated.
+    """
+    search_path = RosSearchPath() if search_path is None else search_path
+    if numpy is None:
+        numpy = ROSMsgLoader.rosimport_numpy
+    if flat is None:
+        flat = ROSMsgLoader.rosimport_flat
+    # all our messages are available as dependencies, without import.
+    for package, rosdef_files in packages.items():
+        rospackage = package.partition('.')[0]
+        msg_dirs = {os.path.dirname(f) for f in rosdef_files if f.endswith(genmsg.EXT_MSG)}
+        if msg_dirs:
+            search_path[rospackage] = set(search_path.get(rospackage, set())) | msg_dirs
+
+    graph = rosdef_packages_graph(packages)
+    pending = list(packages)
+    done = set()
+
+    def ready_packages():
+        # when only dependency cycles remain, we go on anyway : generation only needs the definitions
+        ready = [p for p in pending if graph[p] <= done] or pending[:1]
+        for p in ready:
+            pending.remove(p)
+        return ready
+
+    if jobs <= 1:
+        while pending:
+            for p in ready_packages():
+                result = _compile_rosdef_package(p, packages[p], sitedir, cache_dir, search_path, numpy, flat)
+                done.add(p)
+                yield result
+        return
+
+    # the pool processes do not need the dynamic discovery of RosSearchPath, everything is in the graph
+    if isinstance(search_path, RosSearchPath):
+        search_path.load_index()
+    search_path = dict((k, search_path[k]) for k in search_path.keys())
+    results = queue.Queue()
+    pool = multiprocessing.Pool(jobs)
+    try:
+        running = 0
+        while pending or running:
+            if pending and (running == 0 or [p for p in pending if graph[p] <= done]):
+                for p in ready_packages():
+                    pool.apply_async(
+                        _compile_rosdef_package, (p, packages[p], sitedir, cache_dir, search_path, numpy, flat),
+                        callback=results.put, **_error_callback(results, p, len(packages[p]))
+                    )
+                    running += 1
+            result = results.get()
+            running -= 1
+            done.add(result[0])
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
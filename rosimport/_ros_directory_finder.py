@@ -6,6 +6,7 @@ import site
 from collections import OrderedDict
 
 from rosimport import ROSMsgLoader, ROSSrvLoader
+from ._rosdef_loader import ros_generated_finders
 
 """
 A module to setup custom importer for .msg and .srv files
@@ -24,13 +25,35 @@ import sys
 
 import logging
 
-from ._utils import _ImportError, _verbose_message
+from ._stats import count, timed
+from ._utils import _ImportError, _string_types, _verbose_message
 
 import filefinder2
 import filefinder2.machinery
 import filefinder2.util
 
 
+try:
+    from os import scandir as _scandir
+except ImportError:  # python < 3.5
+    _scandir = None
+
+
+def _list_directory(path):
+    """Returns the names of the (directories, files) in path, with only one system call when possible"""
+    directories, files = [], []
+    if _scandir is not None:
+        for entry in list(_scandir(path)):
+            try:
+                (directories if entry.is_dir() else files).append(entry.name)
+            except OSError:  # broken entry
+                continue
+    else:
+        for name in os.listdir(path):
+            (directories if os.path.isdir(os.path.join(path, name)) else files).append(name)
+    return directories, files
+
+
 class ROSPathFinder(filefinder2.machinery.PathFinder):
     """
     MetaFinder to handle Finding ROS package directories
@@ -38,6 +61,68 @@ class ROSPathFinder(filefinder2.machinery.PathFinder):
     ROS package root directories, containing msg and srv subdirs.
     """
 
+    # for each path searched : {tuple(path): (root index, names we could not find in that path)}
+    # The root index of a path is {top level package: [(entry, root, parent)]}, for the ROS roots of its entries,
+    # so finding a package is a lookup, instead of splitting every entry of the path again.
+    # Most imports are not ROS related, and should not pay for our search more than once.
+    _searched_paths = {}
+
+    # the last path searched, with its value in _searched_paths.
+    # sys.path is searched again and again, and rarely changes : comparing it to a copy is cheaper than hashing it.
+    _last_searched = (None, None)
+
+    @classmethod
+    def invalidate_caches(cls):
+        """Forgets about the names we could not find, as well as the caches of the path entries finders."""
+        cls._searched_paths.clear()
+        cls._last_searched = (None, None)
+        super(ROSPathFinder, cls).invalidate_caches()
+
+    @classmethod
+    def _searched(cls, path):
+        """
+        Returns the root index of a path, and the set of names we could not find in it,
+        building the index the first time the path is searched.
+        Each directory name in an entry, like my_pkg in /ws/src/my_pkg/msg, is a candidate top level package,
+        rooted at the first directory with that name (/ws/src/my_pkg), in its parent directory (/ws/src).
+        :param path: a sequence of path entries
+        :return: ({top level package: [(entry, root, parent)]}, in path order, set of names)
+        """
+        last_path, searched = cls._last_searched
+        # comparing the entries, most often the same strings, without hashing them
+        if path == last_path:
+            return searched
+        key = tuple(path)
+        searched = cls._searched_paths.get(key)
+        if searched is None:
+            index = {}
+            for entry in key:
+                if not isinstance(entry, _string_types):
+                    continue
+                dirlist = entry.split(os.sep)
+                names = set()
+                for i, name in enumerate(dirlist):
+                    if name in names:  # only the first directory with that name
+                        continue
+                    names.add(name)
+                    rootentry = os.path.join(os.sep if dirlist[0] == '' else '', *dirlist[:i + 1])
+                    index.setdefault(name, []).append((entry, rootentry, os.path.dirname(rootentry)))
+            if len(cls._searched_paths) >= 32:  # sys.path keeps changing, we only need the recent ones
+                cls._searched_paths.clear()
+            searched = cls._searched_paths[key] = (index, set())
+            count('path_finder_root_indexes')
+        cls._last_searched = (list(key), searched)
+        return searched
+
+    @classmethod
+    def _root_index(cls, path):
+        """
+        Returns the index of the ROS roots of the entries of a path (see _searched).
+        :param path: a sequence of path entries
+        :return: {top level package: [(entry, root, parent)]}, in path order
+        """
+        return cls._searched(path)[0]
+
     @classmethod
     def find_spec(cls, fullname, path, target=None):  # from importlib.PathFinder
         """Try to find the module on sys.path or 'path'
@@ -46,42 +131,46 @@ class ROSPathFinder(filefinder2.machinery.PathFinder):
 
         if path is None:
             path = sys.path
+        index, misses = cls._searched(path)
+        if fullname in misses:
+            count('path_finder_cached_misses')
+            return None
+        rospkg = fullname.partition('.')[0]
+        roots = index.get(rospkg)
+        if not roots:  # no directory is named like the package, this is not a ROS import, and is not timed
+            misses.add(fullname)
+            return None
+        with timed('find', fullname):
+            return cls._find_spec(fullname, misses, rospkg, roots)
+
+    @classmethod
+    def _find_spec(cls, fullname, misses, rospkg, roots):
         loader = None
         # TODO: review hte logic here... it was done for a find_module() API for py2 but could be improved...
-        for entry in path:
-            if not isinstance(entry, (str, bytes)):
-                continue
-            # first we check if the root import is doable with ROS recursively
-            rospkg = fullname.partition('.')[0]
-            dirlist = entry.split(os.sep)
-            if rospkg in dirlist:
-                dirlist[:] = dirlist[:dirlist.index(rospkg)+1]
-
-                rootentry = os.path.join(os.sep if dirlist[0] == '' else '', *dirlist)
-                rosentry = os.path.dirname(rootentry)
-
-                # we need to keep order here to maintain strict dependency and generation order
-                entrymap = []
-                # we are trying to find root messages if we dont have a root package, or if the directory is different
-                if rospkg + '.msg' != fullname or rosentry != entry:
-                    entrymap.append((rospkg + '.msg', rosentry))
-                if rospkg + '.msg' != fullname or rootentry != entry:
-                    entrymap.append((rospkg + '.msg', rootentry))
-                # This should always be last
-                entrymap.append((fullname, entry))
-
-                loader = None
-                for n, e in entrymap:
-                    finder = cls._path_importer_cache(e)
-                    if finder is not None:
-                        # creatign the loader will generate the python code and make sure it is importable.
-                        l = finder.find_module(n)
-                        if l and n == fullname:  # we prevent erasing a loader with None or a different loader
-                            # Note one loader will aggregate root entries like repo/msg and repo/pkg/msg
-                            loader = l
-            # else:
-            # other cases handled later by the default python pathfinder.
+        # first we check if the root import is doable with ROS recursively, from the entries containing the root package
+        # other entries are handled later by the default python pathfinder.
+        for entry, rootentry, rosentry in roots:
+            # we need to keep order here to maintain strict dependency and generation order
+            entrymap = []
+            # we are trying to find root messages if we dont have a root package, or if the directory is different
+            if rospkg + '.msg' != fullname or rosentry != entry:
+                entrymap.append((rospkg + '.msg', rosentry))
+            if rospkg + '.msg' != fullname or rootentry != entry:
+                entrymap.append((rospkg + '.msg', rootentry))
+            # This should always be last
+            entrymap.append((fullname, entry))
+
+            loader = None
+            for n, e in entrymap:
+                finder = cls._path_importer_cache(e)
+                if finder is not None:
+                    # creatign the loader will generate the python code and make sure it is importable.
+                    l = finder.find_module(n)
+                    if l and n == fullname:  # we prevent erasing a loader with None or a different loader
+                        # Note one loader will aggregate root entries like repo/msg and repo/pkg/msg
+                        loader = l
         if loader is None:
+            misses.add(fullname)
             return None
         spec = filefinder2.util.spec_from_loader(fullname, loader)
 
@@ -115,11 +204,13 @@ class ROSDirectoryFinder(filefinder2.machinery.FileFinder):
         # We need to check that we will be able to find a module or package,
         # or raise ImportError to allow other finders to be instantiated for this path.
         # => the logic must correspond to find_module()
+        # snapshots of the directories we look into, {path: (mtime, directories, files)}
+        self._snapshots = {}
         findable = False
-        for f in [p for p in os.listdir(path) if os.path.isdir(os.path.join(path, p))]:  # we are only interested in directories
+        for f in self._list_directory(path)[0]:  # we are only interested in directories
             findable = findable or any(  # we make sure we have at least a directory that :
                     f == l.get_origin_subdir() and  # has the right name and
-                    [subf for subf in os.listdir(os.path.join(path, f)) if subf.endswith(s)]
+                    [subf for subf in self._list_directory(os.path.join(path, f))[1] if subf.endswith(s)]
                     # contain at least one file with the right extension
                     for s, l in self._ros_loaders
             )
@@ -134,6 +225,8 @@ class ROSDirectoryFinder(filefinder2.machinery.FileFinder):
             )
             # This is needed to not override default behavior in path where there is NO ROS files/directories.
 
+        count('directory_finders_created')
+
         # Since we can have only one finder per directory, we are also a filefinder for usual python,
         # so we should initialize properly.
         # CAREFUL : this is only visible while trying to import a subpackage existing along a msg/
@@ -143,10 +236,45 @@ class ROSDirectoryFinder(filefinder2.machinery.FileFinder):
     def __repr__(self):
         return 'ROSDirectoryFinder({!r})'.format(self.path)
 
+    def _list_directory(self, path):
+        """
+        Returns the names of the (directories, files) in path.
+        A snapshot of each directory is kept, and taken again only when the directory modification time changes,
+        like FileFinder does for its own path.
+        """
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return [], []
+        snapshot = self._snapshots.get(path)
+        if snapshot is None or snapshot[0] != mtime:
+            snapshot = (mtime,) + _list_directory(path)
+            self._snapshots[path] = snapshot
+        return snapshot[1], snapshot[2]
+
+    def _find_rosdef_loader(self, path):
+        """
+        Returns the ROS loader for a directory containing ROS definition files, or None.
+        Only the files directly in that directory are considered : we never walk the directory tree.
+        """
+        files = self._list_directory(path)[1]
+        for suffix, loader_cls in self._ros_loaders:
+            # we need to take care of msgs before srvs (because they can be used as dependencies)
+            if any(f.endswith(suffix) for f in files):
+                return loader_cls
+        return None
+
+    def invalidate_caches(self):
+        self._snapshots = {}
+        super(ROSDirectoryFinder, self).invalidate_caches()
+
     @classmethod
     def path_hook(cls, *loader_details):
         def rosimporter_path_hook(path):
             """Path hook for ROSDirectoryFinder."""
+            # directories of generated code have their own finder (even if sys.path_importer_cache has been cleared)
+            if path in ros_generated_finders:
+                return ros_generated_finders[path]
             if not os.path.isdir(path):
                 raise _ImportError('only directories are supported', path=path)
             return cls(path, *loader_details)
@@ -160,24 +288,18 @@ class ROSDirectoryFinder(filefinder2.machinery.FileFinder):
         :param fullname: the name of the package we are trying to import
         :return:
         """
+        with timed('find', fullname):
+            return self._find_spec(fullname, target)
 
+    def _find_spec(self, fullname, target=None):
         tail_module = fullname.rpartition('.')[2]
         spec = None
         base_path = os.path.join(self.path, tail_module)
 
         # special code here since FileFinder expect a "__init__" that we don't need for msg or srv.
-        if os.path.isdir(base_path):
-            loader_class = None
-            rosdir = None
-            # Figuring out if we should care about this directory at all
-            for root, dirs, files in os.walk(base_path):
-                for suffix, loader_cls in self._ros_loaders:
-                    if any(f.endswith(suffix) for f in files):
-                        loader_class = loader_cls
-                        rosdir = root
-                        break  # breaking as soon as we find something interesting
-                        # we need to take care of msgs before srvs (because they can be used as dependencies
-            if loader_class and rosdir and rosdir == base_path:  # we found a message/service file in the hierarchy, that belong to our module
+        if tail_module in self._list_directory(self.path)[0]:
+            loader_class = self._find_rosdef_loader(base_path)
+            if loader_class:  # we found a message/service file, that belong to our module
                 # rospackage = fullname.partition('.')[0]
                 # # We should reproduce package structure in generated file structure
                 # dirlist = base_path.split(os.sep)
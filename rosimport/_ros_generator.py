@@ -1,12 +1,15 @@
 from __future__ import absolute_import, division, print_function
 
+import hashlib
 import os
 import sys
 import tempfile
 import traceback
 import importlib
 import site
+import struct
 import time
+import types
 
 import collections
 import pkg_resources
@@ -52,6 +55,31 @@ except ImportError:
     # If needed it should have been done before (loading a parent package).
     # this handle the case where we want to be independent of any underlying ROS system.
 
+try:
+    from ._stats import timed, count
+except (ImportError, ValueError):  # standalone usage, without statistics
+    import contextlib
+
+    @contextlib.contextmanager
+    def timed(phase, name):
+        yield
+
+    def count(counter, n=1):
+        pass
+
+try:
+    from ._utils import _atomic_write, _file_lock
+except (ImportError, ValueError):  # standalone usage, without cross-process safety
+    import contextlib
+
+    def _atomic_write(path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    @contextlib.contextmanager
+    def _file_lock(path):
+        yield
+
 # TMP bwcompat
 try:
     import genmsg.MSG_DIR as genmsg_MSG_DIR
@@ -61,6 +89,174 @@ except ImportError:  # bwcompat
     genmsg_SRV_DIR = 'srv'
 
 
+# little endian numpy dtypes of the ROS primitive types that can be stored in numpy arrays.
+# uint8 and char arrays are bytes, like genpy does, and variable length types cannot be.
+_NUMPY_DTYPES = {
+    'bool': '?',
+    'byte': 'i1',
+    'int8': 'i1',
+    'int16': '<i2',
+    'uint16': '<u2',
+    'int32': '<i4',
+    'uint32': '<u4',
+    'int64': '<i8',
+    'uint64': '<u8',
+    'float32': '<f4',
+    'float64': '<f8',
+}
+
+def _array_serializer_generator(genpy_array_serializer_generator, msg_context, package, type_, name, serialize, is_numpy):
+    """
+    Generator for array types, wrapping genpy one to fix its numpy code for primitive arrays :
+    genpy relies on ndarray.tostring() (removed from numpy 2), does not specify the byte order,
+    copies the buffer before reading it, and cannot serialize lists.
+    Here arrays are deserialized as little endian views over the buffer, and serialized with tobytes().
+    :param genpy_array_serializer_generator: the copy of the genpy generator used for the other arrays (see _genpy_generators)
+    """
+    base_type, is_array, array_len = genmsg.msgs.parse_type(type_)
+    if not (is_numpy and is_array and base_type in _NUMPY_DTYPES):
+        for y in genpy_array_serializer_generator(msg_context, package, type_, name, serialize, is_numpy):
+            yield y
+        return
+
+    # the serialization context of the genpy copy being run
+    var = genpy_array_serializer_generator.__globals__['_serial_context'] + name
+    dtype = _NUMPY_DTYPES[base_type]
+    if array_len is None:
+        for y in genpy_generator.len_serializer_generator(var, False, serialize):
+            yield y
+        length = 'length'
+    else:
+        length = array_len
+
+    if serialize:
+        if array_len is not None:
+            # a struct error, like the other fields, reported by the message _check_types()
+            yield "if len(%s) != %s:" % (var, array_len)
+            yield "  raise struct.error('%s should have %s elements')" % (name, array_len)
+        yield "buff.write(numpy.asarray(%s, dtype='%s').tobytes())" % (var, dtype)
+    else:
+        yield "start = end"
+        yield "end += %s * %s" % (length, struct.calcsize('<' + genpy_generator.compute_struct_pattern([base_type])))
+        yield "%s = numpy.frombuffer(str, dtype='%s', count=%s, offset=start)" % (var, dtype, length)
+
+
+def _rebound(module, names, **replaced):
+    """
+    Returns copies of functions of a module, looking up their globals in a copy of the module namespace,
+    where some names are replaced. The module itself is left unchanged, for its other users.
+    :param module: the module of the functions
+    :param names: the names of the functions to copy. They call each other's copies, unless replaced.
+    :param replaced: the names to replace in the namespace of the copies
+    :return: the list of the copies, in the order of names
+    """
+    namespace = dict(vars(module), **replaced)
+    copies = []
+    for name in names:
+        function = getattr(module, name)
+        copies.append(types.FunctionType(
+            function.__code__, namespace, function.__name__, function.__defaults__, function.__closure__
+        ))
+    namespace.update((n, c) for n, c in zip(names, copies) if n not in replaced)
+    return copies
+
+
+def _genpy_generators(**replaced):
+    """
+    Returns copies of the genpy msg_generator and srv_generator, generating primitive arrays with
+    _array_serializer_generator. genpy.generator is left unchanged, for its other users.
+    All genpy.generator functions are copied, so the copies share their own serialization context.
+    :param replaced: other names to replace in the namespace of the copies
+    :return: a dict {genpy generator function: its copy}
+    """
+    def array_serializer_generator(msg_context, package, type_, name, serialize, is_numpy):
+        return _array_serializer_generator(genpy_copies['array_serializer_generator'],
+                                           msg_context, package, type_, name, serialize, is_numpy)
+
+    names = sorted(
+        n for n, f in vars(genpy_generator).items()
+        if isinstance(f, types.FunctionType) and f.__module__ == genpy_generator.__name__
+    )
+    genpy_copies = dict(zip(names, _rebound(
+        genpy_generator, names, array_serializer_generator=array_serializer_generator, _context_stack=[], **replaced
+    )))
+    return {getattr(genpy_generator, n): genpy_copies[n] for n in ['msg_generator', 'srv_generator']}
+
+
+# {genpy generator function: its copy used by rosimport}
+_generator_fns = _genpy_generators()
+
+
+_NUMPY_TEMPLATE = '''
+# rosimport : numpy arrays for primitive array fields
+import numpy as _numpy
+
+
+def _numpy_serialize(self, buff):
+  """
+  serialize message into buffer, primitive arrays can be numpy arrays or sequences
+  :param buff: buffer, ``StringIO``
+  """
+  self.serialize_numpy(buff, _numpy)
+
+
+def _numpy_deserialize(self, str):
+  """
+  unpack serialized message in str into this message instance, primitive arrays being numpy arrays over str
+  :param str: byte array of serialized message, ``str``
+  """
+  return self.deserialize_numpy(str, _numpy)
+
+
+for _cls in [{classes}]:
+  if hasattr(_cls, 'deserialize_numpy'):
+    _cls.serialize, _cls.deserialize = _numpy_serialize, _numpy_deserialize
+    _cls._numpy_arrays = True
+'''
+
+
+def _numpy_source(classes):
+    """
+    Generates the code to append to a generated module, for its classes to use numpy arrays for primitive arrays fields.
+    This is what rospy.numpy_msg() does at runtime, for all classes.
+    :param classes: the names of the classes defined in the module
+    :return: the python source
+    """
+    return _NUMPY_TEMPLATE.format(classes=', '.join(classes))
+
+
+_CODEC_TEMPLATE = '''
+# rosimport : decoding from any buffer at an offset, and encoding in place
+try:
+  from rosimport._ros_codec import deserialize_from as _deserialize_from, serialize_into as _serialize_into, \\
+    serialized_size as _serialized_size, flat_serialize as _flat_serialize, flat_deserialize as _flat_deserialize
+except ImportError:  # generated code used without rosimport
+  _deserialize_from = None
+
+for _cls in [{classes}]:
+  if _deserialize_from is not None and hasattr(_cls, '_slot_types'):
+    _cls.deserialize_from, _cls.serialize_into = _deserialize_from, _serialize_into
+    _cls.serialized_size = _serialized_size{flat}
+'''
+
+_FLAT_TEMPLATE = '''
+    # flattened fixed size fields
+    _cls.serialize, _cls.deserialize = _flat_serialize, _flat_deserialize'''
+
+
+def _codec_source(classes, flat=False):
+    """
+    Generates the code to append to a generated module, adding rosimport codec methods to its classes :
+    deserialize_from(buf, offset=0), serialize_into(buf, offset=0) and serialized_size() (see _ros_codec).
+    :param classes: the names of the classes defined in the module
+    :param flat: whether serialize() and deserialize() are replaced by the codec ones, reading and writing
+    consecutive fixed size fields with one struct, even across nested messages and fixed size arrays.
+    Without rosimport, the classes keep the genpy ones.
+    :return: the python source
+    """
+    return _CODEC_TEMPLATE.format(classes=', '.join(classes), flat=_FLAT_TEMPLATE if flat else '')
+
+
 class MsgGenerationFailed(Exception):
     pass
 
@@ -73,31 +269,203 @@ class PkgAlreadyExists(Exception):
     pass
 
 
-def _generator_factory(generator, directory_name, file_extension):
+def _filter_rosdef_files(files, file_extension):
+    # checking if we have files with unknown extension to except early
+    for f in files:
+        if not f.endswith(file_extension):
+            print("WARNING: {f} doesnt have the proper {file_extension} extension. It has been Ignored.".format(**locals()), file=sys.stderr)
+
+    return [f for f in files if f.endswith(file_extension)]
+
+
+_INITPY_TEMPLATE = '''# This Python file uses the following encoding: utf-8
+"""autogenerated by rosimport. Do not edit."""
+import sys as _sys
+
+# generated classes, and the generated module defining them
+_modules = {{
+{modules}}}
+
+__all__ = sorted(_modules)
+
+if _sys.version_info >= (3, 5):
+    import importlib as _importlib
+
+    def __getattr__(name):
+        # importing (and generating if needed) a class only when it is first accessed
+        try:
+            module = _modules[name]
+        except KeyError:
+            raise AttributeError("module {{0!r}} has no attribute {{1!r}}".format(__name__, name))
+        loader = getattr(__spec__, 'loader', None)
+        if hasattr(loader, 'import_submodule'):
+            # the rosimport loader finds the modules, even when the importer is not active anymore
+            submodule = loader.import_submodule(module)
+        else:  # generated code used without rosimport
+            submodule = _importlib.import_module('.' + module, __name__)
+        value = getattr(submodule, name)
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(globals()) | set(_modules))
+
+    if _sys.version_info < (3, 7):
+        # without module __getattr__ (PEP 562), the class of the module looks up the missing attributes
+        import types as _types
+
+        class _LazyModule(_types.ModuleType):
+            def __getattr__(self, name):
+                return __getattr__(name)
+
+            def __dir__(self):
+                return __dir__()
+
+        _sys.modules[__name__].__class__ = _LazyModule
+
+else:
+{imports}
+'''
 
-    def _generator_py_pkg(files, package, outdir, search_path=None, initpy=True):
+
+def _initpy_source(module_types):
+    """
+    Generates the source of the __init__ module of a generated package.
+    The generated classes are imported lazily, on first access (PEP 562, or the module class before python 3.7),
+    falling back to eager imports on python < 3.5, where the class of a module cannot be changed.
+    :param module_types: a dict {module name: [names of the classes it defines]}
+    :return: the python source of the __init__ module
+    """
+    return _INITPY_TEMPLATE.format(
+        modules=''.join("    '{0}': '{1}',\n".format(t, m) for m in sorted(module_types) for t in module_types[m]),
+        imports=''.join("    from .{0} import *\n".format(m) for m in sorted(module_types)) or '    pass\n',
+    )
+
+
+def _generator_src_factory(generator, file_extension, type_suffixes):
+
+    def _module_types(files):
+        """Returns the generated module names, and the classes they define, for a list of ros definition files"""
+        return {
+            '_' + genpy_generator.compute_resource_name(f, file_extension): [
+                genpy_generator.compute_resource_name(f, file_extension) + s for s in type_suffixes
+            ]
+            for f in files
+        }
+
+    def _generator_py_src(files, package, search_path=None, initpy=True, lazy=False, spec_cache=None, numpy=False,
+                          flat=False):
         """
-        Generates python code from ROS definition files
+        Generates python code from ROS definition files, in memory.
         :param files: the list of ros definition files to generate from
         :param package: the ROS package for which we are generating messages / services
-        :param outdir: the directory where to output the code generated for this package.
         :param search_path: a dict where keys are ROS package names, and value is a list of path to directory containing '.msg' files
-        :param initpy: Whether or not generate the __init__.py for the package
-        :return:
+        :param initpy: Whether or not generate the __init__ module for the package
+        :param lazy: Whether to only generate the __init__ module. The other modules are expected to be generated when imported.
+        :param spec_cache: optionally a RosdefSpecCache, to reuse the ROS definitions it has already parsed
+        :param numpy: Whether the generated classes deserialize primitive arrays as numpy arrays, viewing the buffer.
+        :param flat: Whether the generated classes serialize with the rosimport codec, flattening fixed size fields.
+        :return: a dict {module name: python source}, module names being relative to the generated package
         """
 
         # Note only msg files can be used as dependencies.
         # setting search path here ensures it is stored in ros_search_path
         search_path = {} if search_path is None else search_path
 
-        # checking if we have files with unknown extension to except early
-        for f in files:
-            if not f.endswith(file_extension):
-                print("WARNING: {f} doesnt have the proper {file_extension} extension. It has been Ignored.".format(**locals()), file=sys.stderr)
+        sources = {}
+        filtered_files = _filter_rosdef_files(files, file_extension)
+
+        if filtered_files:
+
+            if not genmsg.is_legal_resource_base_name(package):
+                raise genmsg.MsgGenerationException(
+                    "package name '{package}' is illegal and cannot be used in message generation.".format(**locals())
+                )
+
+            # one context for all the files of the package, like genpy does
+            if spec_cache is None:
+                msg_context = genmsg.msg_loader.MsgContext.create_default()
+                spec_loader = generator.spec_loader_fn
+                generator_fn = _generator_fns.get(generator.generator_fn, generator.generator_fn)
+            else:
+                msg_context = spec_cache.msg_context(search_path)
+                spec_loader = spec_cache.load_spec
+                generator_fn = spec_cache.generator_fn(generator.generator_fn)
+            for f in ([] if lazy else filtered_files):
+                try:
+                    f = os.path.abspath(f)
+                    full_type = genmsg.gentools.compute_full_type_name(package, os.path.basename(f))
+                    with timed('parse', package):
+                        spec = spec_loader(msg_context, f, full_type)
+                    module_name = '_' + genpy_generator.compute_resource_name(f, file_extension)
+                    with timed('generate', package):
+                        sources[module_name] = '\n'.join(generator_fn(msg_context, spec, search_path)) + '\n'
+                        if numpy:
+                            sources[module_name] += _numpy_source(_module_types([f])[module_name])
+                        sources[module_name] += _codec_source(_module_types([f])[module_name], flat=flat)
+                    count('generated_modules')
+
+                except genmsg.InvalidMsgSpec as e:
+                    print("ERROR: ", e, file=sys.stderr)
+                    raise
+                except genmsg.MsgGenerationException as e:
+                    print("ERROR: ", e, file=sys.stderr)
+                    raise
+                except Exception as e:
+                    traceback.print_exc()
+                    print("ERROR: ", e)
+                    raise
+
+            # optionally we can generate __init__
+            if initpy:
+                sources['__init__'] = _initpy_source(_module_types(filtered_files))
+
+        return sources
+
+    _generator_py_src.module_types = _module_types
+    return _generator_py_src
+
+
+def _outdir_lock_path(outdir):
+    """
+    Returns the path of the lock file of a generated package directory.
+    It is in the temporary directory, keyed on the package directory path, so that site directories
+    (like the ones written by ``python -m rosimport compile -o``) only contain python code.
+    :param outdir: the directory of the generated package
+    """
+    key = hashlib.sha1(os.path.abspath(outdir).encode('utf-8')).hexdigest()
+    return os.path.join(tempfile.gettempdir(), 'rosimport-{0}.lock'.format(key))
+
+
+def _generator_factory(generator, directory_name, file_extension, type_suffixes):
+
+    _generator_py_src = _generator_src_factory(generator, file_extension, type_suffixes)
+
+    def _generator_py_pkg(files, package, outdir, search_path=None, initpy=True, lazy=False, spec_cache=None, numpy=False,
+                          flat=False):
+        """
+        Generates python code from ROS definition files
+        :param files: the list of ros definition files to generate from
+        :param package: the ROS package for which we are generating messages / services
+        :param outdir: the directory where to output the code generated for this package.
+        :param search_path: a dict where keys are ROS package names, and value is a list of path to directory containing '.msg' files
+        :param initpy: Whether or not generate the __init__.py for the package
+        :param lazy: Whether to only generate the __init__.py. The other modules are expected to be generated when imported.
+        :param spec_cache: optionally a RosdefSpecCache, to reuse the ROS definitions it has already parsed
+        :param numpy: Whether the generated classes deserialize primitive arrays as numpy arrays, viewing the buffer.
+        :param flat: Whether the generated classes serialize with the rosimport codec, flattening fixed size fields.
+        :return:
+        """
 
-        filtered_files = [f for f in files if f.endswith(file_extension)]
         genset = set()
 
+        # generating in memory first, we will write only valid code
+        sources = _generator_py_src(
+            files, package, search_path=search_path, initpy=False, lazy=lazy, spec_cache=spec_cache, numpy=numpy,
+            flat=flat,
+        )
+        filtered_files = _filter_rosdef_files(files, file_extension)
+
         if filtered_files:
 
             if not os.path.exists(outdir):
@@ -109,52 +477,59 @@ def _generator_factory(generator, directory_name, file_extension):
                 except OSError as e:
                     if not os.path.exists(outdir):
                         raise
-            try:
-                retcode = generator.generate_messages(
-                    package=package,
-                    package_files=filtered_files,
-                    outdir=outdir,
-                    search_path=search_path
-                )
-                assert retcode == 0
-
-                # because the OS interface might not be synchronous....
-                while not os.path.exists(outdir):
-                    time.sleep(.1)
-
-            except genmsg.InvalidMsgSpec as e:
-                print("ERROR: ", e, file=sys.stderr)
-                raise
-            except genmsg.MsgGenerationException as e:
-                print("ERROR: ", e, file=sys.stderr)
-                raise
-            except Exception as e:
-                traceback.print_exc()
-                print("ERROR: ", e)
-                raise
+
+            # each file is replaced atomically, other processes never see partially written modules.
+            for module_name, source in sources.items():
+                _atomic_write(os.path.join(outdir, module_name + '.py'), source.encode('utf-8'))
 
             # optionally we can generate __init__.py
             if initpy:
                 init_path = os.path.join(outdir, '__init__.py')
                 # Note if it already exists, we overwrite it. This should accumulate generated modules.
-                genpy_generate_initpy.write_modules(outdir)
+                # The lock makes sure the modules generated by other processes in the meantime are not forgotten.
+                with _file_lock(_outdir_lock_path(outdir)):
+                    module_types = _generator_py_src.module_types(
+                        [f[1:-len('.py')] + file_extension for f in os.listdir(outdir) if f.startswith('_') and f.endswith('.py')]
+                    )
+                    module_types.update(_generator_py_src.module_types(filtered_files))
+                    _atomic_write(init_path, _initpy_source(module_types).encode('utf-8'))
                 genset.add(init_path)
             else:  # we list all files, only if init.py was not created (and user has to import one by one)
-                for f in files:
-                    f, _ = os.path.splitext(f)  # removing extension
-                    os.path.relpath(outdir)
-                    genset.add(os.path.join(outdir, '_' + os.path.basename(f) + '.py'))
+                for module_name in sources:
+                    genset.add(os.path.join(outdir, module_name + '.py'))
 
         return genset
 
     return _generator_py_pkg
 
 # TODO : get extensions and dir from genmsg
-_genmsgpkg_py = _generator_factory(genpy_generator.MsgGenerator(), 'msg', '.msg')
-_gensrvpkg_py = _generator_factory(genpy_generator.SrvGenerator(), 'srv', '.srv')
+_genmsgpkg_py = _generator_factory(genpy_generator.MsgGenerator(), 'msg', '.msg', [''])
+_gensrvpkg_py = _generator_factory(genpy_generator.SrvGenerator(), 'srv', '.srv', ['', 'Request', 'Response'])
+_genmsgsrc_py = _generator_src_factory(genpy_generator.MsgGenerator(), '.msg', [''])
+_gensrvsrc_py = _generator_src_factory(genpy_generator.SrvGenerator(), '.srv', ['', 'Request', 'Response'])
+
+
+def genros_py_outdir(package, sitedir, directory_name):
+    """
+    Computes the directory where the python code for a package will be generated,
+    following ROS conventions ('msg'/'srv' subpackage)
+    :param package: the package for which we want to generate these messages/services.
+    This is a string separated with '.', the head element being the ros package,
+    the tail being the optional python subpackage where the code will be generated.
+    :param sitedir: the site directory where to put the generated package.
+    :param directory_name: the generated subpackage name, 'msg' or 'srv'
+    :return: the path of the generated subpackage directory
+    """
+    outdir = sitedir
+    for pkg in package.split('.'):
+        # removing the trailing 'msg'/'srv' if present, to enforce it if not
+        if not (package.endswith(pkg) and pkg == directory_name):
+            outdir = os.path.join(outdir, pkg)
+    return os.path.join(outdir, directory_name)
 
 
-def genrosmsg_py(rosdef_files, package, sitedir, search_path=None):
+def genrosmsg_py(rosdef_files, package, sitedir, search_path=None, lazy=False, spec_cache=None, numpy=False,
+                 flat=False):
     """
     Generates message/services modules for a package, in that package directory,
     in a subpackage called 'msg'/'srv', following ROS conventions
@@ -166,17 +541,18 @@ def genrosmsg_py(rosdef_files, package, sitedir, search_path=None):
     :param search_path: optionally a mapping of the form {package: [list of paths]} , in order to retrieve message dependencies
     Note that all dependencies must have been previously generated, or passed in the rosdef_files list,
     otherwise generation will fail if not included in search_path, or import will fail afterwards...
+    :param lazy: if True, only the package __init__.py is generated, the modules are generated by rosimport finders on import.
+    :param spec_cache: optionally a RosdefSpecCache, to reuse the ROS definitions it has already parsed
+    :param numpy: if True, the generated classes deserialize primitive arrays as numpy arrays, viewing the buffer.
+    :param flat: if True, the generated classes serialize with the rosimport codec, reading and writing
+    consecutive fixed size fields, including the ones of nested messages and fixed size arrays, with one struct.
     :return: the list of files generated
     """
 
     # Computing outdir_pkg from sitedir and package
     rospackage = package.partition('.')[0]
 
-    outdir = sitedir
-    for pkg in package.split('.'):
-        # removing the trailing 'msg' if present, to enforce it if not
-        if not (package.endswith(pkg) and pkg == 'msg'):
-            outdir = os.path.join(outdir, pkg)
+    outdir = genros_py_outdir(package, sitedir, 'msg')
 
     search_path = {} if search_path is None else search_path
 
@@ -189,15 +565,20 @@ def genrosmsg_py(rosdef_files, package, sitedir, search_path=None):
     (generated_pkg,) = _genmsgpkg_py(
         files=[f for f in rosdef_files if f.endswith('.msg')],
         package=rospackage,
-        outdir=os.path.join(outdir, 'msg'),
+        outdir=outdir,
         search_path=search_path,
-        initpy=True
+        initpy=True,
+        lazy=lazy,
+        spec_cache=spec_cache,
+        numpy=numpy,
+        flat=flat,
     )
 
     return sitedir, generated_pkg
 
 
-def genrossrv_py(rosdef_files, package, sitedir, search_path=None):
+def genrossrv_py(rosdef_files, package, sitedir, search_path=None, lazy=False, spec_cache=None, numpy=False,
+                 flat=False):
     """
     Generates message/services modules for a package, in that package directory,
     in a subpackage called 'msg'/'srv', following ROS conventions
@@ -209,17 +590,18 @@ def genrossrv_py(rosdef_files, package, sitedir, search_path=None):
     :param search_path: optionally a mapping of the form {package: [list of paths]} , in order to retrieve message dependencies
     Note that all dependencies must have been previously generated, or passed in the rosdef_files list,
     otherwise generation will fail if not included in search_path, or import will fail afterwards...
+    :param lazy: if True, only the package __init__.py is generated, the modules are generated by rosimport finders on import.
+    :param spec_cache: optionally a RosdefSpecCache, to reuse the ROS definitions it has already parsed
+    :param numpy: if True, the generated classes deserialize primitive arrays as numpy arrays, viewing the buffer.
+    :param flat: if True, the generated classes serialize with the rosimport codec, reading and writing
+    consecutive fixed size fields, including the ones of nested messages and fixed size arrays, with one struct.
     :return: the list of files generated
     """
 
     # Computing outdir_pkg from sitedir and package
     rospackage = package.partition('.')[0]
 
-    outdir = sitedir
-    for pkg in package.split('.'):
-        # removing the trailing 'srv' if present, to enforce it if not
-        if not (package.endswith(pkg) and pkg == 'srv'):
-            outdir = os.path.join(outdir, pkg)
+    outdir = genros_py_outdir(package, sitedir, 'srv')
 
     search_path = search_path or {}
 
@@ -229,14 +611,87 @@ def genrossrv_py(rosdef_files, package, sitedir, search_path=None):
     (generated_pkg, ) = _gensrvpkg_py(
         files=[f for f in rosdef_files if f.endswith('.srv')],
         package=rospackage,
-        outdir=os.path.join(outdir, 'srv'),
+        outdir=outdir,
         search_path=search_path,
-        initpy=True
+        initpy=True,
+        lazy=lazy,
+        spec_cache=spec_cache,
+        numpy=numpy,
+        flat=flat,
     )
 
     return sitedir, generated_pkg
 
 
+def genrosmsg_py_sources(rosdef_files, package, search_path=None, initpy=True, lazy=False, spec_cache=None, numpy=False,
+                         flat=False):
+    """
+    Generates message modules for a package in memory, without touching the filesystem.
+    :param rosdef_files: the .msg files to use as input for generating the python message classes
+    :param package: the package for which we want to generate these messages.
+    This is a string separated with '.', the head element being the ros package,
+    the tail being the optional python subpackage where the code would be generated.
+    :param search_path: optionally a mapping of the form {package: [list of paths]} , in order to retrieve message dependencies
+    :param initpy: Whether or not generate the __init__ module for the package
+    :param lazy: if True, only the __init__ module is generated, the modules are generated by rosimport finders on import.
+    :param spec_cache: optionally a RosdefSpecCache, to reuse the ROS definitions it has already parsed
+    :param numpy: if True, the generated classes deserialize primitive arrays as numpy arrays, viewing the buffer.
+    :param flat: if True, the generated classes serialize with the rosimport codec, reading and writing
+    consecutive fixed size fields, including the ones of nested messages and fixed size arrays, with one struct.
+    :return: a dict {module name: python source}, module names being relative to the 'msg' subpackage ('__init__', '_MyMsg', ...)
+    """
+    rospackage = package.partition('.')[0]
+
+    search_path = {} if search_path is None else search_path
+
+    # Same as genrosmsg_py, need to be done before generation to avoid useless harmful recursive self imports
+    search_path.setdefault(rospackage, {os.path.dirname(m) for m in rosdef_files})
+
+    return _genmsgsrc_py(
+        files=[f for f in rosdef_files if f.endswith('.msg')],
+        package=rospackage,
+        search_path=search_path,
+        initpy=initpy,
+        lazy=lazy,
+        spec_cache=spec_cache,
+        numpy=numpy,
+        flat=flat,
+    )
+
+
+def genrossrv_py_sources(rosdef_files, package, search_path=None, initpy=True, lazy=False, spec_cache=None, numpy=False,
+                         flat=False):
+    """
+    Generates service modules for a package in memory, without touching the filesystem.
+    :param rosdef_files: the .srv files to use as input for generating the python service classes
+    :param package: the package for which we want to generate these services.
+    This is a string separated with '.', the head element being the ros package,
+    the tail being the optional python subpackage where the code would be generated.
+    :param search_path: optionally a mapping of the form {package: [list of paths]} , in order to retrieve message dependencies
+    :param initpy: Whether or not generate the __init__ module for the package
+    :param lazy: if True, only the __init__ module is generated, the modules are generated by rosimport finders on import.
+    :param spec_cache: optionally a RosdefSpecCache, to reuse the ROS definitions it has already parsed
+    :param numpy: if True, the generated classes deserialize primitive arrays as numpy arrays, viewing the buffer.
+    :param flat: if True, the generated classes serialize with the rosimport codec, reading and writing
+    consecutive fixed size fields, including the ones of nested messages and fixed size arrays, with one struct.
+    :return: a dict {module name: python source}, module names being relative to the 'srv' subpackage ('__init__', '_MySrv', ...)
+    """
+    rospackage = package.partition('.')[0]
+
+    search_path = search_path or {}
+
+    return _gensrvsrc_py(
+        files=[f for f in rosdef_files if f.endswith('.srv')],
+        package=rospackage,
+        search_path=search_path,
+        initpy=initpy,
+        lazy=lazy,
+        spec_cache=spec_cache,
+        numpy=numpy,
+        flat=flat,
+    )
+
+
 # def generate_rosdefs_py(files, package, sitedir=None):
 #     """
 #     Generates ros messages python modules for a set of rosdefs files.
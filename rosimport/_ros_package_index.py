@@ -0,0 +1,169 @@
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+
+"""
+A module providing an index of the ROS packages message directories.
+
+Scanning ROS_PACKAGE_PATH can be slow (a full distro, on a network filesystem...).
+So the index is built only when a package is first looked up, and stored in the generation cache directory,
+along with the modification time of each ROS_PACKAGE_PATH directory, package directory and msg directory,
+for the next processes to reuse it as long as no package, or msg directory, has been added or removed.
+
+The message directories discovered by importing packages are also stored in the index.
+When the loaders generate code in memory, or without the cache, the index is kept in memory.
+"""
+
+from ._rosdef_cache import rosdef_cache_dir
+from ._utils import _atomic_write, _verbose_message
+
+
+INDEX_NAME = 'package_index.json'
+
+
+def _has_msg_files(path):
+    try:
+        return any(f.endswith('.msg') for f in os.listdir(path))
+    except OSError:
+        return False
+
+
+def _mtimes(paths):
+    """Returns the modification time of the existing paths, {path: mtime}"""
+    mtimes = {}
+    for p in paths:
+        try:
+            mtimes[p] = os.stat(p).st_mtime
+        except OSError:
+            continue
+    return mtimes
+
+
+class RosPackageIndex(object):
+    """
+    Index of the message directories of ROS packages, built lazily and persisted on disk, unless in memory.
+    """
+
+    def __init__(self, ros_package_path=None, index_path=None, cache_dir=None, in_memory=False):
+        """
+        :param ros_package_path: the list of directories containing ROS packages. defaults to ROS_PACKAGE_PATH.
+        :param index_path: the file storing the index. defaults to a file in the generation cache directory.
+        False disables persistence.
+        :param cache_dir: the generation cache directory, like the loaders rosimport_cachedir.
+        defaults to rosdef_cache_dir(), False keeps the index in memory.
+        :param in_memory: if True, an index found in the cache is used, but nothing is written to the filesystem.
+        """
+        self.ros_package_path = ros_package_path
+        self.index_path = index_path
+        self.cache_dir = cache_dir
+        self.in_memory = in_memory
+        # {ros package: [msg directories]}
+        self.packages = None
+        self.discovered = None
+
+    def _roots(self):
+        ros_package_path = self.ros_package_path
+        if ros_package_path is None:
+            ros_package_path = os.environ.get('ROS_PACKAGE_PATH', '').split(':')
+        return [d for d in ros_package_path if d and os.path.isdir(d)]
+
+    def _index_path(self):
+        if self.index_path is False or self.cache_dir is False:
+            return None
+        if self.index_path is not None:
+            return self.index_path
+        # in memory, the cache is only read, it is not created
+        cache_dir = rosdef_cache_dir(create=not self.in_memory) if self.cache_dir is None else self.cache_dir
+        return os.path.join(cache_dir, INDEX_NAME) if cache_dir is not None else None
+
+    def _scan(self, roots):
+        """
+        Lists the packages containing a msg directory, in ROS_PACKAGE_PATH directories
+        :return: a tuple ({package: [msg directories]}, [the package and msg directories, to watch for changes])
+        """
+        packages, watched = {}, []
+        for distropath in roots:
+            for p in os.listdir(distropath):
+                package_dir = os.path.join(distropath, p)
+                if os.path.isdir(package_dir):
+                    watched.append(package_dir)
+                if os.path.exists(os.path.join(package_dir, 'msg')):
+                    packages.setdefault(p, []).append(os.path.join(package_dir, 'msg'))
+                    watched.append(os.path.join(package_dir, 'msg'))
+        return packages, watched
+
+    def _load(self):
+        """Loads the index from disk, building it if it is missing or outdated"""
+        roots = self._roots()
+        index_path = self._index_path()
+
+        stored = {}
+        if index_path is not None:
+            try:
+                with open(index_path, 'rb') as f:
+                    stored = json.loads(f.read().decode('utf-8'))
+            except (IOError, OSError, ValueError):
+                stored = {}
+
+        # discovered directories remain valid as long as they still contain messages
+        self.discovered = dict(
+            (p, [d for d in paths if _has_msg_files(d)]) for p, paths in stored.get('discovered', {}).items()
+        )
+        # a package added in a root directory changes its mtime, a msg directory added in a package changes the package's
+        mtimes = stored.get('mtimes')
+        if stored.get('roots') == roots and isinstance(mtimes, dict) and set(roots) <= set(mtimes) and \
+                _mtimes(mtimes) == mtimes:
+            _verbose_message("ROS package index loaded from {0}", index_path)
+            self.packages = stored.get('packages', {})
+        else:
+            _verbose_message("building ROS package index for {0}", roots)
+            self.packages, watched = self._scan(roots)
+            mtimes = _mtimes(roots + watched)
+            self._store(roots, mtimes)
+        self._roots_mtimes = roots, mtimes
+
+    def _store(self, roots=None, mtimes=None):
+        index_path = self._index_path() if not self.in_memory else None
+        if index_path is None:
+            return
+        roots, mtimes = (roots, mtimes) if roots is not None else self._roots_mtimes
+        try:
+            _atomic_write(index_path, json.dumps({
+                'roots': roots,
+                'mtimes': mtimes,
+                'packages': self.packages,
+                'discovered': self.discovered,
+            }, sort_keys=True).encode('utf-8'))
+        except (IOError, OSError) as e:
+            _verbose_message("{0}: could not store ROS package index: {1}", index_path, e)
+
+    def get(self, package):
+        """
+        Returns the message directories of a ROS package
+        :param package: the ROS package name
+        :return: a set of directories, or None if the package is unknown
+        """
+        if self.packages is None:
+            self._load()
+        paths = self.packages.get(package, []) + self.discovered.get(package, [])
+        return set(paths) if paths else None
+
+    def items(self):
+        """Returns all the (ROS package, set of message directories) known by the index"""
+        if self.packages is None:
+            self._load()
+        return [(p, self.get(p)) for p in sorted(set(self.packages) | set(self.discovered))]
+
+    def record(self, package, paths):
+        """
+        Records message directories discovered for a ROS package, for later processes.
+        :param package: the ROS package name
+        :param paths: the directories found for this package. Only the ones containing messages are stored.
+        """
+        if self.packages is None:
+            self._load()
+        paths = sorted(set(self.discovered.get(package, [])) | set(p for p in paths if _has_msg_files(p)))
+        if paths != self.discovered.get(package, []):
+            self.discovered[package] = paths
+            self._store()
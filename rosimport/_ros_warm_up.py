@@ -0,0 +1,211 @@
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import os
+import sys
+import threading
+import time
+
+"""
+A module to generate, in the background, the python code of the ROS packages that might be imported later.
+
+When activated, a worker thread discovers the ROS definitions reachable from sys.path and ROS_PACKAGE_PATH,
+and generates them in the generation cache, so that the first import of a package only has to load its code.
+
+The worker has a low priority : it pauses while an import generates code in the foreground,
+and it sleeps a little between packages, to leave the interpreter to the application.
+When the application imports a package, the packages it depends on are generated next.
+"""
+
+from ._ros_compiler import find_rosdef_packages, rosdef_dependencies, _compile_rosdef_package
+from ._ros_directory_finder import get_supported_ros_loaders
+from ._rosdef_loader import RosSearchPath, ros_import_search_path
+from ._stats import count
+from ._utils import _verbose_message
+
+
+def _has_rosdef_directory(path):
+    return any(os.path.isdir(os.path.join(path, loader.get_origin_subdir())) for loader, _ in get_supported_ros_loaders())
+
+
+def discover_rosdef_packages(python_path=None, search_path=None):
+    """
+    Discovers the ROS definitions packages that can be imported.
+    Only the top level directories of python_path entries are considered as packages, like imports do,
+    along with the ROS packages of the search path index (ROS_PACKAGE_PATH).
+    :param python_path: the python import paths. defaults to sys.path
+    :param search_path: the RosSearchPath to get ROS_PACKAGE_PATH packages from. defaults to the one used by imports
+    :return: an OrderedDict {package name: [rosdef files]}, like find_rosdef_packages
+    """
+    python_path = sys.path if python_path is None else python_path
+    search_path = ros_import_search_path if search_path is None else search_path
+
+    roots = []
+    for entry in python_path:
+        try:
+            children = sorted(os.listdir(entry or '.'))
+        except OSError:  # not a directory (zip file, missing directory...)
+            continue
+        roots.extend(
+            os.path.join(entry, c) for c in children
+            if not c.startswith('.') and _has_rosdef_directory(os.path.join(entry, c))
+        )
+    index = getattr(search_path, 'index', None)
+    for _, msg_dirs in index.items() if index is not None else []:
+        roots.extend(sorted(os.path.dirname(d) for d in msg_dirs))
+
+    unique_roots = []
+    for r in roots:
+        r = os.path.normpath(os.path.abspath(r))
+        if r not in unique_roots:
+            unique_roots.append(r)
+    return find_rosdef_packages(unique_roots)
+
+
+class WarmUpSearchPath(RosSearchPath):
+    """
+    The search path of a warm-up worker, separate from the one of imports.
+    Packages are found among the discovered ones, and in the package index, but never imported from the worker thread.
+    """
+
+    def add_packages(self, packages):
+        """
+        Adds the msg directories of discovered packages
+        :param packages: a dict {package name: [rosdef files]}, like discover_rosdef_packages returns
+        """
+        for package, rosdef_files in packages.items():
+            rospackage, _, subpackage = package.partition('.')
+            if subpackage == 'msg':
+                self.setdefault(rospackage, set()).update(os.path.dirname(f) for f in rosdef_files)
+
+    def try_import(self, item):
+        return None
+
+
+class RosWarmUp(threading.Thread):
+    """
+    Background worker generating ROS definitions packages in the generation cache.
+    """
+
+    # seconds to sleep between two packages, leaving the interpreter to the application
+    interval = 0.01
+
+    def __init__(self, packages=None, cache_dir=None, search_path=None, numpy=False, flat=False):
+        """
+        :param packages: a dict {package name: [rosdef files]} to generate. defaults to discover_rosdef_packages()
+        :param cache_dir: the root of the generation cache. defaults to rosdef_cache_dir()
+        :param search_path: a mapping of the form {package: [list of paths]}, in order to retrieve message dependencies.
+        defaults to a WarmUpSearchPath, finding the packages to generate.
+        :param numpy: if True, the generated classes deserialize primitive arrays as numpy arrays, like imports do.
+        :param flat: if True, the generated classes serialize with the rosimport codec, like imports do.
+        """
+        super(RosWarmUp, self).__init__(name='rosimport-warm-up')
+        self.daemon = True
+        self.cache_dir = cache_dir
+        self.search_path = WarmUpSearchPath() if search_path is None else search_path
+        if packages is not None and isinstance(self.search_path, WarmUpSearchPath):
+            self.search_path.add_packages(packages)
+        self.numpy = numpy
+        self.flat = flat
+        self._condition = threading.Condition()
+        # the packages left to generate, in order
+        self._queue = None if packages is None else list(packages.items())
+        # the packages imported by the application, whose dependencies should be generated first
+        self._requested = []
+        self._imported = set()
+        # the number of imports generating code in the foreground
+        self._foreground = 0
+        self._stopped = False
+        # the packages generated, with their results, like compile_rosdef_packages
+        self.results = []
+
+    def pending(self):
+        """Returns the names of the packages left to generate, in order"""
+        with self._condition:
+            return [p for p, _ in self._queue or []]
+
+    def stop(self, timeout=None):
+        """
+        Stops the worker after the package being generated, if any
+        :param timeout: the seconds to wait for the worker to stop, None to return without waiting
+        :return: True if the worker is stopped
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if timeout is not None and self.is_alive():
+            self.join(timeout)
+        return not self.is_alive()
+
+    @contextlib.contextmanager
+    def foreground(self, package):
+        """
+        Context manager for an import generating a package in the foreground.
+        The worker does not start generating another package until it exits,
+        and then generates the packages it depends on first.
+        :param package: the package being imported
+        """
+        with self._condition:
+            self._foreground += 1
+            self._imported.add(package)
+            if self._queue is not None:
+                for p, rosdef_files in self._queue:
+                    if p == package:
+                        self._queue.remove((p, rosdef_files))
+                        self._requested.append((p, rosdef_files))
+                        break
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._foreground -= 1
+                self._condition.notify_all()
+
+    def _promote_dependencies(self, requested):
+        """Moves the packages the requested ones depend on at the front of the queue"""
+        dependencies = set()
+        for package, rosdef_files in requested:
+            dependencies.update(rosdef_dependencies(package, rosdef_files))
+        with self._condition:
+            promoted = [(p, f) for p, f in self._queue if p.partition('.')[0] in dependencies]
+            if promoted:
+                _verbose_message("rosimport warm-up: generating {0} first", [p for p, _ in promoted])
+                self._queue[:] = promoted + [e for e in self._queue if e not in promoted]
+
+    def _next_package(self):
+        """Waits for the foreground imports to finish, and returns the next package to generate, or None"""
+        with self._condition:
+            while self._foreground and not self._stopped:
+                self._condition.wait()
+            if self._stopped:
+                return None
+            requested, self._requested = self._requested, []
+        if requested:
+            self._promote_dependencies(requested)
+        with self._condition:
+            return self._queue.pop(0) if self._queue and not self._stopped else None
+
+    def run(self):
+        if self._queue is None:
+            packages = discover_rosdef_packages(search_path=self.search_path)
+            if isinstance(self.search_path, WarmUpSearchPath):
+                self.search_path.add_packages(packages)
+            with self._condition:
+                # packages imported while discovering are not generated again
+                self._requested.extend(e for e in packages.items() if e[0] in self._imported)
+                self._queue = [e for e in packages.items() if e[0] not in self._imported]
+        _verbose_message("rosimport warm-up: {0} packages to generate", len(self._queue))
+
+        while True:
+            entry = self._next_package()
+            if entry is None:
+                break
+            package, rosdef_files = entry
+            result = _compile_rosdef_package(
+                package, rosdef_files, None, self.cache_dir, self.search_path, self.numpy, self.flat
+            )
+            if result[3] is not None:
+                _verbose_message("rosimport warm-up: {0} failed: {1}", package, result[3])
+            count('warm_up_packages')
+            self.results.append(result)
+            time.sleep(self.interval)
@@ -0,0 +1,752 @@
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import json
+import marshal
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+
+"""
+A module providing a persistent cache for the python code generated from ROS definition files.
+
+The generated code is stored in a site directory per package, definitions directory and python environment,
+along with a manifest storing, for each generated module, a key computed from everything that influences its generation :
+- the content of its .msg / .srv file,
+- the md5 and text of the resolved message dependencies,
+- the python interpreter and the genpy / rosimport versions.
+
+This way the cache can be shared between processes (and between runs),
+a package only needs to be generated once on a machine,
+and only the modules whose definition changed need to be generated again.
+
+The compiled code objects are also stored, next to the generated code,
+along with the hash of the source they have been compiled from.
+
+Processes generating the same package synchronize with a lock file, so a package is generated only once,
+and never observed partially written.
+
+The ROS definitions parsed by genmsg are cached too, since generating a package parses all its dependencies,
+and a message like std_msgs/Header would be parsed again for every package using it.
+Parsed specs are kept in memory, keyed on their type and the hash of their definition,
+and stored in a compact (marshalled) form, one file per definition directory.
+Another process then gets all the specs of a directory with a single read, without opening the definition files,
+as long as their modification time and size did not change.
+The md5 and full text of each type, computed from its whole dependency tree, are memoized the same way,
+keyed on the definitions of the type and of all its dependencies.
+"""
+
+try:
+    from importlib.util import MAGIC_NUMBER as BYTECODE_MAGIC
+except ImportError:  # python2
+    import imp
+    BYTECODE_MAGIC = imp.get_magic()
+
+BYTECODE_SUFFIX = '.rosc'
+
+# the manifest of a generated package, storing the key of the inputs of each generated module
+MANIFEST_NAME = '.rosimport_manifest'
+# the lock file next to a generated package, held while generating it
+LOCK_SUFFIX = '.lock'
+# the coarsest modification time resolution of common filesystems (FAT), in seconds.
+# A file hashed sooner than that after its last change could change again, keeping the same mtime.
+MTIME_RESOLUTION = 2.0
+
+# genmsg and genpy are setup by the generator module
+from . import _ros_generator
+from ._ros_generator import _genpy_generators, _rebound, genmsg, genpy_generator, genros_py_outdir
+from ._stats import count, timed
+from ._utils import _atomic_write, _file_lock, _verbose_message
+from ._version import __version__
+
+
+def rosdef_cache_dir(create=True):
+    """
+    Returns the root directory of the rosimport generation cache.
+    It can be configured via the ROSIMPORT_CACHE_DIR environment variable,
+    and defaults to the user cache directory (or the system temp directory if the former is not writable).
+    :param create: whether to create the cache directory if it doesn't exist yet.
+    """
+    cache_dir = os.environ.get('ROSIMPORT_CACHE_DIR')
+    if cache_dir:
+        return cache_dir
+
+    user_cache_dir = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    for d in [os.path.join(user_cache_dir, 'rosimport'), os.path.join(tempfile.gettempdir(), 'rosimport', 'cache')]:
+        if not create:
+            if os.path.isdir(d):
+                return d
+            continue
+        try:
+            if not os.path.exists(d):
+                os.makedirs(d)
+        except OSError:
+            # The cache dir might have been created by somebody else in the meantime
+            if not os.path.isdir(d):
+                continue
+        if os.access(d, os.W_OK):
+            return d
+    return None
+
+
+_generation_tag = None
+
+
+def generation_tag():
+    """
+    Returns a string identifying the code generation environment :
+    python interpreter, genpy code (along with rosimport additions to it) and rosimport version.
+    """
+    global _generation_tag
+    if _generation_tag is not None:
+        return _generation_tag
+
+    genpy_hash = hashlib.sha1()
+    for module in [genpy_generator, _ros_generator]:
+        source = os.path.splitext(module.__file__)[0] + '.py'
+        if os.path.exists(source):
+            with open(source, 'rb') as f:
+                genpy_hash.update(f.read())
+    _generation_tag = '{0}-{1}.{2} genpy-{3} rosimport-{4}'.format(
+        platform.python_implementation(), sys.version_info[0], sys.version_info[1],
+        genpy_hash.hexdigest(), __version__
+    )
+    return _generation_tag
+
+
+def compute_rosdef_keys(rosdef_files, package, search_path=None):
+    """
+    Computes the keys identifying the generated code for each of a set of ROS definition files.
+    A key depends on the content of its file and on its whole dependency tree, but not on the other files.
+    :param rosdef_files: the .msg/.srv files the python code is generated from
+    :param package: the package for which we generate the code, '.' separated, the head element being the ros package.
+    :param search_path: a mapping of the form {package: [list of paths]}, in order to retrieve message dependencies
+    :return: a dict {generated module name: key as an hexadecimal string},
+    or None if the ros definitions cannot be resolved (in which case the generator should be called to report the problem)
+    """
+    rospackage = package.partition('.')[0]
+    search_path = {} if search_path is None else search_path
+
+    msg_files = sorted(f for f in rosdef_files if f.endswith(genmsg.EXT_MSG))
+    srv_files = sorted(f for f in rosdef_files if f.endswith(genmsg.EXT_SRV))
+
+    if msg_files:
+        # Same as genrosmsg_py : our own messages have to be found in our own directory,
+        # this avoids recursive self imports while resolving dependencies.
+        search_path.setdefault(rospackage, {os.path.dirname(m) for m in msg_files})
+
+    tag = '{0} {1}'.format(generation_tag(), package).encode('utf-8')
+
+    keys = {}
+    msg_context = rosdef_spec_cache.msg_context(search_path)
+    for files in [msg_files, srv_files]:
+        for f in files:
+            key = hashlib.sha1(tag)
+            full_type = genmsg.gentools.compute_full_type_name(rospackage, os.path.basename(f))
+            key.update(full_type.encode('utf-8'))
+            key.update(rosdef_spec_cache.definition_hash(f).encode('utf-8'))
+            try:
+                with timed('parse', rospackage):
+                    spec = rosdef_spec_cache.load_spec(msg_context, f, full_type)
+                    dependencies = genmsg.msg_loader.load_depends(msg_context, spec, search_path)
+            except (genmsg.InvalidMsgSpec, genmsg.MsgNotFound) as e:
+                _verbose_message("{0}: cannot compute generation cache key: {1}", f, e)
+                return None
+
+            # the whole dependency tree matters, since dependencies definitions end up in the generated code
+            all_dependencies = set(dependencies)
+            for d in dependencies:
+                all_dependencies.update(msg_context.get_all_depends(d))
+            for d in sorted(all_dependencies):
+                dspec = msg_context.get_registered(d)
+                key.update(d.encode('utf-8'))
+                key.update(_compute_md5(msg_context, dspec).encode('utf-8'))
+                key.update(dspec.text.encode('utf-8'))
+
+            keys['_' + os.path.splitext(os.path.basename(f))[0]] = key.hexdigest()
+
+    return keys
+
+
+def rosdef_dependency_packages(rosdef_files, package, search_path=None):
+    """
+    Returns the ROS packages of the message types a set of ROS definition files directly depends on.
+    :param rosdef_files: the .msg/.srv files
+    :param package: the package for which we generate the code, '.' separated, the head element being the ros package.
+    :param search_path: a mapping of the form {package: [list of paths]}, in order to retrieve message dependencies
+    :return: a sorted list of ROS package names, including the package of the files if they depend on each other.
+    :raises genmsg.InvalidMsgSpec, genmsg.MsgNotFound: if a definition cannot be resolved.
+    """
+    rospackage = package.partition('.')[0]
+    search_path = {} if search_path is None else search_path
+    msg_files = [f for f in rosdef_files if f.endswith(genmsg.EXT_MSG)]
+    if msg_files:
+        # like compute_rosdef_keys, our own messages are found in our own directory
+        search_path.setdefault(rospackage, {os.path.dirname(m) for m in msg_files})
+
+    packages = set()
+    msg_context = rosdef_spec_cache.msg_context(search_path)
+    for f in sorted(rosdef_files):
+        full_type = genmsg.gentools.compute_full_type_name(rospackage, os.path.basename(f))
+        with timed('parse', rospackage):
+            spec = rosdef_spec_cache.load_spec(msg_context, f, full_type)
+            packages.update(d.partition('/')[0] for d in genmsg.msg_loader.load_depends(msg_context, spec, search_path))
+    return sorted(packages)
+
+
+def load_manifest(outdir):
+    """
+    Loads the manifest of a generated package, mapping each generated module to the key of its inputs.
+    :param outdir: the generated package directory
+    :return: a dict {generated module name: key}, empty if there is no valid manifest
+    """
+    try:
+        with open(os.path.join(outdir, MANIFEST_NAME), 'rb') as f:
+            manifest = json.loads(f.read().decode('utf-8'))
+    except (IOError, OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def _remove_generated_module(outdir, module_name):
+    for path in [os.path.join(outdir, module_name + '.py'), rosdef_bytecode_path(os.path.join(outdir, module_name + '.py'))]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def cached_genros_py(generator, directory_name, rosdef_files, package, search_path=None, cache_dir=None, lazy=False,
+                     numpy=False, flat=False):
+    """
+    Generates python code from ROS definition files, unless it is already present in the cache.
+    Each package has its own directory in the cache, along with a manifest of the inputs of each generated module,
+    per location of its definitions, so two workspaces with the same package never update each other's code,
+    so only the modules whose definition (or dependencies) changed are regenerated,
+    and the package __init__.py is rewritten only when the set of generated types changes.
+    :param generator: the sources generator to call on a cache miss, genrosmsg_py_sources or genrossrv_py_sources.
+    If None, the cache is only looked up, and nothing is written to it.
+    :param directory_name: the generated subpackage name, 'msg' or 'srv'
+    :param rosdef_files: the .msg/.srv files to use as input for generating the python message classes
+    :param package: the package for which we want to generate these messages.
+    :param search_path: optionally a mapping of the form {package: [list of paths]} , in order to retrieve message dependencies
+    :param cache_dir: the root of the generation cache. defaults to rosdef_cache_dir()
+    :param lazy: if True, only the package __init__.py is generated, the modules are generated on import.
+    :param numpy: if True, the generated classes deserialize primitive arrays as numpy arrays.
+    :param flat: if True, the generated classes serialize with the rosimport codec, flattening fixed size fields.
+    The code generated with these options is cached separately from the default one.
+    :return: a tuple (sitedir, generated package __init__.py) like genrosmsg_py, or None if cache cannot be used.
+    """
+    cache_dir = rosdef_cache_dir(create=generator is not None) if cache_dir is None else cache_dir
+    if cache_dir is None:
+        return None
+
+    keys = compute_rosdef_keys(rosdef_files, package, search_path=search_path)
+    if keys is None:
+        return None
+    if generator is not None:
+        # the definitions parsed to compute the keys will not need to be parsed again by the next processes
+        rosdef_spec_cache.store()
+
+    sitedir = os.path.join(cache_dir, hashlib.sha1('{0} {1}{2}{3} {4}'.format(
+        generation_tag(), package, ' numpy' if numpy else '', ' flat' if flat else '',
+        ' '.join(sorted({os.path.dirname(os.path.abspath(f)) for f in rosdef_files}))
+    ).encode('utf-8')).hexdigest())
+    outdir = genros_py_outdir(package, sitedir, directory_name)
+    gen_rosdef_pkgpath = os.path.join(outdir, '__init__.py')
+
+    outdated = _outdated_modules(outdir, keys, lazy)
+    if outdated is None:
+        _verbose_message("{0}: generated code found in cache {1}", package, sitedir)
+        count('generation_cache_hits')
+        return sitedir, gen_rosdef_pkgpath
+
+    if generator is None:
+        count('generation_cache_misses')
+        return None
+
+    _makedirs(os.path.dirname(outdir))
+    # Only one process generates a package, the others wait for it, and find it in the cache afterwards.
+    with _file_lock(outdir + LOCK_SUFFIX):
+        outdated = _outdated_modules(outdir, keys, lazy)
+        if outdated is None:
+            _verbose_message("{0}: generated code found in cache {1}, after waiting", package, sitedir)
+            count('generation_cache_hits')
+            return sitedir, gen_rosdef_pkgpath
+
+        count('generation_cache_misses')
+        stale_modules, removed_modules, types_changed = outdated
+        _verbose_message(
+            "{0}: generating {1} of {2} modules in cache {3}", package, len(stale_modules), len(keys), sitedir
+        )
+
+        # A new package is generated in a staging directory, and published all at once.
+        # An existing package is updated file by file (each write is atomic), the manifest last,
+        # so the modules listed in a manifest are always up to date, or not generated yet.
+        staging = None if os.path.exists(outdir) else '{0}.staging-{1}'.format(outdir, os.getpid())
+        gendir = staging or outdir
+        try:
+            _makedirs(gendir)
+
+            rosdef_modules = {'_' + os.path.splitext(os.path.basename(f))[0]: f for f in rosdef_files}
+            sources = {}
+            if stale_modules and not lazy:
+                sources.update(generator(
+                    rosdef_files=[rosdef_modules[m] for m in stale_modules],
+                    package=package,
+                    search_path=search_path,
+                    initpy=False,
+                    spec_cache=rosdef_spec_cache,
+                    numpy=numpy,
+                    flat=flat,
+                ))
+            if types_changed:
+                sources.update(generator(
+                    rosdef_files=rosdef_files,
+                    package=package,
+                    search_path=search_path,
+                    initpy=True,
+                    spec_cache=rosdef_spec_cache,
+                    lazy=True,
+                ))
+
+            # lazily generated modules will be generated again on import
+            for m in removed_modules + (stale_modules if lazy else []):
+                _remove_generated_module(gendir, m)
+            for m, src in sources.items():
+                _atomic_write(os.path.join(gendir, m + '.py'), src.encode('utf-8'))
+            _atomic_write(os.path.join(gendir, MANIFEST_NAME), json.dumps(keys, sort_keys=True, indent=0).encode('utf-8'))
+
+            if staging is not None:
+                os.rename(staging, outdir)
+        finally:
+            if staging is not None and os.path.exists(staging):
+                shutil.rmtree(staging, ignore_errors=True)
+
+    return sitedir, gen_rosdef_pkgpath
+
+
+def _outdated_modules(outdir, keys, lazy):
+    """
+    Compares the generated package with the keys of its inputs.
+    :return: None if it is up to date, otherwise a tuple (stale modules, removed modules, whether the types changed)
+    """
+    manifest = load_manifest(outdir)
+    stale_modules = sorted(
+        m for m in keys
+        # lazily generated modules might not be there yet, they will be generated on import.
+        if manifest.get(m) != keys[m] or (not lazy and not os.path.exists(os.path.join(outdir, m + '.py')))
+    )
+    removed_modules = sorted(set(manifest) - set(keys))
+    types_changed = set(manifest) != set(keys) or not os.path.exists(os.path.join(outdir, '__init__.py'))
+    if not stale_modules and not removed_modules and not types_changed:
+        return None
+    return stale_modules, removed_modules, types_changed
+
+
+def _makedirs(path):
+    if not os.path.exists(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # It might have been created by somebody else in the meantime
+            if not os.path.isdir(path):
+                raise
+
+
+def rosdef_bytecode_path(source_path):
+    """Returns the path of the compiled code matching a generated python file"""
+    return os.path.splitext(source_path)[0] + BYTECODE_SUFFIX
+
+
+def load_bytecode(source_path, source):
+    """
+    Loads the compiled code for a generated python file, if it has been compiled from the same source.
+    :param source_path: the path of the generated python file
+    :param source: the content of the generated python file, as bytes
+    :return: the code object, or None if it is not in the cache or is stale
+    """
+    try:
+        with open(rosdef_bytecode_path(source_path), 'rb') as f:
+            data = f.read()
+    except (IOError, OSError):
+        return None
+
+    header = BYTECODE_MAGIC + hashlib.sha1(source).digest()
+    if data[:len(header)] != header:
+        _verbose_message("{0}: stale bytecode", source_path, verbosity=2)
+        return None
+    try:
+        return marshal.loads(data[len(header):])
+    except (EOFError, ValueError, TypeError):
+        _verbose_message("{0}: bad bytecode", source_path, verbosity=2)
+        return None
+
+
+def write_bytecode(source_path, source, code):
+    """
+    Stores the compiled code for a generated python file, next to it.
+    Errors are ignored : the cache might be read-only.
+    :param source_path: the path of the generated python file
+    :param source: the content of the generated python file, as bytes
+    :param code: the code object compiled from source
+    """
+    if sys.dont_write_bytecode:
+        return
+    bytecode_path = rosdef_bytecode_path(source_path)
+    # never exposing partially written bytecode to other processes
+    try:
+        _atomic_write(bytecode_path, BYTECODE_MAGIC + hashlib.sha1(source).digest() + marshal.dumps(code))
+    except (IOError, OSError) as e:
+        _verbose_message("{0}: could not write bytecode: {1}", bytecode_path, e)
+
+
+# changing this invalidates the specs stored on disk
+SPEC_CACHE_VERSION = 2
+# the directory storing the parsed specs, in the generation cache directory
+SPECS_DIRNAME = 'specs'
+
+
+def _msg_spec_data(spec):
+    """Converts a MsgSpec to plain data, that can be marshalled"""
+    return (
+        'msg', spec.types, spec.names, [(c.type, c.name, c.val, c.val_text) for c in spec.constants],
+        spec.text, spec.full_name, spec.package, spec.short_name,
+    )
+
+
+def _msg_spec(data):
+    """Converts plain data back to a MsgSpec"""
+    _, types, names, constants, text, full_name, package, short_name = data
+    return genmsg.MsgSpec(
+        list(types), list(names), [genmsg.Constant(*c) for c in constants], text, full_name, package, short_name
+    )
+
+
+def _read_definition(file_path):
+    """Reads a definition file, the same way genmsg does. Returns its text, and the hash of its content."""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if sys.version_info >= (3,):
+        # like a file opened in text mode, with universal newlines
+        text = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+    else:
+        text = data
+    return text, hashlib.sha1(data).hexdigest()
+
+
+class _CachedMsgContext(genmsg.msg_loader.MsgContext):
+    """
+    A genmsg MsgContext getting the dependencies it is asked about from the spec cache,
+    before genmsg tries to load them itself.
+    """
+
+    def __init__(self, spec_cache, search_path):
+        super(_CachedMsgContext, self).__init__()
+        self.spec_cache = spec_cache
+        self.search_path = search_path
+        # {full type: (definition directory, definition hash)}, for the types loaded from the spec cache
+        self.definitions = {}
+        # {full type: all dependencies}
+        self._all_depends = {}
+        # {(kind, full type): value}, for the md5 and full text of the types of this context
+        self._memo = {}
+
+    def is_registered(self, full_msg_type):
+        if super(_CachedMsgContext, self).is_registered(full_msg_type):
+            return True
+        package, base_type = genmsg.package_resource_name(genmsg.msgs.bare_msg_type(full_msg_type))
+        if not package or genmsg.msgs.is_builtin(base_type) or package not in self.search_path:
+            return False
+        try:
+            file_path = genmsg.msg_loader.get_msg_file(package, base_type, self.search_path)
+            self.spec_cache.load_spec(self, file_path, '{0}/{1}'.format(package, base_type))
+        except (genmsg.MsgNotFound, genmsg.InvalidMsgSpec):
+            # genmsg will try again, and report the problem
+            return False
+        self.set_file('{0}/{1}'.format(package, base_type), file_path)
+        return True
+
+    def set_depends(self, full_msg_type, dependencies):
+        self._all_depends.clear()
+        super(_CachedMsgContext, self).set_depends(full_msg_type, dependencies)
+
+    def get_all_depends(self, full_msg_type):
+        # genmsg walks the whole tree each time, visiting shared subtrees again and again
+        all_depends = self._all_depends.get(full_msg_type)
+        if all_depends is None:
+            depends = self.get_depends(full_msg_type)
+            if depends is None:
+                raise KeyError(full_msg_type)
+            all_depends = []
+            for d in depends:
+                all_depends.append(d)
+                all_depends.extend(self.get_all_depends(d))
+            self._all_depends[full_msg_type] = all_depends
+        return list(all_depends)
+
+    def _tree_key(self, spec):
+        """
+        Returns a key identifying the definitions of a type and of all its dependencies,
+        or None if some of them were not loaded from the spec cache.
+        """
+        if isinstance(spec, genmsg.SrvSpec):
+            names = [spec.request.full_name, spec.response.full_name]
+        else:
+            names = [spec.full_name]
+        try:
+            depends = set(d for n in names for d in self.get_all_depends(n))
+            definition = self.definitions[names[0]]
+            tree = tuple(sorted((d, self.definitions[d][1]) for d in depends))
+        except KeyError:
+            return None
+        return spec.full_name, definition[1], tree, definition[0]
+
+    def memoized(self, kind, spec, compute):
+        """
+        Returns the md5 or full text of a type, computing it only if it is not known for the same definitions.
+        :param kind: 'md5' or 'full_text'
+        :param spec: the MsgSpec or SrvSpec
+        :param compute: the genmsg function computing the value
+        """
+        value = self._memo.get((kind, spec.full_name))
+        if value is None:
+            tree_key = self._tree_key(spec)
+            key = (kind,) + tree_key[:3] if tree_key is not None else None
+            value = self.spec_cache.memo_get(key) if key is not None else None
+            if value is None:
+                value = compute(self, spec)
+                if key is not None:
+                    self.spec_cache.memo_set(key, value, tree_key[3])
+            self._memo[(kind, spec.full_name)] = value
+        return value
+
+
+class RosdefSpecCache(object):
+    """
+    Cache of the ROS definitions parsed by genmsg, in memory and persisted in the generation cache directory.
+    """
+
+    def __init__(self, cache_dir=None):
+        """
+        :param cache_dir: the generation cache directory. defaults to rosdef_cache_dir().
+        False keeps the specs in memory only.
+        """
+        self.cache_dir = cache_dir
+        self._lock = threading.RLock()
+        # {(full type, definition hash): spec data}
+        self._specs = {}
+        # {definition directory: {file name: (mtime, size, definition hash)}}
+        self._files = {}
+        # {(kind, full type, definition hash, dependencies definition hashes): md5 or full text}
+        self._memos = {}
+        # directories whose content changed since they were loaded from, or stored to, disk
+        self._dirty = set()
+
+    def _store_path(self, directory):
+        cache_dir = rosdef_cache_dir(create=False) if self.cache_dir is None else self.cache_dir
+        if not cache_dir:
+            return None
+        return os.path.join(
+            cache_dir, SPECS_DIRNAME, '{0}-{1}.{2}'.format(platform.python_implementation(), *sys.version_info[:2]),
+            hashlib.sha1(directory.encode('utf-8')).hexdigest()
+        )
+
+    def _load_stored(self, directory):
+        store_path = self._store_path(directory)
+        if store_path is None:
+            return {}, {}, {}
+        try:
+            with open(store_path, 'rb') as f:
+                version, files, specs, memos = marshal.loads(f.read())
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return {}, {}, {}
+        if version != SPEC_CACHE_VERSION:
+            return {}, {}, {}
+        return files, specs, memos
+
+    def _directory_files(self, directory):
+        """Returns the known files of a directory, loading them from disk the first time"""
+        files = self._files.get(directory)
+        if files is None:
+            files, specs, memos = self._load_stored(directory)
+            self._files[directory] = files
+            self._specs.update(specs)
+            self._memos.update(memos)
+        return files
+
+    def memo_get(self, key):
+        """Returns the md5 or full text memoized for a key, or None"""
+        with self._lock:
+            value = self._memos.get(key)
+        count('md5_memo_hits' if value is not None else 'md5_memo_misses')
+        return value
+
+    def memo_set(self, key, value, directory):
+        """Memoizes the md5 or full text for a key, stored with the definitions of a directory"""
+        with self._lock:
+            self._memos[key] = value
+            self._dirty.add(directory)
+
+    def generator_fn(self, generator_fn):
+        """
+        Returns the variant of a genpy generator function getting the md5 and full text of types
+        from the memo of the contexts of this cache, instead of computing them again.
+        :param generator_fn: genpy msg_generator or srv_generator
+        """
+        return _memoized_generator_fns.get(generator_fn, generator_fn)
+
+    def definition_hash(self, file_path):
+        """
+        Returns the hash of the content of a ROS definition file, reading it only if it changed since it was hashed.
+        A file is known unchanged from its mtime and size, so a file changed within MTIME_RESOLUTION
+        of the time it was hashed is read again, until its mtime is old enough to be trusted.
+        :param file_path: the .msg / .srv file
+        :return: the sha1 of the file content, as an hexadecimal string
+        """
+        return self._definition(file_path)[1]
+
+    def _definition(self, file_path):
+        """Returns the text of a definition file, if it had to be read, and the hash of its content"""
+        directory, name = os.path.split(os.path.abspath(file_path))
+        st = os.stat(file_path)
+        with self._lock:
+            files = self._directory_files(directory)
+            known = files.get(name)
+            if known is not None and tuple(known[:2]) == (st.st_mtime, st.st_size):
+                return None, known[2]
+            text, definition_hash = _read_definition(file_path)
+            # a recent mtime is not stored, the file could still change without changing it
+            recent = time.time() - st.st_mtime < MTIME_RESOLUTION
+            files[name] = (None if recent else st.st_mtime, st.st_size, definition_hash)
+            self._dirty.add(directory)
+            return text, definition_hash
+
+    def load_spec(self, msg_context, file_path, full_name):
+        """
+        Loads a .msg / .srv file, like genmsg load_msg_from_file / load_srv_from_file,
+        parsing it only if it has not been parsed before.
+        The spec is registered in the msg_context.
+        :param msg_context: the genmsg MsgContext
+        :param file_path: the .msg / .srv file
+        :param full_name: the full type name, 'package/Type'
+        :return: the MsgSpec or SrvSpec
+        """
+        text, definition_hash = self._definition(file_path)
+        key = (full_name, definition_hash)
+        with self._lock:
+            data = self._specs.get(key)
+
+        if data is None:
+            count('spec_cache_misses')
+            if text is None:
+                text, definition_hash = _read_definition(file_path)
+            # parsing in a separate context, the one passed might already hold some specs
+            parse_context = genmsg.msg_loader.MsgContext()
+            try:
+                if file_path.endswith(genmsg.EXT_SRV):
+                    spec = genmsg.msg_loader.load_srv_from_string(parse_context, text, full_name)
+                    data = (
+                        'srv', _msg_spec_data(spec.request), _msg_spec_data(spec.response),
+                        spec.text, spec.full_name, spec.short_name, spec.package,
+                    )
+                else:
+                    data = _msg_spec_data(genmsg.msg_loader.load_msg_from_string(parse_context, text, full_name))
+            except genmsg.InvalidMsgSpec as e:
+                raise genmsg.InvalidMsgSpec('{0}: {1}'.format(file_path, e))
+            with self._lock:
+                self._specs[key] = data
+                self._dirty.add(os.path.dirname(os.path.abspath(file_path)))
+        else:
+            count('spec_cache_hits')
+
+        if data[0] == 'srv':
+            _, request, response, text, full_name, short_name, package = data
+            spec = genmsg.SrvSpec(_msg_spec(request), _msg_spec(response), text, full_name, short_name, package)
+            registered = [spec.request, spec.response]
+        else:
+            spec = _msg_spec(data)
+            registered = [spec]
+        for s in registered:
+            msg_context.register(s.full_name, s)
+            msg_context.set_file(s.full_name, file_path)
+            if isinstance(msg_context, _CachedMsgContext):
+                msg_context.definitions[s.full_name] = (os.path.dirname(os.path.abspath(file_path)), definition_hash)
+        return spec
+
+    def msg_context(self, search_path):
+        """
+        Creates a genmsg MsgContext getting the definitions from this cache.
+        :param search_path: a mapping of the form {package: [list of paths]}, in order to retrieve message dependencies
+        """
+        msg_context = _CachedMsgContext(self, search_path)
+        # registering builtins, like MsgContext.create_default() does
+        genmsg.msg_loader.load_msg_from_string(msg_context, genmsg.msg_loader.TIME_MSG, genmsg.TIME)
+        genmsg.msg_loader.load_msg_from_string(msg_context, genmsg.msg_loader.DURATION_MSG, genmsg.DURATION)
+        return msg_context
+
+    def store(self):
+        """
+        Stores the specs parsed since the last call on disk, for other processes.
+        Specs stored by other processes in the meantime are kept. Errors are ignored : the cache might be read-only.
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            for directory in sorted(dirty):
+                store_path = self._store_path(directory)
+                if store_path is None:
+                    continue
+                files, specs, memos = self._load_stored(directory)
+                files.update(self._files.get(directory, {}))
+                # forgetting removed files, and the specs of outdated definitions
+                files = dict((name, f) for name, f in files.items() if os.path.exists(os.path.join(directory, name)))
+                hashes = set(f[2] for f in files.values())
+                specs = dict((k, v) for k, v in specs.items() if k[1] in hashes)
+                specs.update((k, v) for k, v in self._specs.items() if k[1] in hashes)
+                memos = dict((k, v) for k, v in memos.items() if k[2] in hashes)
+                memos.update((k, v) for k, v in self._memos.items() if k[2] in hashes)
+                try:
+                    if not os.path.isdir(os.path.dirname(store_path)):
+                        os.makedirs(os.path.dirname(store_path))
+                    _atomic_write(store_path, marshal.dumps((SPEC_CACHE_VERSION, files, specs, memos)))
+                except (IOError, OSError) as e:
+                    _verbose_message("{0}: could not store parsed specs: {1}", store_path, e)
+
+
+# the spec cache shared by all generations in this interpreter
+rosdef_spec_cache = RosdefSpecCache()
+
+
+# genpy gets the md5 and full text of each type from genmsg functions, recomputing the whole dependency tree each time.
+# The code rosimport generates gets them from the memo of our contexts instead, genmsg and genpy are not changed.
+def _compute_md5(msg_context, spec):
+    if isinstance(msg_context, _CachedMsgContext):
+        return msg_context.memoized('md5', spec, _genmsg_compute_md5)
+    return _genmsg_compute_md5(msg_context, spec)
+
+
+def _compute_full_text(msg_context, spec):
+    if isinstance(msg_context, _CachedMsgContext):
+        return msg_context.memoized('full_text', spec, _genmsg_compute_full_text)
+    return _genmsg_compute_full_text(msg_context, spec)
+
+
+# genmsg computes the md5 of each dependency recursively, our copy gets them from the memo as well
+_genmsg_compute_md5 = _rebound(
+    genmsg.gentools, ['compute_md5', '_compute_hash', 'compute_md5_text'], compute_md5=_compute_md5
+)[0]
+_genmsg_compute_full_text = genmsg.gentools.compute_full_text
+
+# the genmsg module, as seen by the genpy generators running for rosimport
+_memoized_genmsg = types.ModuleType(genmsg.__name__, genmsg.__doc__)
+_memoized_genmsg.__dict__.update(vars(genmsg))
+_memoized_genmsg.compute_md5 = _compute_md5
+_memoized_genmsg.compute_full_text = _compute_full_text
+
+# {genpy generator function: its copy using the memo}
+_memoized_generator_fns = _genpy_generators(genmsg=_memoized_genmsg)
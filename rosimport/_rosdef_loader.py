@@ -1,6 +1,7 @@
 from __future__ import absolute_import, division, print_function
 
 import contextlib
+import functools
 import importlib
 import site
 import tempfile
@@ -8,7 +9,15 @@ import tempfile
 import shutil
 
 
-from rosimport import genrosmsg_py, genrossrv_py
+from rosimport import genrosmsg_py, genrossrv_py, genrosmsg_py_sources, genrossrv_py_sources
+from ._ros_generator import genmsg, genros_py_outdir
+
+from ._rosdef_cache import (
+    LOCK_SUFFIX, cached_genros_py, load_bytecode, rosdef_dependency_packages, rosdef_spec_cache, write_bytecode
+)
+from ._ros_package_index import RosPackageIndex
+from ._stats import count, timed
+from ._utils import _atomic_write, _file_lock, _verbose_message
 
 """
 A module to setup custom importer for .msg and .srv files
@@ -27,6 +36,11 @@ import sys
 import logging
 
 
+@contextlib.contextmanager
+def _nullcontext():
+    yield
+
+
 # Class to allow dynamic search of packages
 class RosSearchPath(dict):
     """
@@ -38,21 +52,24 @@ class RosSearchPath(dict):
     as this is too tricky to get right, and too easy to break by mistake.
     """
     def __init__(self, **ros_package_paths):
-        # we use the default ROS_PACKAGE_PATH if already setup in environment.
+        # we use the ROS_PACKAGE_PATH if already setup in environment, via an index built on first lookup.
         # This allows us to find message definitions in a ROS distro (and collaborate with pyros_setup)
-        package_paths = {}
-        for distropath in [d for d in os.environ.get('ROS_PACKAGE_PATH', '').split(':') if os.path.exists(d)]:
-            for p in [pkgd for pkgd in os.listdir(distropath) if os.path.exists(os.path.join(distropath, pkgd, 'msg'))]:
-                package_paths[p] = package_paths.get(p, set()) | {os.path.join(distropath, p, 'msg')}
+        self.index = RosPackageIndex()
 
         # we add any extra path
-        package_paths.update(ros_package_paths)
-        super(RosSearchPath, self).__init__(package_paths)
+        super(RosSearchPath, self).__init__(ros_package_paths)
+
+    def try_index(self, item):
+        paths = self.index.get(item)
+        if paths is not None:
+            self[item] = paths
+        return paths
 
     def try_import(self, item):
         try:
             # we need to import the .msg submodule (only one usable as dependency)
-            mod = importlib.import_module(item + '.msg')
+            with timed('resolve', item):
+                mod = importlib.import_module(item + '.msg')
             # import succeeded : we should get the namespace path
             # and add it to the list of paths to avoid going through this all over again...
             for p in mod.__path__:
@@ -60,16 +77,24 @@ class RosSearchPath(dict):
                 msg_path = os.path.join(p)
                 # We add a path only if we can find the 'msg' directory
                 self[item] = self.get(item, set() | ({msg_path} if os.path.exists(msg_path) else set()))
+            # remembering it for the next processes
+            self.index.record(item, self.get(item, set()))
             return mod
         except ImportError:
             # import failed
             return None
 
+    def load_index(self):
+        """Adds all the packages of the index, for users who cannot rely on dynamic discovery"""
+        for item, paths in self.index.items():
+            self.setdefault(item, paths)
+
     def __contains__(self, item):
         """ True if D has a key k, else False. """
         has = super(RosSearchPath, self).__contains__(item)
         if not has:  # attempt importing. solving ROS path setup problem with python import paths setup.
-            self.try_import(item)
+            if self.try_index(item) is None:
+                self.try_import(item)
             # Note : if ROS is setup, rospkg.RosPack can find packages
         # try again (might work now)
         return super(RosSearchPath, self).__contains__(item)
@@ -79,7 +104,8 @@ class RosSearchPath(dict):
         got = super(RosSearchPath, self).get(item)
         if got is None:
             # attempt discovery by relying on python core import feature.
-            self.try_import(item)
+            if self.try_index(item) is None:
+                self.try_import(item)
             # Note : if ROS is setup, rospkg.RosPack can find packages
         return super(RosSearchPath, self).get(item)
 
@@ -87,6 +113,153 @@ class RosSearchPath(dict):
 ros_import_search_path = RosSearchPath()
 
 
+import filefinder2.machinery
+import filefinder2.util
+
+
+class ROSGeneratedLoader(filefinder2.machinery.SourceFileLoader):
+    """
+    Python Loader for generated python code.
+    The compiled code is stored next to the generated code, along with the hash of its source,
+    so that it can be reused by any process loading the same generated code.
+
+    When generated in memory, the sources are passed as a dict {path: source},
+    and the code is compiled straight from it, the path being purely virtual.
+    """
+
+    # Set to True to never write to the filesystem, not even the bytecode of the code found in the cache
+    rosimport_in_memory = False
+
+    def __init__(self, fullname, path, sources=None, in_memory=None):
+        """
+        :param sources: the dict {path: source} of the code generated in memory, None for code on the filesystem
+        :param in_memory: whether to write nothing to the filesystem. defaults to rosimport_in_memory.
+        """
+        self.sources = sources
+        if in_memory is not None:
+            self.rosimport_in_memory = in_memory
+        super(ROSGeneratedLoader, self).__init__(fullname, path)
+
+    def get_data(self, path):
+        if self.sources is not None:
+            try:
+                return self.sources[path]
+            except KeyError:
+                raise IOError("{0} has not been generated".format(path))
+        return super(ROSGeneratedLoader, self).get_data(path)
+
+    def get_code(self, fullname):
+        with timed('compile', fullname):
+            source_path = self.get_filename(fullname)
+            source = self.get_data(source_path)
+            if self.sources is not None:  # nothing to cache, no need to touch the filesystem
+                return compile(source, source_path, 'exec', dont_inherit=True)
+            code = load_bytecode(source_path, source)
+            if code is None:
+                count('bytecode_cache_misses')
+                code = compile(source, source_path, 'exec', dont_inherit=True)
+                if not self.rosimport_in_memory:
+                    write_bytecode(source_path, source, code)
+            else:
+                count('bytecode_cache_hits')
+            return code
+
+    def exec_module(self, module):
+        # the code is retrieved first, to time only the execution
+        code = self.get_code(module.__name__)
+        with timed('exec', module.__name__):
+            exec(code, module.__dict__)
+
+
+class ROSGeneratedFinder(object):
+    """
+    Finder for the modules of a generated package.
+    It is setup for the generated package directory (a virtual one when the code is generated in memory),
+    and generates the modules on demand, from their ROS definition file, when they are first imported.
+    """
+
+    def __init__(self, path, rosdef_files=(), generator=None, sources=None):
+        """
+        :param path: the generated package directory
+        :param rosdef_files: the ROS definition files the package is generated from
+        :param generator: a function generating the python code for a list of ROS definition files, as a dict {module name: source}
+        :param sources: a dict {path: source} when the code is generated in memory, None when it is on the filesystem
+        """
+        self.path = path
+        self.rosdef_files = {'_' + os.path.splitext(os.path.basename(f))[0]: f for f in rosdef_files}
+        self.generator = generator
+        self.sources = sources
+        count('generated_finders_created')
+
+    def __repr__(self):
+        return 'ROSGeneratedFinder({!r})'.format(self.path)
+
+    def _generate(self, module_name, source_path):
+        rosdef_file = self.rosdef_files.get(module_name)
+        if rosdef_file is None or self.generator is None:
+            return False
+        if self.sources is not None:
+            _verbose_message("{0}: generating {1}", rosdef_file, source_path)
+            self.sources[source_path] = self.generator([rosdef_file])[module_name].encode('utf-8')
+            return True
+        # Only one process generates a module, the others wait for it.
+        with _file_lock(self.path + LOCK_SUFFIX):
+            if not os.path.isfile(source_path):
+                _verbose_message("{0}: generating {1}", rosdef_file, source_path)
+                _atomic_write(source_path, self.generator([rosdef_file])[module_name].encode('utf-8'))
+        return True
+
+    def find_spec(self, fullname, target=None):
+        module_name = fullname.rpartition('.')[2]
+        source_path = os.path.join(self.path, module_name + '.py')
+        # modules already generated in the cache are loaded from it, even when generating in memory
+        if (self.sources is None or source_path not in self.sources) and os.path.isfile(source_path):
+            return filefinder2.util.spec_from_loader(
+                fullname, ROSGeneratedLoader(fullname, source_path, in_memory=self.sources is not None)
+            )
+        if (self.sources is None or source_path not in self.sources) and not self._generate(module_name, source_path):
+            return None
+        return filefinder2.util.spec_from_loader(fullname, ROSGeneratedLoader(fullname, source_path, self.sources))
+
+    def find_module(self, fullname, path=None):
+        spec = self.find_spec(fullname)
+        return spec.loader if spec is not None else None
+
+    def invalidate_caches(self):
+        pass
+
+    def generate_modules(self, package):
+        """
+        Generates all the modules of the package, and compiles the ones on the filesystem,
+        so that importing them later costs only their execution.
+        :param package: the generated package name
+        """
+        for module_name in sorted(self.rosdef_files):
+            spec = self.find_spec('{0}.{1}'.format(package, module_name))
+            if spec is not None and spec.loader.sources is None and not spec.loader.rosimport_in_memory:
+                # the bytecode is stored next to the code, only code in memory would be compiled again on import
+                spec.loader.get_code(spec.name)
+
+
+# finders for generated directories, to load generated submodules with ROSGeneratedLoader.
+# These are kept here since sys.path_importer_cache can be cleared at any time.
+ros_generated_finders = {}
+
+
+def generated_dir_finder(path, rosdef_files=(), generator=None, sources=None):
+    """
+    Sets up the finder for a directory containing generated python code.
+    :param path: the generated package directory
+    :param rosdef_files: the ROS definition files the package is generated from
+    :param generator: a function generating the python code for a list of ROS definition files, as a dict {module name: source}
+    :param sources: a dict {path: source} when the code is generated in memory, None when it is on the filesystem
+    """
+    finder = ROSGeneratedFinder(path, rosdef_files=rosdef_files, generator=generator, sources=sources)
+    ros_generated_finders[path] = finder
+    sys.path_importer_cache[path] = finder
+    return finder
+
+
 def RosLoader(rosdef_extension):
     """
     Function generating ROS loaders.
@@ -97,17 +270,17 @@ def RosLoader(rosdef_extension):
         loader_file_extension = rosdef_extension
         loader_generated_subdir = 'msg'
         loader_generator = genrosmsg_py
+        loader_sources_generator = genrosmsg_py_sources
     elif rosdef_extension == '.srv':
         loader_origin_subdir = 'srv'
         loader_file_extension = rosdef_extension
         loader_generated_subdir = 'srv'
         loader_generator = genrossrv_py
+        loader_sources_generator = genrossrv_py_sources
     else:
         raise RuntimeError("RosLoader for a format {0} other than .msg or .srv is not supported".format(rosdef_extension))
 
-    import filefinder2.machinery
-
-    class ROSDefLoader(filefinder2.machinery.SourceFileLoader):
+    class ROSDefLoader(ROSGeneratedLoader):
         """
         Python Loader for Rosdef files.
         Note : We support ROS layout :
@@ -133,6 +306,31 @@ def RosLoader(rosdef_extension):
         """
 
         rosimport_tempdir = os.path.join(tempfile.gettempdir(), 'rosimport')
+        # None means the default persistent cache directory (see rosdef_cache_dir()).
+        # Set to False to disable the cache and always generate in rosimport_tempdir.
+        rosimport_cachedir = None
+        # Set to True to generate the code in memory when it is not found in the cache.
+        # Nothing is written to the filesystem then.
+        rosimport_in_memory = bool(os.environ.get('ROSIMPORT_IN_MEMORY'))
+        # The virtual site directory for code generated in memory
+        rosimport_memory_sitedir = '<rosimport>'
+        # The background worker generating packages ahead of imports (see RosWarmUp), set by RosImporter.
+        rosimport_warm_up = None
+        # Set to True to generate the package modules only when they are first imported.
+        # The generated package then relies on module __getattr__ (PEP 562, or the module class before python 3.7)
+        # to import its classes lazily.
+        rosimport_lazy = sys.version_info >= (3, 5)
+        # Set to True to generate classes deserializing their primitive arrays (float32[], int16[]...)
+        # as numpy arrays viewing the serialized buffer, instead of lists of python objects.
+        rosimport_numpy = bool(os.environ.get('ROSIMPORT_NUMPY'))
+        # Set to True to generate classes serializing with the rosimport codec (see _ros_codec),
+        # reading and writing consecutive fixed size fields, even across nested messages, with one struct.
+        rosimport_flat = bool(os.environ.get('ROSIMPORT_FLAT'))
+
+        # rosdef files already used to generate each package in this interpreter.
+        # One generated package can aggregate multiple rosdef directories (like repo/msg and repo/pkg/msg),
+        # so we need to generate from all of them at once, to get the matching code from the cache.
+        rosdef_files_generated = {}
 
         def __init__(self, fullname, path):
 
@@ -140,13 +338,6 @@ def RosLoader(rosdef_extension):
             # to normalize input
             path = os.path.normpath(path)
 
-            # Doing this in each loader, in case we are running from different processes,
-            # avoiding to reload from same file (especially useful for boxed tests).
-            # But deterministic path to avoid regenerating from the same interpreter
-            rosimport_path = os.path.join(self.rosimport_tempdir, str(os.getpid()))
-            if not os.path.exists(rosimport_path):
-                os.makedirs(rosimport_path)
-
             rospackage = fullname.partition('.')[0]
 
             if os.path.isdir(path):
@@ -155,15 +346,74 @@ def RosLoader(rosdef_extension):
                             fullname.endswith(loader_origin_subdir) and
                             any([f.endswith(loader_file_extension) for f in os.listdir(path)])
                 ):
-
-                    # TODO : dynamic in memory generation (we do not need the file ultimately...)
-                    outdir, gen_rosdef_pkgpath = loader_generator(
-                        # generate message's python code at once, for this package level.
-                        rosdef_files=[os.path.join(path, f) for f in os.listdir(path)],
-                        package=fullname,
-                        sitedir=rosimport_path,
-                        search_path=ros_import_search_path,
+                    rosdef_files = sorted(
+                        {f for f in self.rosdef_files_generated.get(fullname, []) if os.path.exists(f)} |
+                        {os.path.join(path, f) for f in os.listdir(path) if f.endswith(loader_file_extension)}
                     )
+                    self.rosdef_files_generated[fullname] = rosdef_files
+
+                    # the index of ROS_PACKAGE_PATH is persisted like the generated code, or kept in memory
+                    ros_import_search_path.index.cache_dir = self.rosimport_cachedir
+                    ros_import_search_path.index.in_memory = self.rosimport_in_memory
+
+                    # a warm-up worker waits for imports to generate their code, not to slow them down
+                    warm_up = self.rosimport_warm_up.foreground(fullname) if self.rosimport_warm_up is not None else None
+                    with warm_up or _nullcontext():
+                        generated = None
+                        sources = None
+                        if self.rosimport_cachedir is not False:
+                            # generating in the persistent cache, shared between processes,
+                            # or getting the code directly from it if it has already been generated.
+                            generated = cached_genros_py(
+                                generator=None if self.rosimport_in_memory else loader_sources_generator,
+                                directory_name=loader_generated_subdir,
+                                rosdef_files=rosdef_files,
+                                package=fullname,
+                                search_path=ros_import_search_path,
+                                cache_dir=self.rosimport_cachedir,
+                                lazy=self.rosimport_lazy,
+                                numpy=self.rosimport_numpy,
+                                flat=self.rosimport_flat,
+                            )
+
+                        if generated is None and self.rosimport_in_memory:
+                            # generating the python code in memory
+                            gen_rosdef_pkgdir = genros_py_outdir(fullname, self.rosimport_memory_sitedir, loader_generated_subdir)
+                            sources = {
+                                os.path.join(gen_rosdef_pkgdir, m + '.py'): src.encode('utf-8')
+                                for m, src in loader_sources_generator(
+                                    rosdef_files=rosdef_files,
+                                    package=fullname,
+                                    search_path=ros_import_search_path,
+                                    lazy=self.rosimport_lazy,
+                                    spec_cache=rosdef_spec_cache,
+                                    numpy=self.rosimport_numpy,
+                                    flat=self.rosimport_flat,
+                                ).items()
+                            }
+                            generated = self.rosimport_memory_sitedir, os.path.join(gen_rosdef_pkgdir, '__init__.py')
+
+                        elif generated is None:
+                            # Doing this in each loader, in case we are running from different processes,
+                            # avoiding to reload from same file (especially useful for boxed tests).
+                            # But deterministic path to avoid regenerating from the same interpreter
+                            rosimport_path = os.path.join(self.rosimport_tempdir, str(os.getpid()))
+                            if not os.path.exists(rosimport_path):
+                                os.makedirs(rosimport_path)
+
+                            generated = loader_generator(
+                                # generate message's python code at once, for this package level.
+                                rosdef_files=rosdef_files,
+                                package=fullname,
+                                sitedir=rosimport_path,
+                                search_path=ros_import_search_path,
+                                lazy=self.rosimport_lazy,
+                                spec_cache=rosdef_spec_cache,
+                                numpy=self.rosimport_numpy,
+                                flat=self.rosimport_flat,
+                            )
+
+                    outdir, gen_rosdef_pkgpath = generated
                     # TODO : handle thrown exception (cleaner than hacking the search path dict...)
                     # try:
                     #     generator.generate_messages(package, rosfiles, outdir, search_path)
@@ -183,11 +433,73 @@ def RosLoader(rosdef_extension):
                     #         # import failed
                     #         return None
 
-                    if not os.path.exists(gen_rosdef_pkgpath):
+                    if gen_rosdef_pkgpath not in (sources or {}) and not os.path.exists(gen_rosdef_pkgpath):
                         raise ImportError("{0} file not found".format(gen_rosdef_pkgpath))
 
+                    # generated submodules should also be loaded with our loader (cached bytecode or in memory)
+                    # and generated when they are first imported, if they have not been already.
+                    self.generated_finder = generated_dir_finder(
+                        os.path.dirname(gen_rosdef_pkgpath),
+                        rosdef_files=rosdef_files,
+                        generator=functools.partial(
+                            loader_sources_generator,
+                            package=fullname,
+                            search_path=ros_import_search_path,
+                            initpy=False,
+                            spec_cache=rosdef_spec_cache,
+                            numpy=self.rosimport_numpy,
+                            flat=self.rosimport_flat,
+                        ),
+                        # when generating in memory, missing modules are generated in memory, even on a cache hit.
+                        sources=sources if sources is not None or not self.rosimport_in_memory else {},
+                    )
+
+                    # the definitions of a lazy package, whose dependencies are imported with it
+                    self.lazy_rosdef_files = rosdef_files if self.rosimport_lazy else []
+                    self._dependency_modules = None
+
                     # relying on usual source file loader since we have generated normal python code
-                    super(ROSDefLoader, self).__init__(fullname, gen_rosdef_pkgpath)
+                    super(ROSDefLoader, self).__init__(fullname, gen_rosdef_pkgpath, sources=sources)
+
+        def dependency_modules(self):
+            """
+            Returns the message packages the modules of a lazy package import, to import them along with it.
+            The modules of a lazy package import them when a class is first accessed,
+            possibly once the importer is not active anymore, so they are imported now, like an eager package does.
+            :return: a list of module names, empty for an eager package
+            """
+            if self._dependency_modules is not None:
+                return self._dependency_modules
+            self._dependency_modules = []
+            if self.lazy_rosdef_files:
+                rospackage = self.name.partition('.')[0]
+                try:
+                    dependencies = rosdef_dependency_packages(self.lazy_rosdef_files, self.name, ros_import_search_path)
+                except (genmsg.InvalidMsgSpec, genmsg.MsgNotFound) as e:
+                    # the error is raised when generating the module needing it
+                    _verbose_message("{0}: cannot resolve dependencies: {1}", self.name, e)
+                    dependencies = []
+                self._dependency_modules = [
+                    # the messages of the same package are only imported by its services
+                    p + '.msg' for p in dependencies if p != rospackage or self.name == rospackage + '.srv'
+                ]
+            return self._dependency_modules
+
+        def exec_module(self, module):
+            super(ROSDefLoader, self).exec_module(module)
+            for name in self.dependency_modules():
+                importlib.import_module(name)
+
+        def import_submodule(self, name):
+            """
+            Imports a module of the generated package with its finder, even if the importer is not active anymore,
+            and sys.path_importer_cache has been cleared since. Lazy packages import their modules with it.
+            :param name: the module name, like '_MyMsg'
+            """
+            finder = self.generated_finder
+            if sys.path_importer_cache.get(finder.path) is not finder:
+                sys.path_importer_cache[finder.path] = finder
+            return importlib.import_module('{0}.{1}'.format(self.name, name))
 
         def get_gen_path(self):
             """Returning the generated path matching the import"""
@@ -0,0 +1,95 @@
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import copy
+import threading
+import timeit
+
+"""
+A module gathering statistics about rosimport work : time spent in each phase of an import, per ROS package,
+and counters for the caches and finders.
+
+Phases are timed exclusively : when a phase starts inside another one (a dependency being imported while generating code...),
+the outer phase is paused, so the times of all phases add up to the total time spent in rosimport.
+"""
+
+# The phases of an import, in the order they usually happen
+PHASES = (
+    'find',  # finder probing (ROSPathFinder, ROSDirectoryFinder)
+    'resolve',  # dependency resolution (RosSearchPath)
+    'parse',  # genmsg parsing of ROS definitions
+    'generate',  # genpy code generation
+    'compile',  # compilation of generated code
+    'exec',  # execution of generated modules
+)
+
+_lock = threading.Lock()
+_local = threading.local()
+
+# {ros package: {phase: seconds}}
+_times = {}
+# {counter: value}
+_counters = {}
+
+
+def _add_time(package, phase, elapsed):
+    with _lock:
+        package_times = _times.setdefault(package, dict.fromkeys(PHASES, 0.0))
+        package_times[phase] += elapsed
+
+
+def count(counter, n=1):
+    """
+    Increments a counter.
+    :param counter: the name of the counter
+    :param n: the increment
+    """
+    with _lock:
+        _counters[counter] = _counters.get(counter, 0) + n
+
+
+@contextlib.contextmanager
+def timed(phase, name):
+    """
+    Context manager timing a phase of an import
+    :param phase: one of PHASES
+    :param name: the ROS package, or a module name, the head element being the ROS package
+    """
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    now = timeit.default_timer()
+    if stack:  # pausing the outer phase
+        outer = stack[-1]
+        _add_time(outer[1], outer[0], now - outer[2])
+    current = [phase, name.partition('.')[0], now]
+    stack.append(current)
+    try:
+        yield
+    finally:
+        now = timeit.default_timer()
+        stack.pop()
+        _add_time(current[1], current[0], now - current[2])
+        if stack:  # resuming the outer phase
+            stack[-1][2] = now
+
+
+def stats():
+    """
+    Returns statistics about the work done by rosimport in this process.
+    :return: a dict with :
+      - 'packages': {ros package: {phase: seconds}}, with phases from PHASES
+      - 'counters': {counter: value}, counting cache hits and misses, and finders created
+    """
+    with _lock:
+        return {
+            'packages': copy.deepcopy(_times),
+            'counters': dict(_counters),
+        }
+
+
+def reset_stats():
+    """Resets all statistics"""
+    with _lock:
+        _times.clear()
+        _counters.clear()
@@ -1,6 +1,14 @@
 from __future__ import absolute_import, print_function
 
+import contextlib
+import os
 import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:  # not available on windows
+    fcntl = None
 
 
 def _verbose_message(message, *args, **kwargs):
@@ -21,3 +29,51 @@ except TypeError:
             super(_ImportError, self).__init__(*args, **kwargs)
 else:
     _ImportError = ImportError
+
+try:
+    _string_types = basestring  # python2, str and unicode path entries
+except NameError:
+    _string_types = str
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    """
+    Advisory lock on a file : only one process (or thread) holds it at a time, the others wait for it.
+    The lock file is created if needed, and left behind.
+    Where fcntl is not available, this does not lock anything.
+    :param path: the lock file path
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+# replacing an existing file atomically. os.rename does it only on POSIX.
+_replace = getattr(os, 'replace', os.rename)
+
+
+def _atomic_write(path, data):
+    """
+    Writes a file atomically : readers see either the previous content, or all the new content.
+    :param path: the path of the file
+    :param data: the content, as bytes
+    """
+    # unique per process and thread, so concurrent writers never share a temporary file
+    tmp_path = '{0}.{1}-{2}.tmp'.format(path, os.getpid(), threading.current_thread().ident)
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        _replace(tmp_path, path)
+    except (IOError, OSError):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -99,6 +99,10 @@ setuptools.setup(name='rosimport',
         'pyros_genmsg',
         'pyros_genpy'
     ],
+    extras_require={
+        # numpy arrays for primitive array fields (ROSIMPORT_NUMPY)
+        'numpy': ['numpy'],
+    },
     cmdclass={
         'prepare_release': PrepareReleaseCommand,
         'publish': PublishCommand,
@@ -0,0 +1,90 @@
+from __future__ import absolute_import, division, print_function
+
+import importlib
+import os
+import shutil
+import site
+import sys
+import tempfile
+import threading
+import unittest
+
+"""
+Testing the asyncio import API.
+"""
+
+import rosimport
+import rosimport._rosdef_loader
+
+try:
+    import asyncio
+except ImportError:  # python2
+    asyncio = None
+
+
+@unittest.skipIf(not hasattr(rosimport, 'import_async'), reason="asyncio import API requires python >= 3.5")
+class TestImportAsync(unittest.TestCase):
+    rosdeps_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'rosdeps')
+
+    rosimporter = rosimport.RosImporter()
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workspace = tempfile.mkdtemp('rosimport_tests_async')
+        for pkg in ['test_async_msgs', 'test_async_other_msgs']:
+            os.makedirs(os.path.join(cls.workspace, pkg, 'msg'))
+            with open(os.path.join(cls.workspace, pkg, 'msg', 'TestAsync.msg'), 'w') as f:
+                f.write('std_msgs/Header header\nbool test_bool\n')
+        # This is used for message definitions, not for python code
+        site.addsitedir(cls.rosdeps_path)
+        sys.path.insert(0, cls.workspace)
+        cls.rosimporter.__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.rosimporter.__exit__(None, None, None)
+        sys.path.remove(cls.workspace)
+        shutil.rmtree(cls.workspace, ignore_errors=True)
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.generated_in = []
+        self.generated_locked = []
+        from rosimport._ros_async import _prepare_lock
+        self.cached_genros_py = rosimport._rosdef_loader.cached_genros_py
+
+        def recording_cached_genros_py(*args, **kwargs):
+            self.generated_in.append(threading.current_thread())
+            self.generated_locked.append(_prepare_lock.locked())
+            return self.cached_genros_py(*args, **kwargs)
+        rosimport._rosdef_loader.cached_genros_py = recording_cached_genros_py
+
+    def tearDown(self):
+        rosimport._rosdef_loader.cached_genros_py = self.cached_genros_py
+        self.loop.close()
+
+    def test_import_async(self):
+        msgs = self.loop.run_until_complete(rosimport.import_async('test_async_msgs.msg'))
+        # generated out of the event loop thread
+        assert self.generated_in and threading.current_thread() not in self.generated_in
+
+        assert msgs is sys.modules['test_async_msgs.msg']
+        assert importlib.import_module('test_async_msgs.msg') is msgs
+        assert msgs.TestAsync(test_bool=True).test_bool is True
+
+        # already imported
+        assert self.loop.run_until_complete(rosimport.import_async('.msg', package='test_async_msgs')) is msgs
+
+    def test_import_all_async(self):
+        msgs, other_msgs, again_msgs = self.loop.run_until_complete(rosimport.import_all_async(
+            ['test_async_other_msgs.msg', 'std_msgs.msg', 'test_async_other_msgs.msg']
+        ))
+        assert msgs is again_msgs is sys.modules['test_async_other_msgs.msg']
+        assert other_msgs is sys.modules['std_msgs.msg']
+        assert msgs.TestAsync().header.__class__ is other_msgs.Header
+        # the concurrent preparations generated code one at a time
+        assert self.generated_locked and all(self.generated_locked)
+
+    def test_import_async_not_found(self):
+        with self.assertRaises(ImportError):
+            self.loop.run_until_complete(rosimport.import_async('test_async_msgs.unknown'))
@@ -0,0 +1,425 @@
+from __future__ import absolute_import, division, print_function
+
+import copy
+import os
+import pickle
+import shutil
+import site
+import subprocess
+import sys
+import tempfile
+import unittest
+from io import BytesIO
+
+"""
+Testing the decoding plans of generated message classes.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import genpy
+
+import rosimport
+from rosimport import genrosmsg_py_sources
+from rosimport._ros_codec import MessagePlan, MessagePool, message_plan, message_dtype, deserialize_batch, lazy_class
+
+
+CODEC_MSGS = {
+    'Sample.msg': 'time stamp\nfloat64 x\nuint8 flag\n',
+    'Fixed.msg': 'Sample sample\nint16[3] values\nSample[2] pair\nduration period\nbool valid\n',
+    'Record.msg': '\n'.join([
+        'std_msgs/Header header',
+        'Sample sample',
+        'int32 count',
+        'bool valid',
+        'string name',
+        'float32[] ranges',
+        'uint8[] data',
+        'int16[3] fixed',
+        'Sample[] samples',
+        'string[] tags',
+        'time[] stamps',
+        'duration period',
+        '',
+    ]),
+    'Point.msg': 'float64 x\nfloat64 y\nfloat64 z\n',
+    'Pose.msg': 'Point position\nPoint orientation\n',
+    'Covariance.msg': 'Pose pose\nfloat64[36] covariance\nPose twin\nint16[3] fixed\nbool valid\n',
+}
+
+
+class TestMessagePlan(unittest.TestCase):
+    rosdeps_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'rosdeps')
+
+    rosimporter = rosimport.RosImporter()
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workspace = tempfile.mkdtemp('rosimport_tests_codec')
+        os.makedirs(os.path.join(cls.workspace, 'test_codec_msgs', 'msg'))
+        for name, definition in CODEC_MSGS.items():
+            with open(os.path.join(cls.workspace, 'test_codec_msgs', 'msg', name), 'w') as f:
+                f.write(definition)
+        # This is used for message definitions, not for python code
+        site.addsitedir(cls.rosdeps_path)
+        sys.path.insert(0, cls.workspace)
+        cls.rosimporter.__enter__()
+        from test_codec_msgs.msg import Fixed, Record, Sample
+        cls.Fixed, cls.Record, cls.Sample = Fixed, Record, Sample
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.rosimporter.__exit__(None, None, None)
+        sys.path.remove(cls.workspace)
+        shutil.rmtree(cls.workspace, ignore_errors=True)
+
+    def record(self, i=0):
+        msg = self.Record()
+        msg.header.seq = i
+        msg.header.stamp = genpy.Time(10 + i, 20)
+        msg.header.frame_id = 'frame'
+        msg.sample = self.Sample(genpy.Time(1, 2), 0.5 * i, 1)
+        msg.count = -i
+        msg.valid = bool(i % 2)
+        msg.name = u'r\xe9cord {0}'.format(i)
+        msg.ranges = [1.5, 2.5, float(i)]
+        msg.data = b'\x00\x01'
+        msg.fixed = [1, -2, i]
+        msg.samples = [self.Sample(genpy.Time(i, 0), 2.0, 0)] * i
+        msg.tags = ['a', 'bc'][:i]
+        msg.stamps = [genpy.Time(3, 4)]
+        msg.period = genpy.Duration(-1, 5)
+        return msg
+
+    def serialize(self, msg):
+        buff = BytesIO()
+        msg.serialize(buff)
+        return buff.getvalue()
+
+    def test_plan_built_once(self):
+        assert message_plan(self.Record) is message_plan(self.Record)
+        # fixed size fields in a row are read at once, even across nested messages
+        # (decode_into, _reuse and the flat deserialize, then decode_flat, compiled on first use)
+        plan = MessagePlan(self.Sample)
+        assert plan.source.count('unpack_from') == 3
+        assert [name for name, _ in plan.columns] == ['stamp.secs', 'stamp.nsecs', 'x', 'flag']
+        assert plan.source.count('unpack_from') == 4
+
+    def test_numpy_imported_when_needed(self):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+            [self.workspace, self.rosdeps_path, os.path.dirname(os.path.dirname(os.path.dirname(__file__)))]
+        ))
+        env.pop('ROSIMPORT_NUMPY', None)
+        subprocess.check_call([sys.executable, '-c', '\n'.join([
+            'import sys, rosimport',
+            'with rosimport.RosImporter():',
+            '    from test_codec_msgs.msg import Fixed',
+            'data = rosimport.message_plan(Fixed).size(Fixed()) * b"\\0"',
+            'Fixed().deserialize_from(data)',
+            'assert "numpy" not in sys.modules',
+            'rosimport.deserialize_batch(Fixed, [data])',
+            'assert "numpy" in sys.modules or rosimport._ros_codec.numpy is None',
+        ])], env=env)
+
+    def test_decode_into_like_deserialize(self):
+        plan = message_plan(self.Record)
+        for i in range(3):
+            serialized = self.serialize(self.record(i))
+            expected = self.Record().deserialize(serialized)
+            for buf in [serialized, bytearray(serialized), memoryview(serialized)]:
+                msg = self.Record()
+                assert plan.decode_into(buf, msg) == len(serialized)
+                assert msg == expected
+
+    def test_decode_at_offset(self):
+        serialized = self.serialize(self.record(2))
+        buf = b'\xff' * 7 + serialized + b'\xff'
+        msg = self.Record()
+        assert message_plan(self.Record).decode_into(memoryview(buf), msg, offset=7) == 7 + len(serialized)
+        assert msg == self.Record().deserialize(serialized)
+
+    def test_decode_without_copy(self):
+        serialized = self.serialize(self.record(2))
+        offsets = message_plan(self.Record).field_codecs()[0](serialized, 0)
+        # the data of the uint8[] field, after its length
+        start = offsets[self.Record.__slots__.index('data')] + 4
+        for reuse in [False, True]:
+            buf = bytearray(serialized)
+            msg = self.Record()
+            assert msg.deserialize_from(buf, reuse=reuse, copy=False) == len(buf)
+            # the field views the buffer
+            assert isinstance(msg.data, memoryview) and msg.data.obj is buf
+            assert msg.data.tobytes() == b'\x00\x01'
+            buf[start] = 7
+            assert msg.data.tobytes() == b'\x07\x01'
+
+        # it is copied by default, like genpy does
+        buf = bytearray(serialized)
+        msg = self.Record()
+        msg.deserialize_from(buf)
+        buf[start] = 7
+        assert msg.data == b'\x00\x01'
+
+    def test_decode_canonical_times(self):
+        msg = self.record(1)
+        # out of range nsecs, only possible on the wire, or setting the slots directly
+        msg.sample.stamp.nsecs = msg.stamps[0].nsecs = 2500000000
+        msg.period.nsecs = 1500000000
+        serialized = self.serialize(msg)
+        # genpy canonicalizes the time and duration fields of the message
+        assert self.Record().deserialize(serialized).period == genpy.Duration(0, 500000000)
+        for reuse in [False, True]:
+            decoded = self.record(2)
+            message_plan(self.Record).decode_into(serialized, decoded, reuse=reuse)
+            assert decoded.period == genpy.Duration(0, 500000000)
+            # and the ones of nested messages and lists
+            assert decoded.sample.stamp == genpy.Time(3, 500000000) and decoded.stamps == [genpy.Time(5, 500000000)]
+        lazy = lazy_class(self.Record)().deserialize(serialized)
+        assert lazy.period == genpy.Duration(0, 500000000) and lazy.sample.stamp == genpy.Time(3, 500000000)
+
+    def test_decode_truncated(self):
+        serialized = self.serialize(self.record(2))
+        with self.assertRaises(genpy.DeserializationError):
+            message_plan(self.Record).decode_flat(serialized[:-3])
+
+    def test_generated_methods(self):
+        for i in range(3):
+            msg = self.record(i)
+            serialized = self.serialize(msg)
+            assert msg.serialized_size() == len(serialized)
+
+            # writing in place, at an offset
+            buf = bytearray(b'\xff' * (len(serialized) + 10))
+            assert msg.serialize_into(memoryview(buf), 5) == 5 + len(serialized)
+            assert buf[5:-5] == serialized and buf[:5] == buf[-5:] == b'\xff' * 5
+            # a bytearray grows as needed
+            buf = bytearray()
+            assert msg.serialize_into(buf) == len(serialized)
+            assert buf == serialized
+
+            decoded = self.Record()
+            assert decoded.deserialize_from(memoryview(buf)) == len(serialized)
+            assert decoded == self.Record().deserialize(serialized)
+
+    def test_serialize_into_errors(self):
+        msg = self.record(1)
+        with self.assertRaises(genpy.SerializationError):
+            msg.serialize_into(memoryview(bytearray(10)))
+        msg.fixed = [1, 2]
+        with self.assertRaises(genpy.SerializationError):
+            msg.serialize_into(bytearray())
+        msg = self.record(1)
+        msg.count = 'not an int'
+        with self.assertRaises(genpy.SerializationError):
+            msg.serialize_into(bytearray())
+
+    def flat_classes(self, *names):
+        """Generates the classes of the test messages with ROSIMPORT_FLAT, returning them"""
+        msg_dir = os.path.join(self.workspace, 'test_codec_msgs', 'msg')
+        sources = genrosmsg_py_sources(
+            [os.path.join(msg_dir, n + '.msg') for n in names], 'test_codec_msgs.msg',
+            search_path={'std_msgs': [os.path.join(self.rosdeps_path, 'std_msgs', 'msg')]}, flat=True
+        )
+        classes = []
+        for name in names:
+            namespace = {'__name__': 'test_codec_msgs.msg._' + name}
+            exec(compile(sources['_' + name], name, 'exec'), namespace)
+            classes.append(namespace[name])
+        return classes
+
+    def test_flat_generation(self):
+        from test_codec_msgs.msg import Covariance, Point, Pose
+        FlatCovariance, FlatRecord = self.flat_classes('Covariance', 'Record')
+
+        msg = Covariance(
+            Pose(Point(1, 2, 3), Point(4, 5, 6)), [0.5 * i for i in range(36)], Pose(Point(7, 8, 9), Point()), [1, -2, 3], True
+        )
+        serialized = self.serialize(msg)
+        flat = FlatCovariance(msg.pose, msg.covariance, msg.twin, msg.fixed, msg.valid)
+        assert self.serialize(flat) == serialized
+        decoded = FlatCovariance().deserialize(serialized)
+        # a different class, with the same fields
+        assert str(decoded) == str(Covariance().deserialize(serialized))
+        assert decoded.covariance == tuple(msg.covariance) and decoded.twin == msg.twin
+        # all the fields, including nested messages and fixed size arrays, are read with one struct
+        functions = dict(f.split('(', 1) for f in message_plan(FlatCovariance).source.split('def ')[1:])
+        assert functions['decode_into'].count('unpack_from') == 1
+        # once used, the class methods are the functions compiled by the plan, reading with that struct directly
+        assert functions['deserialize'].count('unpack_from') == 1
+        plan = message_plan(FlatCovariance)
+        assert vars(FlatCovariance)['serialize'] is plan._serialize
+        assert vars(FlatCovariance)['deserialize'] is plan._deserialize
+
+        flat.fixed = [1, 2]
+        with self.assertRaises(genpy.SerializationError):
+            self.serialize(flat)
+        with self.assertRaises(genpy.DeserializationError):
+            FlatCovariance().deserialize(serialized[:-1])
+
+        for i in range(3):
+            serialized = self.serialize(self.record(i))
+            decoded = FlatRecord().deserialize(serialized)
+            assert str(decoded) == str(self.Record().deserialize(serialized))
+            assert self.serialize(decoded) == serialized
+
+        # out of range nsecs are canonicalized like genpy does
+        msg = self.record(1)
+        msg.period.nsecs = 1500000000
+        serialized = self.serialize(msg)
+        expected = self.Record().deserialize(serialized).period
+        decoded = FlatRecord().deserialize(serialized).period
+        assert (decoded.secs, decoded.nsecs) == (expected.secs, expected.nsecs) == (0, 500000000)
+
+    def test_lazy_class(self):
+        LazyRecord = lazy_class(self.Record)
+        assert lazy_class(self.Record) is LazyRecord and issubclass(LazyRecord, self.Record)
+
+        for i in range(3):
+            serialized = self.serialize(self.record(i))
+            msg = LazyRecord().deserialize(serialized)
+            assert msg._offsets[-1] == len(serialized)
+            assert msg == self.Record().deserialize(serialized) and self.Record().deserialize(serialized) == msg
+            # all the fields were read, but they did not change
+            assert self.serialize(msg) == serialized
+
+        serialized = self.serialize(self.record(2))
+        msg = LazyRecord()
+        assert msg.deserialize_from(memoryview(b'\xff' * 3 + serialized), 3) == 3 + len(serialized)
+        # only the fields read are decoded
+        assert msg.count == -2 and msg.name == u'r\xe9cord 2'
+        assert msg._decoded == 1 << self.Record.__slots__.index('count') | 1 << self.Record.__slots__.index('name')
+        assert self.serialize(msg) == serialized
+
+        # the fields assigned or modified in place are encoded
+        msg.header.seq = 42
+        msg.tags = ['changed']
+        expected = self.record(2)
+        expected.header.seq, expected.tags = 42, ['changed']
+        assert self.serialize(msg) == self.serialize(expected)
+
+        # new messages have the default values
+        assert LazyRecord() == self.Record()
+        assert LazyRecord(count=3, name=None) == self.Record(count=3)
+        assert self.serialize(LazyRecord(count=3)) == self.serialize(self.Record(count=3))
+
+        # pickled with the generated class, and the values of the fields
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            unpickled = pickle.loads(pickle.dumps(msg, protocol))
+            assert type(unpickled) is LazyRecord and unpickled == msg
+        assert copy.deepcopy(msg) == msg and self.serialize(copy.copy(msg)) == self.serialize(msg)
+
+        with self.assertRaises(genpy.DeserializationError):
+            LazyRecord().deserialize(serialized[:-3])
+
+    def test_reuse_instances(self):
+        msg = self.Record()
+        msg.deserialize_from(self.serialize(self.record(2)), reuse=True)
+        header, samples, first, stamps = msg.header, msg.samples, msg.samples[0], msg.stamps
+        for i in [1, 2, 0]:
+            serialized = self.serialize(self.record(i))
+            assert msg.deserialize_from(serialized, reuse=True) == len(serialized)
+            assert msg == self.Record().deserialize(serialized)
+            # nested messages, lists of messages and their elements are decoded into
+            assert msg.header is header and msg.samples is samples and msg.stamps is stamps
+            if i:
+                assert msg.samples[0] is first
+        # the same element several times in a list is not decoded into more than once
+        serialized = self.serialize(self.record(2))
+        aliased = self.record(1)
+        aliased.samples, aliased.stamps = [self.Sample()] * 3, [genpy.Time()] * 2
+        aliased.deserialize_from(serialized, reuse=True)
+        assert aliased == self.Record().deserialize(serialized)
+        aliased.samples = [self.Sample(genpy.Time(1, 0), 1.0, 1), self.Sample(genpy.Time(2, 0), 2.0, 2)]
+        aliased.stamps = [genpy.Time(5, 6), genpy.Time(7, 8)]
+        expected = self.serialize(aliased)
+        aliased.samples, aliased.stamps = [self.Sample()] * 2, [genpy.Time()] * 2
+        aliased.deserialize_from(expected, reuse=True)
+        assert self.serialize(aliased) == expected
+        assert aliased.samples[0] is not aliased.samples[1] and aliased.stamps[0] is not aliased.stamps[1]
+
+        # without reuse, lists are replaced
+        msg.deserialize_from(serialized)
+        assert msg.samples is not samples and msg.header is header
+
+        pool = MessagePool(self.Record, size=1)
+        msg = pool.deserialize(self.serialize(self.record(2)))
+        pool.release(msg)
+        pool.release(self.Record())
+        serialized = self.serialize(self.record(1))
+        assert pool.deserialize(serialized) is msg and msg == self.Record().deserialize(serialized)
+        assert pool.deserialize(serialized) is not msg
+        with self.assertRaises(TypeError):
+            pool.release(self.Sample())
+
+    def test_deserialize_batch(self):
+        buffers = [self.serialize(self.record(i)) for i in range(4)]
+        columns = deserialize_batch(self.Record, buffers)
+
+        assert list(columns)[:6] == [
+            'header.seq', 'header.stamp.secs', 'header.stamp.nsecs', 'header.frame_id',
+            'sample.stamp.secs', 'sample.stamp.nsecs',
+        ]
+        assert list(columns['header.seq']) == [0, 1, 2, 3]
+        assert list(columns['count']) == [0, -1, -2, -3]
+        assert list(columns['valid']) == [False, True, False, True]
+        assert list(columns['period.secs']) == [-1] * 4
+        assert columns['name'] == [u'r\xe9cord {0}'.format(i) for i in range(4)]
+        assert columns['header.frame_id'] == ['frame'] * 4
+        assert columns['data'] == [b'\x00\x01'] * 4
+        assert columns['tags'] == [[], ['a'], ['a', 'bc'], ['a', 'bc']]
+        assert columns['samples'][2] == [self.Sample(genpy.Time(2, 0), 2.0, 0)] * 2
+        assert columns['stamps'][0] == [genpy.Time(3, 4)]
+        assert [list(r) for r in columns['ranges']] == [[1.5, 2.5, float(i)] for i in range(4)]
+        assert [list(f) for f in columns['fixed']] == [[1, -2, i] for i in range(4)]
+
+        if numpy is not None:
+            assert columns['header.seq'].dtype == numpy.uint32
+            assert columns['sample.x'].dtype == numpy.float64
+            assert columns['valid'].dtype == numpy.bool_
+            assert isinstance(columns['ranges'][0], numpy.ndarray)
+
+    def test_deserialize_batch_empty(self):
+        columns = deserialize_batch(self.Sample, [])
+        assert list(columns) == ['stamp.secs', 'stamp.nsecs', 'x', 'flag']
+        assert all(len(c) == 0 for c in columns.values())
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_message_dtype(self):
+        dtype = message_dtype(self.Sample)
+        assert dtype.names == ('stamp', 'x', 'flag')
+        assert dtype['stamp'].names == ('secs', 'nsecs')
+        assert dtype.itemsize == len(self.serialize(self.Sample()))
+
+        messages = [self.Fixed(
+            self.Sample(genpy.Time(i, 1), 0.5 * i, i), [i, -i, 3], [self.Sample(), self.Sample(genpy.Time(2, i), 1.0, 1)],
+            genpy.Duration(-i, 0), bool(i % 2)
+        ) for i in range(5)]
+        buf = b''.join(self.serialize(m) for m in messages)
+        records = numpy.frombuffer(buf, message_dtype(self.Fixed))
+        assert len(records) == 5
+        assert list(records['sample']['x']) == [0.5 * i for i in range(5)]
+        assert records['values'].tolist() == [[i, -i, 3] for i in range(5)]
+        assert list(records['pair']['stamp']['nsecs'][:, 1]) == list(range(5))
+        assert list(records['period']['secs']) == [-i for i in range(5)]
+        assert list(records['valid']) == [bool(i % 2) for i in range(5)]
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_message_dtype_variable_size(self):
+        with self.assertRaises(ValueError) as raised:
+            message_dtype(self.Record)
+        assert 'header.frame_id (string)' in str(raised.exception)
+        assert message_plan(self.Record).dtype_descr is None
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_deserialize_batch_fixed_size(self):
+        buffers = [self.serialize(self.Sample(genpy.Time(i, 2), 0.5 * i, i)) for i in range(4)]
+        columns = deserialize_batch(self.Sample, buffers)
+        # viewed at once, like other messages are decoded one by one
+        assert list(columns) == ['stamp.secs', 'stamp.nsecs', 'x', 'flag']
+        assert columns['stamp.secs'].dtype == numpy.uint32
+        assert list(columns['stamp.secs']) == list(range(4))
+        assert list(columns['x']) == [0.5 * i for i in range(4)]
+        assert list(columns['flag']) == list(range(4))
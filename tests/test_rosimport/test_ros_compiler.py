@@ -0,0 +1,102 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+"""
+Testing ahead of time generation of a whole workspace.
+"""
+
+from rosimport._ros_compiler import find_rosdef_packages, compile_rosdef_packages, rosdef_packages_graph
+from rosimport._rosdef_cache import cached_genros_py
+from rosimport.__main__ import main
+
+
+class TestRosCompiler(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp('rosimport_tests_ws')
+        self.sitedir = tempfile.mkdtemp('rosimport_tests_site')
+        self.cachedir = tempfile.mkdtemp('rosimport_tests_cache')
+        os.makedirs(os.path.join(self.workspace, 'src', 'test_ws_msgs', 'msg'))
+        os.makedirs(os.path.join(self.workspace, 'src', 'test_ws_srvs', 'srv'))
+        with open(os.path.join(self.workspace, 'src', 'test_ws_msgs', 'package.xml'), 'w') as f:
+            f.write('<package/>\n')
+        shutil.copy(
+            os.path.join(os.path.dirname(__file__), 'msg', 'TestMsg.msg'),
+            os.path.join(self.workspace, 'src', 'test_ws_msgs', 'msg')
+        )
+        with open(os.path.join(self.workspace, 'src', 'test_ws_srvs', 'srv', 'TestWsSrv.srv'), 'w') as f:
+            f.write('test_ws_msgs/TestMsg request\n---\nbool response\n')
+
+    def tearDown(self):
+        for d in [self.workspace, self.sitedir, self.cachedir]:
+            shutil.rmtree(d, ignore_errors=True)
+
+    def test_find_rosdef_packages(self):
+        packages = find_rosdef_packages([self.workspace])
+        assert list(packages) == ['test_ws_msgs.msg', 'test_ws_srvs.srv']
+        assert packages['test_ws_msgs.msg'] == [os.path.join(self.workspace, 'src', 'test_ws_msgs', 'msg', 'TestMsg.msg')]
+
+        # a package root is also accepted
+        assert list(find_rosdef_packages([os.path.join(self.workspace, 'src', 'test_ws_msgs')])) == ['test_ws_msgs.msg']
+
+    def test_compile_sitedir(self):
+        results = list(compile_rosdef_packages(find_rosdef_packages([self.workspace]), sitedir=self.sitedir))
+        assert [(p, n, e) for p, n, _, e in results] == [('test_ws_msgs.msg', 1, None), ('test_ws_srvs.srv', 1, None)]
+        # it only contains the generated code, without lock files
+        files = [os.path.join(d, f) for d, _, fs in os.walk(self.sitedir) for f in fs]
+        assert files and not [f for f in files if not f.endswith(('.py', '.pyc'))]
+
+        # the site directory is importable without rosimport
+        subprocess.check_call(
+            [sys.executable, '-c', 'from test_ws_srvs.srv import TestWsSrvRequest; TestWsSrvRequest()'],
+            cwd=self.sitedir
+        )
+
+    def test_packages_graph(self):
+        graph = rosdef_packages_graph(find_rosdef_packages([self.workspace]))
+        assert graph == {'test_ws_msgs.msg': set(), 'test_ws_srvs.srv': {'test_ws_msgs.msg'}}
+
+    def test_compile_parallel(self):
+        results = list(compile_rosdef_packages(find_rosdef_packages([self.workspace]), sitedir=self.sitedir, jobs=2))
+        # dependencies are generated first
+        assert [(p, n, e) for p, n, _, e in results] == [('test_ws_msgs.msg', 1, None), ('test_ws_srvs.srv', 1, None)]
+        assert os.path.exists(os.path.join(self.sitedir, 'test_ws_srvs', 'srv', '_TestWsSrv.py'))
+
+    @unittest.skipIf(sys.version_info < (3,), "python 2 pools do not report task errors")
+    def test_compile_parallel_errors(self):
+        # the task arguments cannot be sent to the pool processes, each package is reported failed, instead of waiting
+        results = list(compile_rosdef_packages(
+            find_rosdef_packages([self.workspace]), sitedir=self.sitedir, jobs=2, search_path={'unpicklable': lambda: None}
+        ))
+        assert sorted(p for p, _, _, _ in results) == ['test_ws_msgs.msg', 'test_ws_srvs.srv']
+        assert all(e is not None for _, _, _, e in results)
+
+    def test_compile_cache(self):
+        assert main(['compile', '--cache-dir', self.cachedir, self.workspace]) == 0
+
+        # the rosimport loaders will find the generated code in the cache
+        assert cached_genros_py(
+            None, 'msg',
+            [os.path.join(self.workspace, 'src', 'test_ws_msgs', 'msg', 'TestMsg.msg')],
+            'test_ws_msgs.msg', search_path={}, cache_dir=self.cachedir,
+        ) is not None
+
+    @unittest.skipIf(sys.version_info < (3, 5), "packages are not lazy")
+    def test_lazy_dependencies_from_cache(self):
+        # the dependencies of a lazy package are imported with it, even when they are found in the package index
+        env = dict(os.environ, ROSIMPORT_CACHE_DIR=self.cachedir, PYTHONPATH=os.pathsep.join(
+            [os.path.join(self.workspace, 'src'), os.path.dirname(os.path.dirname(os.path.dirname(__file__)))]
+        ))
+        for _ in range(2):  # generating, then from the cache
+            subprocess.check_call([sys.executable, '-c', '\n'.join([
+                'import rosimport',
+                'with rosimport.RosImporter():',
+                '    from test_ws_srvs import srv',
+                'srv.TestWsSrvRequest()',
+            ])], env=env)
@@ -0,0 +1,145 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+"""
+Testing the caches of the ROS finders, without importing anything.
+"""
+
+import rosimport._ros_directory_finder
+from rosimport import ROSDirectoryFinder, ROSPathFinder, ROSMsgLoader, ROSSrvLoader, get_supported_ros_loaders
+
+
+class TestROSDirectoryFinderSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp('rosimport_tests_finder')
+        os.makedirs(os.path.join(self.path, 'msg'))
+        os.makedirs(os.path.join(self.path, 'srv'))
+        os.makedirs(os.path.join(self.path, 'deep', 'tree', 'msg'))
+        for f in [os.path.join('msg', 'Test.msg'), os.path.join('deep', 'tree', 'msg', 'Deep.msg')]:
+            with open(os.path.join(self.path, f), 'w') as rosdef:
+                rosdef.write('bool test\n')
+
+        self.listed = []
+        self._list_directory = rosimport._ros_directory_finder._list_directory
+
+        def counting_list_directory(path):
+            self.listed.append(path)
+            return self._list_directory(path)
+        rosimport._ros_directory_finder._list_directory = counting_list_directory
+
+    def tearDown(self):
+        rosimport._ros_directory_finder._list_directory = self._list_directory
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_find_rosdef_loader(self):
+        finder = ROSDirectoryFinder(self.path, *get_supported_ros_loaders())
+        assert finder._find_rosdef_loader(os.path.join(self.path, 'msg')) is ROSMsgLoader
+        assert finder._find_rosdef_loader(os.path.join(self.path, 'srv')) is None
+        # the tree is not walked
+        assert finder._find_rosdef_loader(os.path.join(self.path, 'deep')) is None
+        assert os.path.join(self.path, 'deep', 'tree') not in self.listed
+
+        with open(os.path.join(self.path, 'srv', 'Test.srv'), 'w') as rosdef:
+            rosdef.write('bool test\n---\nbool result\n')
+        # making sure the mtime changes, whatever the filesystem resolution
+        os.utime(os.path.join(self.path, 'srv'), (0, 0))
+        assert finder._find_rosdef_loader(os.path.join(self.path, 'srv')) is ROSSrvLoader
+
+    def test_snapshots_reused(self):
+        finder = ROSDirectoryFinder(self.path, *get_supported_ros_loaders())
+        self.listed = []
+        for _ in range(3):
+            finder._find_rosdef_loader(os.path.join(self.path, 'msg'))
+        assert self.listed == []
+
+        finder.invalidate_caches()
+        finder._find_rosdef_loader(os.path.join(self.path, 'msg'))
+        assert self.listed == [os.path.join(self.path, 'msg')]
+
+
+class TestROSPathFinderMisses(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp('rosimport_tests_pathfinder')
+        os.makedirs(os.path.join(self.path, 'test_misses_pkg'))
+        self.searched = []
+        path_importer_cache = ROSPathFinder._path_importer_cache
+
+        def counting_path_importer_cache(path):
+            self.searched.append(path)
+            return path_importer_cache(path)
+        ROSPathFinder._path_importer_cache = staticmethod(counting_path_importer_cache)
+
+    def tearDown(self):
+        del ROSPathFinder._path_importer_cache
+        ROSPathFinder.invalidate_caches()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_misses_cached(self):
+        path = [os.path.join(self.path, 'test_misses_pkg')]
+        assert ROSPathFinder.find_spec('test_misses_pkg', path) is None
+        searched = len(self.searched)
+        assert searched > 0
+
+        assert ROSPathFinder.find_spec('test_misses_pkg', path) is None
+        assert len(self.searched) == searched
+
+        # a different path is a different search
+        assert ROSPathFinder.find_spec('test_misses_pkg', path + [self.path]) is None
+        assert len(self.searched) > searched
+
+    def test_misses_path_changed(self):
+        # sys.path changes in place
+        path = [os.path.join(self.path, 'test_misses_pkg')]
+        assert ROSPathFinder.find_spec('test_misses_pkg', path) is None
+        searched = len(self.searched)
+        path.append(self.path)
+        assert ROSPathFinder.find_spec('test_misses_pkg', path) is None
+        assert len(self.searched) > searched
+        searched = len(self.searched)
+        path.pop()
+        assert ROSPathFinder.find_spec('test_misses_pkg', path) is None
+        assert len(self.searched) == searched
+
+    def test_misses_bounded(self):
+        paths = [[os.path.join(self.path, 'test_misses_pkg', str(i))] for i in range(100)]
+        for path in paths:
+            assert ROSPathFinder.find_spec('test_misses_pkg', path) is None
+            assert len(ROSPathFinder._searched_paths) <= 32
+        # the recent paths are still known
+        searched = len(self.searched)
+        assert ROSPathFinder.find_spec('test_misses_pkg', paths[-2]) is None
+        assert len(self.searched) == searched
+
+    def test_misses_invalidated(self):
+        path = [os.path.join(self.path, 'test_misses_pkg')]
+        assert ROSPathFinder.find_spec('test_misses_pkg', path) is None
+        searched = len(self.searched)
+
+        ROSPathFinder.invalidate_caches()
+        assert ROSPathFinder.find_spec('test_misses_pkg', path) is None
+        assert len(self.searched) == 2 * searched
+
+    def test_root_index(self):
+        entry = os.path.join(self.path, 'test_misses_pkg', 'msg')
+        path = (entry, os.path.join(self.path, 'other'))
+        index = ROSPathFinder._root_index(path)
+        assert ROSPathFinder._root_index(path) is index
+        assert index['test_misses_pkg'] == [(entry, os.path.join(self.path, 'test_misses_pkg'), self.path)]
+        assert [e for e, _, _ in index['msg']] == [entry]
+
+        # entries without the package are not searched
+        assert ROSPathFinder.find_spec('test_other_pkg.msg', list(path)) is None
+        assert self.searched == []
+        assert ROSPathFinder.find_spec('test_misses_pkg.msg', list(path)) is None
+        assert self.searched == [self.path, os.path.join(self.path, 'test_misses_pkg'), entry]
+
+        # a different path has its own index
+        assert ROSPathFinder._root_index(path + (self.path,)) is not index
+        # text entries (unicode on python 2) are indexed, other objects are skipped
+        assert ROSPathFinder._root_index((None, u'' + entry))['test_misses_pkg'] == index['test_misses_pkg']
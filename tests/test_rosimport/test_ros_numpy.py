@@ -0,0 +1,155 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+
+"""
+Testing the generation of classes with numpy arrays for primitive array fields.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from rosimport import genrosmsg_py_sources
+from rosimport._ros_codec import lazy_class
+
+
+ARRAYS_MSG = """float32[] ranges
+float64[] values
+int16[] samples
+bool[] flags
+uint8[] data
+float32[3] position
+string[] names
+string frame_id
+"""
+
+
+def exec_sources(sources, module_name):
+    """Executes a generated module in a new namespace, returning it"""
+    namespace = {'__name__': module_name}
+    exec(compile(sources[module_name], module_name, 'exec'), namespace)
+    return namespace
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestNumpyGeneration(unittest.TestCase):
+
+    def setUp(self):
+        self.rosdefdir = tempfile.mkdtemp('rosimport_tests_rosdefs')
+        self.msg_file = os.path.join(self.rosdefdir, 'Arrays.msg')
+        with open(self.msg_file, 'w') as f:
+            f.write(ARRAYS_MSG)
+        self.Arrays = exec_sources(
+            genrosmsg_py_sources([self.msg_file], 'test_numpy_msgs.msg', search_path={}, numpy=True), '_Arrays'
+        )['Arrays']
+        self.ListArrays = exec_sources(
+            genrosmsg_py_sources([self.msg_file], 'test_numpy_msgs.msg', search_path={}), '_Arrays'
+        )['Arrays']
+
+    def tearDown(self):
+        shutil.rmtree(self.rosdefdir, ignore_errors=True)
+
+    def serialize(self, msg):
+        buff = BytesIO()
+        msg.serialize(buff)
+        return buff.getvalue()
+
+    def message(self, cls):
+        return cls(
+            ranges=[1.5, 2.5, -3.0], values=[0.1, 1e10], samples=[-2, 0, 32767], flags=[True, False],
+            data=b'\x01\x02', position=[1.0, 2.0, 3.0], names=['a', 'bc'], frame_id='base'
+        )
+
+    def test_lists_serialize_like_default_classes(self):
+        assert self.serialize(self.message(self.Arrays)) == self.serialize(self.message(self.ListArrays))
+
+    def test_deserialize_numpy_views(self):
+        serialized = self.serialize(self.message(self.ListArrays))
+        msg = self.Arrays().deserialize(serialized)
+
+        for field, dtype in [('ranges', numpy.float32), ('values', numpy.float64), ('samples', numpy.int16),
+                             ('flags', numpy.bool_), ('position', numpy.float32)]:
+            value = getattr(msg, field)
+            assert isinstance(value, numpy.ndarray), field
+            assert value.dtype == dtype, field
+            # viewing the serialized buffer, not copying it
+            assert value.base is not None, field
+        assert msg.ranges.tolist() == [1.5, 2.5, -3.0]
+        assert msg.values.tolist() == [0.1, 1e10]
+        assert msg.samples.tolist() == [-2, 0, 32767]
+        assert msg.flags.tolist() == [True, False]
+        assert msg.position.tolist() == [1.0, 2.0, 3.0]
+        # other fields are unchanged
+        assert msg.data == b'\x01\x02'
+        assert msg.names == ['a', 'bc']
+        assert msg.frame_id == 'base'
+
+        # numpy arrays serialize back to the same bytes
+        assert self.serialize(msg) == serialized
+
+        # decoding from any buffer gives the same numpy arrays
+        decoded = self.Arrays()
+        assert decoded.deserialize_from(memoryview(serialized)) == len(serialized)
+        assert isinstance(decoded.ranges, numpy.ndarray)
+        assert decoded.samples.tolist() == [-2, 0, 32767]
+        buf = bytearray()
+        assert decoded.serialize_into(buf) == len(serialized)
+        assert buf == serialized
+
+        # and so do lazy messages
+        lazy = lazy_class(self.Arrays)().deserialize(bytearray(serialized))
+        assert isinstance(lazy.ranges, numpy.ndarray) and lazy.samples.tolist() == [-2, 0, 32767]
+        lazy.samples[0] = 7
+        assert lazy.names == ['a', 'bc']
+        assert self.Arrays().deserialize(self.serialize(lazy)).samples.tolist() == [7, 0, 32767]
+
+    def test_fixed_array_length_checked(self):
+        msg = self.message(self.Arrays)
+        msg.position = numpy.zeros(2)
+        with self.assertRaises(Exception):
+            self.serialize(msg)
+
+    def test_genpy_unchanged(self):
+        import genmsg.msg_loader
+        import genpy.generator
+        from rosimport._rosdef_cache import RosdefSpecCache
+        # the numpy code is generated with or without a spec cache
+        sources = genrosmsg_py_sources(
+            [self.msg_file], 'test_numpy_msgs.msg', search_path={}, numpy=True, spec_cache=RosdefSpecCache()
+        )
+        assert "dtype='<f4'" in sources['_Arrays']
+
+        # genpy generates its own code, for its other users
+        assert genpy.generator.array_serializer_generator.__globals__ is vars(genpy.generator)
+        msg_context = genmsg.msg_loader.MsgContext.create_default()
+        spec = genmsg.msg_loader.load_msg_from_file(msg_context, self.msg_file, 'test_numpy_msgs/Arrays')
+        source = '\n'.join(genpy.generator.msg_generator(msg_context, spec, {}))
+        assert "dtype='<f4'" not in source and 'dtype=numpy.float32' in source
+
+    def test_numpy_code_cached_separately(self):
+        from rosimport._rosdef_cache import cached_genros_py
+        cachedir = tempfile.mkdtemp('rosimport_tests_cache')
+        try:
+            default_sitedir, _ = cached_genros_py(
+                genrosmsg_py_sources, 'msg', [self.msg_file], 'test_numpy_msgs.msg', search_path={}, cache_dir=cachedir
+            )
+            numpy_sitedir, _ = cached_genros_py(
+                genrosmsg_py_sources, 'msg', [self.msg_file], 'test_numpy_msgs.msg', search_path={}, cache_dir=cachedir,
+                numpy=True
+            )
+            assert default_sitedir != numpy_sitedir
+            with open(os.path.join(numpy_sitedir, 'test_numpy_msgs', 'msg', '_Arrays.py')) as f:
+                assert 'numpy.frombuffer' in f.read()
+        finally:
+            shutil.rmtree(cachedir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    import pytest
+    pytest.main(['-s', '-x', __file__])
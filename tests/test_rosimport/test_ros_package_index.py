@@ -0,0 +1,82 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+"""
+Testing the persisted ROS package index.
+"""
+
+from rosimport._ros_package_index import RosPackageIndex
+
+
+class CountingPackageIndex(RosPackageIndex):
+    """Counting how many times ROS_PACKAGE_PATH is actually scanned"""
+    scans = 0
+
+    def _scan(self, roots):
+        CountingPackageIndex.scans += 1
+        return super(CountingPackageIndex, self)._scan(roots)
+
+
+class TestRosPackageIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.distro = tempfile.mkdtemp('rosimport_tests_distro')
+        self.indexdir = tempfile.mkdtemp('rosimport_tests_index')
+        self.index_path = os.path.join(self.indexdir, 'index.json')
+        os.makedirs(os.path.join(self.distro, 'test_index_msgs', 'msg'))
+        os.makedirs(os.path.join(self.distro, 'test_index_nomsgs'))
+        CountingPackageIndex.scans = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.distro, ignore_errors=True)
+        shutil.rmtree(self.indexdir, ignore_errors=True)
+
+    def test_index_lazy_and_persisted(self):
+        index = CountingPackageIndex([self.distro], index_path=self.index_path)
+        assert CountingPackageIndex.scans == 0
+        assert index.get('test_index_msgs') == {os.path.join(self.distro, 'test_index_msgs', 'msg')}
+        assert index.get('test_index_nomsgs') is None
+        assert CountingPackageIndex.scans == 1
+        assert os.path.exists(self.index_path)
+
+        # another process will reuse the stored index
+        other_index = CountingPackageIndex([self.distro], index_path=self.index_path)
+        assert other_index.get('test_index_msgs') == {os.path.join(self.distro, 'test_index_msgs', 'msg')}
+        assert CountingPackageIndex.scans == 1
+
+    def test_index_invalidated(self):
+        CountingPackageIndex([self.distro], index_path=self.index_path).get('test_index_msgs')
+        os.makedirs(os.path.join(self.distro, 'test_index_other_msgs', 'msg'))
+        # making sure the mtime changes, whatever the filesystem resolution
+        os.utime(self.distro, (0, 0))
+
+        index = CountingPackageIndex([self.distro], index_path=self.index_path)
+        assert index.get('test_index_other_msgs') == {os.path.join(self.distro, 'test_index_other_msgs', 'msg')}
+        assert CountingPackageIndex.scans == 2
+
+    def test_index_invalidated_by_msg_directory(self):
+        CountingPackageIndex([self.distro], index_path=self.index_path).get('test_index_msgs')
+        distro_mtime = os.stat(self.distro).st_mtime
+        os.makedirs(os.path.join(self.distro, 'test_index_nomsgs', 'msg'))
+        # only the package directory changed
+        os.utime(os.path.join(self.distro, 'test_index_nomsgs'), (0, 0))
+        os.utime(self.distro, (distro_mtime, distro_mtime))
+
+        index = CountingPackageIndex([self.distro], index_path=self.index_path)
+        assert index.get('test_index_nomsgs') == {os.path.join(self.distro, 'test_index_nomsgs', 'msg')}
+        assert CountingPackageIndex.scans == 2
+
+    def test_index_record(self):
+        msgdir = os.path.join(self.indexdir, 'test_index_found_msgs', 'msg')
+        os.makedirs(msgdir)
+        with open(os.path.join(msgdir, 'Found.msg'), 'w') as f:
+            f.write('bool found\n')
+
+        CountingPackageIndex([self.distro], index_path=self.index_path).record('test_index_found_msgs', {msgdir})
+        index = CountingPackageIndex([self.distro], index_path=self.index_path)
+        assert index.get('test_index_found_msgs') == {msgdir}
+        assert CountingPackageIndex.scans == 1
@@ -0,0 +1,89 @@
+from __future__ import absolute_import, division, print_function
+
+import collections
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+"""
+Testing the background generation of ROS packages.
+"""
+
+import rosimport
+from rosimport._ros_warm_up import RosWarmUp, discover_rosdef_packages
+from rosimport._rosdef_cache import cached_genros_py
+
+
+class TestRosWarmUp(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp('rosimport_tests_warm_up')
+        self.cachedir = tempfile.mkdtemp('rosimport_tests_cache')
+        for pkg, definition in [
+            ('test_warm_up_a_msgs', 'bool test_bool\n'),
+            ('test_warm_up_b_msgs', 'bool test_bool\n'),
+            ('test_warm_up_c_msgs', 'test_warm_up_b_msgs/TestWarmUp test_b\n'),
+        ]:
+            os.makedirs(os.path.join(self.workspace, pkg, 'msg'))
+            with open(os.path.join(self.workspace, pkg, 'msg', 'TestWarmUp.msg'), 'w') as f:
+                f.write(definition)
+        self.packages = discover_rosdef_packages(python_path=[self.workspace], search_path={})
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace, ignore_errors=True)
+        shutil.rmtree(self.cachedir, ignore_errors=True)
+
+    def test_discover(self):
+        assert list(self.packages) == ['test_warm_up_a_msgs.msg', 'test_warm_up_b_msgs.msg', 'test_warm_up_c_msgs.msg']
+
+    def test_foreground_promotes_dependencies(self):
+        warm_up = RosWarmUp(self.packages, cache_dir=self.cachedir, search_path={})
+        with warm_up.foreground('test_warm_up_c_msgs.msg'):
+            # the imported package is left to the import
+            assert warm_up.pending() == ['test_warm_up_a_msgs.msg', 'test_warm_up_b_msgs.msg']
+        # its dependencies are generated first
+        assert warm_up._next_package()[0] == 'test_warm_up_b_msgs.msg'
+        assert warm_up._next_package()[0] == 'test_warm_up_a_msgs.msg'
+        assert warm_up._next_package() is None
+
+    def test_warm_up_generates(self):
+        search_path = {'test_warm_up_b_msgs': [os.path.join(self.workspace, 'test_warm_up_b_msgs', 'msg')]}
+        warm_up = RosWarmUp(self.packages, cache_dir=self.cachedir, search_path=search_path)
+        warm_up.start()
+        warm_up.join(60)
+        assert not warm_up.is_alive()
+        assert [(r[0], r[3]) for r in warm_up.results] == [(p, None) for p in self.packages]
+        # the imports will find the code in the cache
+        for package, rosdef_files in self.packages.items():
+            assert cached_genros_py(
+                None, 'msg', rosdef_files, package, search_path=search_path, cache_dir=self.cachedir
+            ) is not None
+
+    def test_importer_warm_up(self):
+        cachedir, in_memory = rosimport.ROSMsgLoader.rosimport_cachedir, rosimport.ROSMsgLoader.rosimport_in_memory
+        rosimport.ROSMsgLoader.rosimport_cachedir, rosimport.ROSMsgLoader.rosimport_in_memory = self.cachedir, False
+        sys.path.insert(0, self.workspace)
+        importer = rosimport.RosImporter(warm_up=True)
+        try:
+            with importer:
+                warm_up = importer.warm_up_worker
+                assert warm_up is not None and rosimport.ROSMsgLoader.rosimport_warm_up is warm_up
+                # a nested importer has its own worker, and restores the outer one on exit
+                nested = rosimport.RosImporter(warm_up=True)
+                with nested:
+                    nested_warm_up = nested.warm_up_worker
+                    assert rosimport.ROSMsgLoader.rosimport_warm_up is nested_warm_up is not warm_up
+                assert not nested_warm_up.is_alive()
+                assert rosimport.ROSMsgLoader.rosimport_warm_up is warm_up
+
+                warm_up.join(60)
+                assert set(self.packages) <= set(r[0] for r in warm_up.results)
+                # the worker found the dependencies among the discovered packages, without importing them
+                assert 'test_warm_up_b_msgs.msg' not in sys.modules
+            assert importer.warm_up_worker is None and rosimport.ROSMsgLoader.rosimport_warm_up is None
+            assert not warm_up.is_alive()
+        finally:
+            sys.path.remove(self.workspace)
+            rosimport.ROSMsgLoader.rosimport_cachedir, rosimport.ROSMsgLoader.rosimport_in_memory = cachedir, in_memory
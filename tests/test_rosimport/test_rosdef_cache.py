@@ -0,0 +1,347 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+"""
+Testing the persistent generation cache.
+"""
+
+from rosimport import genrosmsg_py_sources, genrossrv_py_sources
+import rosimport._rosdef_cache
+from rosimport._ros_generator import genmsg
+from rosimport._rosdef_cache import compute_rosdef_keys, cached_genros_py, load_bytecode, write_bytecode, RosdefSpecCache
+from rosimport._rosdef_loader import ROSGeneratedLoader
+from rosimport._utils import fcntl
+
+
+class CountingGenerator(object):
+    """Wrapping a sources generator to record which modules it actually generates"""
+    def __init__(self, generator):
+        self.generator = generator
+        self.generated = []
+
+    def __call__(self, *args, **kwargs):
+        sources = self.generator(*args, **kwargs)
+        self.generated.extend(sorted(sources))
+        return sources
+
+
+class TestRosdefCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp('rosimport_tests_cache')
+        self.rosdefdir = tempfile.mkdtemp('rosimport_tests_rosdefs')
+        os.makedirs(os.path.join(self.rosdefdir, 'msg'))
+        os.makedirs(os.path.join(self.rosdefdir, 'srv'))
+        shutil.copy(os.path.join(os.path.dirname(__file__), 'msg', 'TestMsg.msg'), os.path.join(self.rosdefdir, 'msg'))
+        with open(os.path.join(self.rosdefdir, 'msg', 'TestOtherMsg.msg'), 'w') as f:
+            f.write('int32 test_int\n')
+        shutil.copy(os.path.join(os.path.dirname(__file__), 'srv', 'TestSrv.srv'), os.path.join(self.rosdefdir, 'srv'))
+        self.msg_files = [os.path.join(self.rosdefdir, 'msg', f) for f in ['TestMsg.msg', 'TestOtherMsg.msg']]
+        self.srv_files = [os.path.join(self.rosdefdir, 'srv', 'TestSrv.srv')]
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir, ignore_errors=True)
+        shutil.rmtree(self.rosdefdir, ignore_errors=True)
+
+    def test_keys_are_deterministic(self):
+        keys = compute_rosdef_keys(self.msg_files, 'test_cache_msgs.msg', search_path={})
+        assert set(keys) == {'_TestMsg', '_TestOtherMsg'}
+        assert keys == compute_rosdef_keys(self.msg_files, 'test_cache_msgs.msg', search_path={})
+        # a different package means a different generated code
+        assert keys['_TestMsg'] != compute_rosdef_keys(self.msg_files, 'test_cache_other_msgs.msg', search_path={})['_TestMsg']
+
+    def test_keys_change_with_content(self):
+        keys = compute_rosdef_keys(self.msg_files, 'test_cache_msgs.msg', search_path={})
+        with open(self.msg_files[0], 'a') as f:
+            f.write('\nint32 test_int\n')
+        changed_keys = compute_rosdef_keys(self.msg_files, 'test_cache_msgs.msg', search_path={})
+        assert keys['_TestMsg'] != changed_keys['_TestMsg']
+        assert keys['_TestOtherMsg'] == changed_keys['_TestOtherMsg']
+
+    def test_keys_unresolved_dependency(self):
+        with open(self.msg_files[0], 'a') as f:
+            f.write('\nunknown_msgs/Unknown test_unknown\n')
+        assert compute_rosdef_keys(self.msg_files, 'test_cache_msgs.msg', search_path={}) is None
+
+    def test_cache_hit_skips_generation(self):
+        generator = CountingGenerator(genrosmsg_py_sources)
+        sitedir, generated_msg_code = cached_genros_py(
+            generator, 'msg', self.msg_files, 'test_cache_msgs.msg', search_path={}, cache_dir=self.cachedir
+        )
+        assert sorted(generator.generated) == ['_TestMsg', '_TestOtherMsg', '__init__']
+        assert sitedir.startswith(self.cachedir)
+        assert generated_msg_code == os.path.join(sitedir, 'test_cache_msgs', 'msg', '__init__.py')
+        assert os.path.exists(os.path.join(sitedir, 'test_cache_msgs', 'msg', '_TestMsg.py'))
+
+        cached_sitedir, cached_msg_code = cached_genros_py(
+            generator, 'msg', self.msg_files, 'test_cache_msgs.msg', search_path={}, cache_dir=self.cachedir
+        )
+        assert len(generator.generated) == 3
+        assert (cached_sitedir, cached_msg_code) == (sitedir, generated_msg_code)
+
+    def test_cache_regenerates_changed_module(self):
+        generator = CountingGenerator(genrosmsg_py_sources)
+        sitedir, _ = cached_genros_py(
+            generator, 'msg', self.msg_files, 'test_cache_msgs.msg', search_path={}, cache_dir=self.cachedir
+        )
+        with open(self.msg_files[0], 'a') as f:
+            f.write('\nint32 test_int\n')
+        generator.generated = []
+        changed_sitedir, _ = cached_genros_py(
+            generator, 'msg', self.msg_files, 'test_cache_msgs.msg', search_path={}, cache_dir=self.cachedir
+        )
+        # only the changed module is generated, the set of types did not change
+        assert generator.generated == ['_TestMsg']
+        assert changed_sitedir == sitedir
+        with open(os.path.join(sitedir, 'test_cache_msgs', 'msg', '_TestMsg.py')) as f:
+            assert 'test_int' in f.read()
+
+    def test_cache_per_definitions_directory(self):
+        sitedir, _ = cached_genros_py(
+            genrosmsg_py_sources, 'msg', self.msg_files, 'test_cache_msgs.msg', search_path={}, cache_dir=self.cachedir
+        )
+        # another workspace, with a package of the same name, does not share the generated code
+        other_rosdefdir = tempfile.mkdtemp('rosimport_tests_rosdefs')
+        try:
+            for f in self.msg_files:
+                shutil.copy(f, other_rosdefdir)
+            other_msg_files = [os.path.join(other_rosdefdir, os.path.basename(f)) for f in self.msg_files]
+            other_sitedir, _ = cached_genros_py(
+                genrosmsg_py_sources, 'msg', other_msg_files, 'test_cache_msgs.msg', search_path={},
+                cache_dir=self.cachedir
+            )
+            assert other_sitedir != sitedir
+        finally:
+            shutil.rmtree(other_rosdefdir, ignore_errors=True)
+
+    def test_cache_removed_module(self):
+        generator = CountingGenerator(genrosmsg_py_sources)
+        sitedir, _ = cached_genros_py(
+            generator, 'msg', self.msg_files, 'test_cache_msgs.msg', search_path={}, cache_dir=self.cachedir
+        )
+        generator.generated = []
+        cached_genros_py(
+            generator, 'msg', self.msg_files[:1], 'test_cache_msgs.msg', search_path={}, cache_dir=self.cachedir
+        )
+        # the set of types changed, only __init__ needs to be generated again
+        assert generator.generated == ['__init__']
+        assert not os.path.exists(os.path.join(sitedir, 'test_cache_msgs', 'msg', '_TestOtherMsg.py'))
+
+    def test_cache_lazy(self):
+        generator = CountingGenerator(genrossrv_py_sources)
+        sitedir, _ = cached_genros_py(
+            generator, 'srv', self.srv_files, 'test_cache_srvs.srv', search_path={}, cache_dir=self.cachedir, lazy=True
+        )
+        assert generator.generated == ['__init__']
+        assert not os.path.exists(os.path.join(sitedir, 'test_cache_srvs', 'srv', '_TestSrv.py'))
+        # a missing lazy module is not a cache miss
+        assert cached_genros_py(
+            None, 'srv', self.srv_files, 'test_cache_srvs.srv', search_path={}, cache_dir=self.cachedir, lazy=True
+        ) is not None
+
+    @unittest.skipIf(fcntl is None, "file locks not supported on this platform")
+    def test_cache_concurrent_generation(self):
+        generator = CountingGenerator(genrosmsg_py_sources)
+        results = []
+
+        def generate():
+            results.append(cached_genros_py(
+                generator, 'msg', self.msg_files, 'test_cache_msgs.msg', search_path={}, cache_dir=self.cachedir
+            ))
+        threads = [threading.Thread(target=generate) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # generated once, the others waited for it
+        assert sorted(generator.generated) == ['_TestMsg', '_TestOtherMsg', '__init__']
+        assert len(results) == 4 and len(set(results)) == 1
+        sitedir, _ = results[0]
+        # the package was published from its staging directory
+        assert sorted(f for f in os.listdir(os.path.join(sitedir, 'test_cache_msgs')) if 'staging' in f) == []
+        assert os.path.exists(os.path.join(sitedir, 'test_cache_msgs', 'msg', '_TestMsg.py'))
+
+
+
+class TestRosdefBytecodeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.gendir = tempfile.mkdtemp('rosimport_tests_gen')
+        self.source_path = os.path.join(self.gendir, '_Generated.py')
+        with open(self.source_path, 'w') as f:
+            f.write('answer = 42\n')
+        self.dont_write_bytecode = sys.dont_write_bytecode
+        sys.dont_write_bytecode = False
+
+    def tearDown(self):
+        sys.dont_write_bytecode = self.dont_write_bytecode
+        shutil.rmtree(self.gendir, ignore_errors=True)
+
+    def test_bytecode_roundtrip(self):
+        source = b'answer = 42\n'
+        assert load_bytecode(self.source_path, source) is None
+        write_bytecode(self.source_path, source, compile(source, self.source_path, 'exec'))
+        code = load_bytecode(self.source_path, source)
+        assert code is not None
+        ns = {}
+        exec(code, ns)
+        assert ns['answer'] == 42
+
+        # bytecode is tied to the source it was compiled from
+        assert load_bytecode(self.source_path, b'answer = 7\n') is None
+
+    def test_loader_uses_bytecode(self):
+        loader = ROSGeneratedLoader('_Generated', self.source_path)
+        code = loader.get_code('_Generated')
+        assert load_bytecode(self.source_path, loader.get_data(self.source_path)) is not None
+        assert loader.get_code('_Generated') == code
+
+
+class TestRosdefSpecCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp('rosimport_tests_cache')
+        self.rosdefdir = tempfile.mkdtemp('rosimport_tests_rosdefs')
+        with open(os.path.join(self.rosdefdir, 'TestStamped.msg'), 'w') as f:
+            f.write('Header header\nint32 TEST_CONSTANT=42\nint32 test_int\n')
+        self.msg_file = os.path.join(self.rosdefdir, 'TestStamped.msg')
+        # written a while ago, its mtime can be trusted
+        os.utime(self.msg_file, (time.time() - 60, time.time() - 60))
+        self.search_path = {
+            'std_msgs': [os.path.join(os.path.dirname(os.path.dirname(__file__)), 'rosdeps', 'std_msgs', 'msg')],
+        }
+
+        self.read = []
+        self._read_definition = rosimport._rosdef_cache._read_definition
+
+        def counting_read_definition(file_path):
+            self.read.append(os.path.basename(file_path))
+            return self._read_definition(file_path)
+        rosimport._rosdef_cache._read_definition = counting_read_definition
+
+    def tearDown(self):
+        rosimport._rosdef_cache._read_definition = self._read_definition
+        shutil.rmtree(self.cachedir, ignore_errors=True)
+        shutil.rmtree(self.rosdefdir, ignore_errors=True)
+
+    def load(self, spec_cache):
+        msg_context = spec_cache.msg_context(self.search_path)
+        spec = spec_cache.load_spec(msg_context, self.msg_file, 'test_spec_msgs/TestStamped')
+        genmsg.msg_loader.load_depends(msg_context, spec, self.search_path)
+        return spec, msg_context
+
+    def test_specs_parsed_once(self):
+        spec_cache = RosdefSpecCache(cache_dir=False)
+        spec, msg_context = self.load(spec_cache)
+        assert sorted(self.read) == ['Header.msg', 'TestStamped.msg']
+        assert spec == genmsg.msg_loader.load_msg_from_file(
+            genmsg.msg_loader.MsgContext.create_default(), self.msg_file, 'test_spec_msgs/TestStamped'
+        )
+        assert msg_context.get_registered('std_msgs/Header').text == spec_cache.load_spec(
+            genmsg.msg_loader.MsgContext(), self.search_path['std_msgs'][0] + '/Header.msg', 'std_msgs/Header'
+        ).text
+
+        self.read = []
+        cached_spec, _ = self.load(spec_cache)
+        assert self.read == []
+        assert cached_spec == spec
+
+        # a changed definition is parsed again
+        with open(self.msg_file, 'a') as f:
+            f.write('int32 test_other_int\n')
+        changed_spec, _ = self.load(spec_cache)
+        assert self.read == ['TestStamped.msg']
+        assert changed_spec.names == ['header', 'test_int', 'test_other_int']
+
+    def test_recent_definition_hashed_again(self):
+        spec_cache = RosdefSpecCache(cache_dir=False)
+        definition_hash = spec_cache.definition_hash(self.msg_file)
+        assert spec_cache.definition_hash(self.msg_file) == definition_hash
+        assert self.read == ['TestStamped.msg']
+
+        # changed twice in a row, the same size and mtime, like on a filesystem with a coarse mtime resolution
+        mtime = time.time()
+        with open(self.msg_file, 'w') as f:
+            f.write('Header header\nint32 TEST_CONSTANT=42\nint32 test_one\n')
+        os.utime(self.msg_file, (mtime, mtime))
+        first_hash = spec_cache.definition_hash(self.msg_file)
+        with open(self.msg_file, 'w') as f:
+            f.write('Header header\nint32 TEST_CONSTANT=42\nint32 test_two\n')
+        os.utime(self.msg_file, (mtime, mtime))
+        assert spec_cache.definition_hash(self.msg_file) not in (definition_hash, first_hash)
+
+    def test_specs_persisted(self):
+        spec_cache = RosdefSpecCache(cache_dir=self.cachedir)
+        spec, _ = self.load(spec_cache)
+        spec_cache.store()
+
+        # another process gets the specs from the cache, without reading the definitions
+        self.read = []
+        other_spec, msg_context = self.load(RosdefSpecCache(cache_dir=self.cachedir))
+        assert self.read == []
+        assert other_spec == spec
+        assert other_spec.constants[0].val == 42
+        assert msg_context.is_registered('std_msgs/Header')
+
+    def test_md5_memoized(self):
+        plain_context = genmsg.msg_loader.MsgContext.create_default()
+        plain_spec = genmsg.msg_loader.load_msg_from_file(plain_context, self.msg_file, 'test_spec_msgs/TestStamped')
+        genmsg.msg_loader.load_depends(plain_context, plain_spec, self.search_path)
+        md5 = genmsg.compute_md5(plain_context, plain_spec)
+        full_text = genmsg.compute_full_text(plain_context, plain_spec)
+
+        computed = []
+        compute_md5 = rosimport._rosdef_cache._genmsg_compute_md5
+
+        def counting_compute_md5(msg_context, spec):
+            computed.append(spec.full_name)
+            return compute_md5(msg_context, spec)
+        rosimport._rosdef_cache._genmsg_compute_md5 = counting_compute_md5
+        compute_memoized_md5 = rosimport._rosdef_cache._compute_md5
+        compute_memoized_full_text = rosimport._rosdef_cache._compute_full_text
+        try:
+            spec_cache = RosdefSpecCache(cache_dir=self.cachedir)
+            spec, msg_context = self.load(spec_cache)
+            assert compute_memoized_md5(msg_context, spec) == md5
+            assert compute_memoized_full_text(msg_context, spec) == full_text
+            assert computed == ['test_spec_msgs/TestStamped', 'std_msgs/Header']
+
+            # the same definitions, in another context
+            computed[:] = []
+            spec, msg_context = self.load(spec_cache)
+            assert compute_memoized_md5(msg_context, spec) == md5
+            assert computed == []
+
+            # and in another process
+            spec_cache.store()
+            spec, msg_context = self.load(RosdefSpecCache(cache_dir=self.cachedir))
+            assert compute_memoized_full_text(msg_context, spec) == full_text
+            assert compute_memoized_md5(msg_context, spec) == md5
+            assert computed == []
+
+            # the code generated with a spec cache uses the memo, genmsg itself is unchanged
+            genrosmsg_py_sources(
+                [self.msg_file], 'test_spec_msgs.msg', search_path=dict(self.search_path),
+                spec_cache=RosdefSpecCache(cache_dir=False)
+            )
+            assert computed == ['test_spec_msgs/TestStamped', 'std_msgs/Header']
+            assert genmsg.compute_md5 is genmsg.gentools.compute_md5 is genmsg.gentools.compute_md5_v2
+            assert genmsg.compute_md5(plain_context, plain_spec) == md5
+        finally:
+            rosimport._rosdef_cache._genmsg_compute_md5 = compute_md5
+
+    def test_generated_code_unchanged(self):
+        sources = genrosmsg_py_sources([self.msg_file], 'test_spec_msgs.msg', search_path=dict(self.search_path))
+        cached_sources = genrosmsg_py_sources(
+            [self.msg_file], 'test_spec_msgs.msg', search_path=dict(self.search_path),
+            spec_cache=RosdefSpecCache(cache_dir=False)
+        )
+        assert cached_sources == sources
@@ -0,0 +1,200 @@
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+"""
+Testing ROS loaders directly, without going through the finders.
+"""
+
+try:
+    import builtins
+except ImportError:  # python2
+    import __builtin__ as builtins
+
+import filefinder2.util
+
+from rosimport import ROSMsgLoader, genrosmsg_py_sources, ros_import_search_path
+
+
+class ROSMsgMemoryLoader(ROSMsgLoader):
+    rosimport_in_memory = True
+    rosimport_cachedir = False
+
+
+class ROSMsgCacheLoader(ROSMsgLoader):
+    rosimport_in_memory = False
+
+
+class ROSMsgMemoryCacheLoader(ROSMsgLoader):
+    rosimport_in_memory = True
+    rosimport_cachedir = None
+
+
+@contextlib.contextmanager
+def no_writes():
+    """Fails on any file opened for writing, and any file or directory created, renamed or removed"""
+    def failing(name):
+        def fail(*args, **kwargs):
+            raise AssertionError('{0}{1} in memory'.format(name, args))
+        return fail
+
+    def read_only_open(file, mode='r', *args, **kwargs):
+        if set(mode) & set('wax+'):
+            raise AssertionError('open({0!r}, {1!r}) in memory'.format(file, mode))
+        return builtin_open(file, mode, *args, **kwargs)
+
+    builtin_open = builtins.open
+    functions = dict((name, getattr(os, name)) for name in ['makedirs', 'mkdir', 'rename', 'remove'])
+    builtins.open = read_only_open
+    for name in functions:
+        setattr(os, name, failing(name))
+    try:
+        yield
+    finally:
+        builtins.open = builtin_open
+        for name, function in functions.items():
+            setattr(os, name, function)
+
+
+class TestInMemoryLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.rosdefdir = tempfile.mkdtemp('rosimport_tests_rosdefs')
+        self.msgdir = os.path.join(self.rosdefdir, 'test_memory_msgs', 'msg')
+        os.makedirs(self.msgdir)
+        shutil.copy(os.path.join(os.path.dirname(__file__), 'msg', 'TestMsg.msg'), self.msgdir)
+        sys.path.insert(0, self.rosdefdir)
+
+    def tearDown(self):
+        sys.path.remove(self.rosdefdir)
+        for m in [m for m in sys.modules if m.startswith('test_memory_msgs')]:
+            sys.modules.pop(m)
+        shutil.rmtree(self.rosdefdir, ignore_errors=True)
+
+    def test_generate_sources(self):
+        sources = genrosmsg_py_sources([os.path.join(self.msgdir, 'TestMsg.msg')], 'test_memory_msgs.msg')
+        assert set(sources) == {'__init__', '_TestMsg'}
+        assert "'TestMsg': '_TestMsg'," in sources['__init__']
+        assert 'class TestMsg(genpy.Message):' in sources['_TestMsg']
+
+    def test_generate_sources_lazy(self):
+        sources = genrosmsg_py_sources([os.path.join(self.msgdir, 'TestMsg.msg')], 'test_memory_msgs.msg', lazy=True)
+        assert set(sources) == {'__init__'}
+        assert "'TestMsg': '_TestMsg'," in sources['__init__']
+
+    def load(self, loader_class):
+        loader = loader_class('test_memory_msgs.msg', self.msgdir)
+        spec = filefinder2.util.spec_from_loader('test_memory_msgs.msg', loader)
+        msgs = filefinder2.util.module_from_spec(spec)
+        sys.modules['test_memory_msgs.msg'] = msgs
+        loader.exec_module(msgs)
+        return msgs
+
+    def test_load_in_memory(self):
+        tempdir = tempfile.mkdtemp('rosimport_tests_tempdir')
+        try:
+            ROSMsgMemoryLoader.rosimport_tempdir = tempdir
+            with no_writes():
+                msgs = self.load(ROSMsgMemoryLoader)
+                assert msgs.TestMsg._type == 'test_memory_msgs/TestMsg'
+                assert msgs.TestMsg(test_bool=True).test_bool
+            assert os.listdir(tempdir) == []
+            assert os.listdir(self.msgdir) == ['TestMsg.msg']
+        finally:
+            shutil.rmtree(tempdir, ignore_errors=True)
+
+    def test_load_in_memory_from_cache(self):
+        cachedir = tempfile.mkdtemp('rosimport_tests_cache')
+        dont_write_bytecode, sys.dont_write_bytecode = sys.dont_write_bytecode, False
+        try:
+            ROSMsgCacheLoader.rosimport_cachedir = ROSMsgMemoryCacheLoader.rosimport_cachedir = cachedir
+            assert self.load(ROSMsgCacheLoader).TestMsg._type == 'test_memory_msgs/TestMsg'
+            # the code is found in the cache, without its bytecode
+            assert any(f.endswith('.rosc') for _, _, files in os.walk(cachedir) for f in files)
+            for directory, _, files in os.walk(cachedir):
+                for f in files:
+                    if f.endswith('.rosc'):
+                        os.remove(os.path.join(directory, f))
+            sys.modules.pop('test_memory_msgs.msg._TestMsg', None)
+            with no_writes():
+                msgs = self.load(ROSMsgMemoryCacheLoader)
+                assert msgs.TestMsg._type == 'test_memory_msgs/TestMsg'
+        finally:
+            sys.dont_write_bytecode = dont_write_bytecode
+            ROSMsgMemoryCacheLoader.rosimport_cachedir = None
+            shutil.rmtree(cachedir, ignore_errors=True)
+
+    def test_load_in_memory_index(self):
+        # a dependency found in ROS_PACKAGE_PATH, through a new index
+        rospath = tempfile.mkdtemp('rosimport_tests_rospath')
+        cachedir = tempfile.mkdtemp('rosimport_tests_cache')
+        os.makedirs(os.path.join(rospath, 'test_memory_dep_msgs', 'msg'))
+        with open(os.path.join(rospath, 'test_memory_dep_msgs', 'msg', 'TestDep.msg'), 'w') as f:
+            f.write('int32 test_int\n')
+        with open(os.path.join(self.msgdir, 'TestWithDep.msg'), 'w') as f:
+            f.write('test_memory_dep_msgs/TestDep dep\n')
+        environ = dict(os.environ)
+        index = ros_import_search_path.index
+        packages = index.packages
+        try:
+            os.environ.update(ROS_PACKAGE_PATH=rospath, ROSIMPORT_CACHE_DIR=cachedir)
+            index.packages = None
+            # generating the package resolves its dependencies
+            ROSMsgMemoryCacheLoader('test_memory_msgs.msg', self.msgdir)
+            assert index.get('test_memory_dep_msgs') == {os.path.join(rospath, 'test_memory_dep_msgs', 'msg')}
+            # the index was not stored in the cache
+            assert os.listdir(cachedir) == []
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+            index.packages = packages
+            ros_import_search_path.pop('test_memory_dep_msgs', None)
+            shutil.rmtree(rospath, ignore_errors=True)
+            shutil.rmtree(cachedir, ignore_errors=True)
+
+    @unittest.skipIf(sys.version_info < (3, 5), "lazy module attributes require python 3.5")
+    def test_load_lazily(self):
+        with open(os.path.join(self.msgdir, 'TestOtherMsg.msg'), 'w') as f:
+            f.write('int32 test_int\n')
+        tempdir = tempfile.mkdtemp('rosimport_tests_tempdir')
+        try:
+            ROSMsgMemoryLoader.rosimport_tempdir = tempdir
+            loader = ROSMsgMemoryLoader('test_memory_msgs.msg', self.msgdir)
+            spec = filefinder2.util.spec_from_loader('test_memory_msgs.msg', loader)
+            msgs = filefinder2.util.module_from_spec(spec)
+            sys.modules['test_memory_msgs.msg'] = msgs
+            loader.exec_module(msgs)
+
+            # only the package is loaded, messages are generated when accessed
+            assert sorted(dir(msgs)) == sorted(set(dir(msgs)) | {'TestMsg', 'TestOtherMsg'})
+            assert 'test_memory_msgs.msg._TestMsg' not in sys.modules
+            assert msgs.TestMsg._type == 'test_memory_msgs/TestMsg'
+            assert 'test_memory_msgs.msg._TestMsg' in sys.modules
+            assert 'test_memory_msgs.msg._TestOtherMsg' not in sys.modules
+
+            # the finder of the package is not needed in sys.path_importer_cache
+            sys.path_importer_cache.pop(msgs.__path__[0])
+            assert msgs.TestOtherMsg._type == 'test_memory_msgs/TestOtherMsg'
+        finally:
+            shutil.rmtree(tempdir, ignore_errors=True)
+
+    @unittest.skipIf(sys.version_info < (3, 5), "lazy module attributes require python 3.5")
+    def test_load_lazily_from_cache(self):
+        cachedir = tempfile.mkdtemp('rosimport_tests_cache')
+        try:
+            ROSMsgCacheLoader.rosimport_cachedir = cachedir
+            loader = ROSMsgCacheLoader('test_memory_msgs.msg', self.msgdir)
+            spec = filefinder2.util.spec_from_loader('test_memory_msgs.msg', loader)
+            msgs = filefinder2.util.module_from_spec(spec)
+            sys.modules['test_memory_msgs.msg'] = msgs
+            loader.exec_module(msgs)
+
+            sys.path_importer_cache.pop(msgs.__path__[0], None)
+            assert msgs.TestMsg._type == 'test_memory_msgs/TestMsg'
+        finally:
+            shutil.rmtree(cachedir, ignore_errors=True)
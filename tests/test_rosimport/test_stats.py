@@ -0,0 +1,78 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+import unittest
+
+"""
+Testing rosimport statistics.
+"""
+
+import filefinder2.util
+
+import rosimport
+from rosimport import ROSMsgLoader, ROSPathFinder
+from rosimport._stats import timed
+
+
+class ROSMsgUncachedLoader(ROSMsgLoader):
+    rosimport_cachedir = False
+    rosimport_lazy = False
+
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        rosimport.reset_stats()
+
+    def test_phases_exclusive(self):
+        # a clock we move by hand, so the test does not depend on the machine load
+        clock = [0.0]
+        default_timer, timeit.default_timer = timeit.default_timer, lambda: clock[0]
+        try:
+            with timed('find', 'test_stats_msgs.msg'):
+                clock[0] += 1.0
+                with timed('generate', 'test_stats_msgs'):
+                    clock[0] += 2.0
+                clock[0] += 4.0
+        finally:
+            timeit.default_timer = default_timer
+        times = rosimport.stats()['packages']['test_stats_msgs']
+        assert times['find'] == 5.0
+        assert times['generate'] == 2.0
+        assert times['parse'] == 0.0
+
+    def test_non_ros_imports_not_timed(self):
+        # no directory on sys.path is named like it, this is not a ROS package
+        assert ROSPathFinder.find_spec('test_stats_not_ros', None) is None
+        assert 'test_stats_not_ros' not in rosimport.stats()['packages']
+
+    def test_import_stats(self):
+        rosdefdir = tempfile.mkdtemp('rosimport_tests_rosdefs')
+        tempdir = tempfile.mkdtemp('rosimport_tests_tempdir')
+        msgdir = os.path.join(rosdefdir, 'test_stats_msgs', 'msg')
+        os.makedirs(msgdir)
+        shutil.copy(os.path.join(os.path.dirname(__file__), 'msg', 'TestMsg.msg'), msgdir)
+        try:
+            ROSMsgUncachedLoader.rosimport_tempdir = tempdir
+            loader = ROSMsgUncachedLoader('test_stats_msgs.msg', msgdir)
+            spec = filefinder2.util.spec_from_loader('test_stats_msgs.msg', loader)
+            msgs = filefinder2.util.module_from_spec(spec)
+            sys.modules['test_stats_msgs.msg'] = msgs
+            loader.exec_module(msgs)
+            assert msgs.TestMsg._type == 'test_stats_msgs/TestMsg'
+
+            stats = rosimport.stats()
+            times = stats['packages']['test_stats_msgs']
+            for phase in ['parse', 'generate', 'compile', 'exec']:
+                assert times[phase] > 0, phase
+            assert stats['counters']['generated_modules'] == 1
+            assert stats['counters']['generated_finders_created'] == 1
+        finally:
+            for m in [m for m in sys.modules if m.startswith('test_stats_msgs')]:
+                sys.modules.pop(m)
+            shutil.rmtree(rosdefdir, ignore_errors=True)
+            shutil.rmtree(tempdir, ignore_errors=True)